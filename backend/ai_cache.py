@@ -0,0 +1,154 @@
+"""
+Persistent cache for AI responses
+Entries are keyed on a hash of the full prompt and model, expire after a TTL and are evicted
+least-recently-used once the table grows past its size bound
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+
+from database import SessionLocal, AICacheEntry
+
+AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", "21600"))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "1000"))
+
+
+class AICache:
+    def __init__(self, ttl_seconds: int = AI_CACHE_TTL_SECONDS, max_entries: int = AI_CACHE_MAX_ENTRIES):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "errors": 0, "latency_saved_seconds": 0.0}
+
+    def fingerprint(self, model: str, **inputs) -> str:
+        """Stable hash of everything that shapes the response"""
+        payload = json.dumps({"model": model, **inputs}, sort_keys=True, default=str, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, name: str, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached response for key, or None on a miss, expiry or cache failure"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """Fresh cached responses for any of keys, looked up in one query"""
+        if not keys:
+            return {}
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            entries = (
+                db.query(AICacheEntry)
+                .filter(AICacheEntry.key.in_(keys), AICacheEntry.expires_at > now)
+                .all()
+            )
+            for entry in entries:
+                entry.hits += 1
+                entry.last_accessed_at = now
+            db.commit()
+
+            self._count("hits", len(entries))
+            self._count("misses", len(set(keys)) - len(entries))
+            self._count("latency_saved_seconds", sum(entry.latency_seconds for entry in entries))
+            return {entry.key: entry.response for entry in entries}
+        except Exception as e:
+            # The cache must never take the AI endpoints down with it
+            db.rollback()
+            print(f"AI cache read error: {e}")
+            self._count("errors")
+            self._count("misses", len(set(keys)))
+            return {}
+        finally:
+            db.close()
+
+    def put(self, key: str, kind: str, model: str, response: str, latency_seconds: float):
+        self.put_many(model, [(key, kind, response, latency_seconds)])
+
+    def put_many(self, model: str, entries: List[Tuple[str, str, str, float]]):
+        """Store (key, kind, response, latency_seconds) entries in one transaction"""
+        if not entries:
+            return
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            existing = {
+                entry.key: entry
+                for entry in db.query(AICacheEntry).filter(AICacheEntry.key.in_([e[0] for e in entries]))
+            }
+            for key, kind, response, latency_seconds in entries:
+                entry = existing.get(key)
+                if entry is None:
+                    entry = AICacheEntry(key=key, kind=kind, model=model, hits=0)
+                    db.add(entry)
+                    existing[key] = entry
+                entry.response = response
+                entry.latency_seconds = latency_seconds
+                entry.created_at = now
+                entry.last_accessed_at = now
+                entry.expires_at = now + self.ttl
+            db.flush()
+            self._evict(db, now)
+            db.commit()
+            self._count("stores", len(entries))
+        except Exception as e:
+            db.rollback()
+            print(f"AI cache write error: {e}")
+            self._count("errors")
+        finally:
+            db.close()
+
+    def _evict(self, db, now: datetime):
+        """Drop expired entries, then the least recently used ones beyond max_entries"""
+        db.execute(delete(AICacheEntry).where(AICacheEntry.expires_at <= now))
+        overflow = (db.scalar(select(func.count(AICacheEntry.id))) or 0) - self.max_entries
+        if overflow > 0:
+            stale = (
+                select(AICacheEntry.id)
+                .order_by(AICacheEntry.last_accessed_at, AICacheEntry.id)
+                .limit(overflow)
+                .scalar_subquery()
+            )
+            db.execute(delete(AICacheEntry).where(AICacheEntry.id.in_(stale)))
+
+    def counters(self) -> Dict:
+        """Lookups, stores and errors counted by this process"""
+        with self._lock:
+            return dict(self._stats)
+
+    def stats(self, db) -> Dict:
+        stats = self.counters()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["latency_saved_seconds"] = round(stats["latency_saved_seconds"], 3)
+
+        try:
+            by_kind = dict(
+                db.query(AICacheEntry.kind, func.count(AICacheEntry.id))
+                .filter(AICacheEntry.expires_at > datetime.utcnow())
+                .group_by(AICacheEntry.kind)
+                .all()
+            )
+        except Exception:
+            by_kind = {}
+        stats["entries"] = sum(by_kind.values())
+        stats["entries_by_kind"] = by_kind
+        stats["max_entries"] = self.max_entries
+        stats["ttl_seconds"] = int(self.ttl.total_seconds())
+        return stats
+
+    def clear(self, db) -> int:
+        result = db.execute(delete(AICacheEntry))
+        db.commit()
+        return result.rowcount
+
+
+ai_cache = AICache()
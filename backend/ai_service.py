@@ -1,28 +1,185 @@
 import os
+import re
 import json
-from openai import OpenAI
+import time
+import asyncio
+from openai import AsyncOpenAI
+
+from ai_cache import ai_cache
+from metrics import metrics
+from client_registry import client_registry
+from prompt_compaction import portfolio_prompt_builder, DEFAULT_TOKEN_BUDGET
+from forecasting import collection_forecaster
 
 # the newest OpenAI model is "gpt-5" which was released August 7, 2025.
 # do not change this unless explicitly requested by the user
+AI_MODEL = "gpt-5"
+
+
+AI_TIMEOUT_SECONDS = float(os.environ.get("AI_TIMEOUT_SECONDS", "30"))
+AI_MAX_CONCURRENCY = int(os.environ.get("AI_MAX_CONCURRENCY", "4"))
+# Branches packed into one batch risk-analysis request
+AI_RISK_BATCH_SIZE = int(os.environ.get("AI_RISK_BATCH_SIZE", "20"))
+
+INSIGHTS_SYSTEM_PROMPT = "You are a microfinance analytics expert specializing in branch performance optimization and risk management."
+MOTIVATION_SYSTEM_PROMPT = "You are a motivational coach for microfinance teams in Kenya. Be encouraging, culturally appropriate, and professional."
+RISK_SYSTEM_PROMPT = "You are a risk assessment expert for microfinance institutions."
+
+# Bullets or numbering a model may put in front of a streamed insight line
+_INSIGHT_PREFIX = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+RISK_MAX_TOKENS = 1024
+RISK_BATCH_TOKENS_PER_BRANCH = 400
+# Upper bound on the portfolio section of the predictions prompt, whatever the branch count
+PREDICTION_TOKEN_BUDGET = int(os.environ.get("AI_PREDICTION_TOKEN_BUDGET", str(DEFAULT_TOKEN_BUDGET)))
+
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+RISK_BATCH_SCHEMA = {
+    "name": "branch_risk_profiles",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "additionalProperties": False,
+        "required": ["branches"],
+        "properties": {
+            "branches": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "additionalProperties": False,
+                    "required": ["branch", "risk_score", "risk_level", "risk_factors",
+                                 "mitigation_strategies", "priority_actions"],
+                    "properties": {
+                        "branch": {"type": "string"},
+                        "risk_score": {"type": "integer"},
+                        "risk_level": {"type": "string", "enum": ["low", "medium", "high"]},
+                        "risk_factors": _STRING_LIST,
+                        "mitigation_strategies": _STRING_LIST,
+                        "priority_actions": _STRING_LIST
+                    }
+                }
+            }
+        }
+    }
+}
+
+def _build_openai_client():
+    """Client for the current OPENAI_API_KEY, read at build time so settings updates take effect"""
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    return AsyncOpenAI(
+        api_key=api_key,
+        # Point the client at a local OpenAI-compatible stub server for testing
+        base_url=os.environ.get("OPENAI_BASE_URL") or None,
+        timeout=AI_TIMEOUT_SECONDS,
+        max_retries=1
+    )
 
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+client_registry.register("openai", _build_openai_client, lambda client: client.close())
 
 class AIService:
     def __init__(self):
-        self.client = None
-        if OPENAI_API_KEY:
-            self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self._semaphore = None
+        self._semaphore_loop = None
     
     def is_configured(self):
-        return self.client is not None
+        return client_registry.get("openai") is not None
     
-    def generate_advanced_insights(self, summary_data, branches_data):
-        """Generate comprehensive AI insights from branch performance data"""
-        if not self.is_configured():
-            return self._get_fallback_insights(summary_data, branches_data)
+    def _limiter(self):
+        # Semaphores belong to one event loop; make a fresh one if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+            self._semaphore_loop = loop
+        return self._semaphore
+    
+    async def _stream(self, system_prompt, prompt, max_tokens, timeout=None):
+        """Yield text deltas of a streamed completion, holding a concurrency slot until it ends.
+        
+        The timeout bounds the wait for a slot and each read from the stream.
+        """
+        timeout = timeout or AI_TIMEOUT_SECONDS
+        limiter = self._limiter()
+        try:
+            await asyncio.wait_for(limiter.acquire(), timeout)
+        except TimeoutError:
+            raise TimeoutError(f"AI request timed out after {timeout:g}s waiting for a slot")
+        
+        try:
+            # The lease keeps this client open for the whole stream even if the key is changed meanwhile
+            # Timed until the stream ends, not just until the first chunk
+            with client_registry.lease("openai") as client, metrics.external("openai", "chat_stream"):
+                stream = await client.chat.completions.create(
+                    model=AI_MODEL,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=max_tokens,
+                    stream=True,
+                    timeout=timeout
+                )
+                try:
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+                finally:
+                    await stream.close()
+        finally:
+            limiter.release()
+    
+    def _cache_key(self, system_prompt, prompt, max_tokens, json_response):
+        return ai_cache.fingerprint(
+            AI_MODEL, system=system_prompt, prompt=prompt, max_tokens=max_tokens, json_response=json_response
+        )
+    
+    async def _complete(self, kind, system_prompt, prompt, max_tokens, json_response=False, timeout=None,
+                        cache=True, schema=None):
+        """One chat completion within the concurrency limit; the timeout covers queueing and the request.
+        
+        With cache=True, identical prompts are answered from the response cache until the entry expires.
+        A JSON `schema` asks for structured output instead of a free-form JSON object.
+        """
+        if cache:
+            key = self._cache_key(system_prompt, prompt, max_tokens, json_response)
+            cached = await asyncio.to_thread(ai_cache.get, key)
+            if cached is not None:
+                return cached
         
+        if schema:
+            options = {"response_format": {"type": "json_schema", "json_schema": schema}}
+        elif json_response:
+            options = {"response_format": {"type": "json_object"}}
+        else:
+            options = {}
+        timeout = timeout or AI_TIMEOUT_SECONDS
+        started = time.perf_counter()
         try:
-            prompt = f"""Analyze this microfinance data and provide 6-8 actionable insights:
+            async with asyncio.timeout(timeout):
+                async with self._limiter():
+                    with client_registry.lease("openai") as client, metrics.external("openai", "chat_completion"):
+                        response = await client.chat.completions.create(
+                            model=AI_MODEL,
+                            messages=[
+                                {"role": "system", "content": system_prompt},
+                                {"role": "user", "content": prompt}
+                            ],
+                            max_tokens=max_tokens,
+                            **options
+                        )
+        except TimeoutError:
+            raise TimeoutError(f"AI request timed out after {timeout:g}s")
+        content = response.choices[0].message.content
+        
+        if cache:
+            if json_response or schema:
+                # Never cache a reply the caller will fail to parse
+                json.loads(content)
+            await asyncio.to_thread(ai_cache.put, key, kind, AI_MODEL, content, time.perf_counter() - started)
+        return content
+    
+    def _insights_prompt(self, summary_data, branches_data, output_format):
+        return f"""Analyze this microfinance data and provide 6-8 actionable insights:
 
 Summary:
 - Total Disbursements: KES {summary_data.get('total_disbursements', 0):,.0f}
@@ -43,70 +200,142 @@ Provide specific, actionable insights about:
 5. Financial health indicators
 6. Customer engagement trends
 
-Format as JSON: {{"insights": ["insight1", "insight2", ...]}}"""
-
-            response = self.client.chat.completions.create(
-                model="gpt-5",
-                messages=[
-                    {"role": "system", "content": "You are a microfinance analytics expert specializing in branch performance optimization and risk management."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"},
-                max_tokens=2048
+{output_format}"""
+    
+    async def generate_advanced_insights(self, summary_data, branches_data, timeout=None):
+        """Generate comprehensive AI insights from branch performance data"""
+        if not self.is_configured():
+            return self._get_fallback_insights(summary_data, branches_data)
+        
+        try:
+            prompt = self._insights_prompt(
+                summary_data, branches_data, 'Format as JSON: {"insights": ["insight1", "insight2", ...]}'
+            )
+            content = await self._complete(
+                "insights",
+                INSIGHTS_SYSTEM_PROMPT,
+                prompt,
+                max_tokens=2048,
+                json_response=True,
+                timeout=timeout
             )
             
-            result = json.loads(response.choices[0].message.content)
+            result = json.loads(content)
             return result.get('insights', [])
         
         except Exception as e:
             print(f"AI insight generation error: {e}")
             return self._get_fallback_insights(summary_data, branches_data)
     
-    def predict_collection_trends(self, historical_data):
-        """Predict future collection trends based on historical data"""
+    async def stream_insights(self, summary_data, branches_data, timeout=None):
+        """Yield (event, data) pairs: the fallback insights at once, then AI insights one by one"""
+        yield "fallback", {"insights": self._get_fallback_insights(summary_data, branches_data)}
+        if not self.is_configured():
+            yield "done", {"source": "fallback", "count": 0}
+            return
+        
+        prompt = self._insights_prompt(
+            summary_data, branches_data,
+            "Write each insight on its own line as plain text, with no numbering, bullets or JSON."
+        )
+        key = self._cache_key(INSIGHTS_SYSTEM_PROMPT, prompt, 2048, False)
+        cached = await asyncio.to_thread(ai_cache.get, key)
+        if cached is not None:
+            insights = json.loads(cached)
+            for index, text in enumerate(insights):
+                yield "insight", {"index": index, "text": text}
+            yield "done", {"source": "cache", "count": len(insights)}
+            return
+        
+        insights, buffer = [], ""
+        started = time.perf_counter()
+        try:
+            async for delta in self._stream(INSIGHTS_SYSTEM_PROMPT, prompt, 2048, timeout):
+                buffer += delta
+                *lines, buffer = buffer.split("\n")
+                for line in lines:
+                    text = _INSIGHT_PREFIX.sub("", line).strip()
+                    if text:
+                        yield "insight", {"index": len(insights), "text": text}
+                        insights.append(text)
+            text = _INSIGHT_PREFIX.sub("", buffer).strip()
+            if text:
+                yield "insight", {"index": len(insights), "text": text}
+                insights.append(text)
+        except Exception as e:
+            print(f"AI insight streaming error: {e}")
+            yield "error", {"message": str(e)}
+            yield "done", {"source": "ai" if insights else "fallback", "count": len(insights)}
+            return
+        
+        if insights:
+            await asyncio.to_thread(
+                ai_cache.put, key, "insights_stream", AI_MODEL, json.dumps(insights), time.perf_counter() - started
+            )
+        yield "done", {"source": "ai", "count": len(insights)}
+    
+    def predictions_context(self, historical_data, token_budget=None):
+        """Compact portfolio summary used in place of the raw per-branch data"""
+        return portfolio_prompt_builder.build(historical_data, token_budget or PREDICTION_TOKEN_BUDGET)
+    
+    async def predict_collection_trends(self, forecast, context, timeout=None):
+        """Narrate the local forecast: the numbers come from the forecaster, the model adds risks and recommendations.
+        context is the portfolio summary from predictions_context"""
+        predictions = collection_forecaster.predictions(forecast)
         if not self.is_configured():
-            return self._get_fallback_predictions()
+            return predictions
         
         try:
-            prompt = f"""Based on this historical microfinance data, predict the next 3 months' collection trends:
-
-Historical Data:
-{json.dumps(historical_data, indent=2)}
-
-Provide predictions with:
-1. Expected collection rates for next 3 months
-2. Potential risk areas
-3. Recommended interventions
-4. Confidence levels
-
-Format as JSON: {{"predictions": [{{"month": "Month", "predicted_rate": 0.0, "confidence": 0.0, "risks": [], "recommendations": []}}]}}"""
-
-            response = self.client.chat.completions.create(
-                model="gpt-5",
-                messages=[
-                    {"role": "system", "content": "You are a financial forecasting expert specializing in microfinance trends and risk prediction."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"},
-                max_tokens=2048
+            months = "\n".join(
+                f"{p['month']}|{p['predicted_rate']:.1f}|{p['lower']:.1f}-{p['upper']:.1f}|{p['confidence']:.2f}"
+                for p in predictions
+            )
+            declining = "\n".join(
+                f"{b.branch}|{b.current_rate:.1f}|{b.rate_change:+.1f}"
+                for b in collection_forecaster.declining(forecast).itertuples()
+            ) or "none"
+            prompt = f"""A statistical model has forecast this microfinance portfolio's collection rate for the next 3 months. Explain the forecast; do not change the numbers.
+
+Current Portfolio:
+{context['text']}
+
+Forecast ({forecast['method']}, {forecast['history_months']} months of history, {int(forecast['interval_level'] * 100)}% intervals, current rate {forecast['current_rate']:.1f}):
+month|predicted_rate|interval|confidence
+{months}
+
+Branches projected to decline most:
+branch|current_rate|change
+{declining}
+
+For each forecast month, in order, give:
+1. Potential risk areas
+2. Recommended interventions
+
+Format as JSON: {{"predictions": [{{"month": "Month", "risks": [], "recommendations": []}}]}}"""
+
+            content = await self._complete(
+                "predictions",
+                "You are a financial forecasting expert specializing in microfinance trends and risk prediction.",
+                prompt,
+                max_tokens=2048,
+                json_response=True,
+                timeout=timeout
             )
             
-            result = json.loads(response.choices[0].message.content)
-            return result.get('predictions', [])
+            narrated = json.loads(content).get('predictions', [])
+            for prediction, narration in zip(predictions, narrated):
+                prediction["risks"] = narration.get("risks") or prediction["risks"]
+                prediction["recommendations"] = narration.get("recommendations") or prediction["recommendations"]
+            return predictions
         
         except Exception as e:
             print(f"Prediction error: {e}")
-            return self._get_fallback_predictions()
+            return predictions
     
-    def generate_motivational_message(self, branch_name, performance_data):
-        """Generate personalized motivational message for branch staff"""
-        if not self.is_configured():
-            return self._get_fallback_motivation(branch_name, performance_data)
+    def _motivation_prompt(self, branch_name, performance_data):
+        collection_rate = performance_data.get('collection_rate', 0)
         
-        try:
-            collection_rate = performance_data.get('collection_rate', 0)
-            
-            prompt = f"""Generate a motivational WhatsApp message for {branch_name} microfinance branch.
+        return f"""Generate a motivational WhatsApp message for {branch_name} microfinance branch.
 
 Performance: {collection_rate:.1f}% collection rate
 Customers: {performance_data.get('customer_count', 0)}
@@ -118,29 +347,52 @@ Make it:
 - Actionable with tips
 - Under 150 words
 - Professional but warm"""
-
-            response = self.client.chat.completions.create(
-                model="gpt-5",
-                messages=[
-                    {"role": "system", "content": "You are a motivational coach for microfinance teams in Kenya. Be encouraging, culturally appropriate, and professional."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=512
+    
+    async def generate_motivational_message(self, branch_name, performance_data, timeout=None):
+        """Generate personalized motivational message for branch staff"""
+        if not self.is_configured():
+            return self._get_fallback_motivation(branch_name, performance_data)
+        
+        try:
+            content = await self._complete(
+                "motivation",
+                MOTIVATION_SYSTEM_PROMPT,
+                self._motivation_prompt(branch_name, performance_data),
+                max_tokens=512,
+                timeout=timeout,
+                # Motivation should vary between requests
+                cache=False
             )
             
-            return response.choices[0].message.content
+            return content
         
         except Exception as e:
             print(f"Motivation generation error: {e}")
             return self._get_fallback_motivation(branch_name, performance_data)
     
-    def analyze_risk_profile(self, branch_data):
-        """Analyze risk profile for a branch"""
+    async def stream_motivational_message(self, branch_name, performance_data, timeout=None):
+        """Yield (event, data) pairs with the motivational message token by token"""
         if not self.is_configured():
-            return self._get_fallback_risk_analysis(branch_data)
+            yield "message", {"text": self._get_fallback_motivation(branch_name, performance_data)}
+            yield "done", {"source": "fallback"}
+            return
         
         try:
-            prompt = f"""Analyze the risk profile for this microfinance branch:
+            prompt = self._motivation_prompt(branch_name, performance_data)
+            async for delta in self._stream(MOTIVATION_SYSTEM_PROMPT, prompt, 512, timeout):
+                yield "token", {"text": delta}
+        except Exception as e:
+            print(f"Motivation streaming error: {e}")
+            yield "error", {"message": str(e)}
+            # Replaces whatever was streamed before the failure
+            yield "message", {"text": self._get_fallback_motivation(branch_name, performance_data)}
+            yield "done", {"source": "fallback"}
+            return
+        
+        yield "done", {"source": "ai"}
+    
+    def _risk_prompt(self, branch_data):
+        return f"""Analyze the risk profile for this microfinance branch:
 
 {json.dumps(branch_data, indent=2)}
 
@@ -151,24 +403,121 @@ Provide:
 4. Priority actions
 
 Format as JSON: {{"risk_score": 0, "risk_level": "low/medium/high", "risk_factors": [], "mitigation_strategies": [], "priority_actions": []}}"""
-
-            response = self.client.chat.completions.create(
-                model="gpt-5",
-                messages=[
-                    {"role": "system", "content": "You are a risk assessment expert for microfinance institutions."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"},
-                max_tokens=1024
+    
+    async def analyze_risk_profile(self, branch_data, timeout=None):
+        """Analyze risk profile for a branch"""
+        if not self.is_configured():
+            return self._get_fallback_risk_analysis(branch_data)
+        
+        try:
+            content = await self._complete(
+                "risk_analysis",
+                RISK_SYSTEM_PROMPT,
+                self._risk_prompt(branch_data),
+                max_tokens=RISK_MAX_TOKENS,
+                json_response=True,
+                timeout=timeout
             )
             
-            result = json.loads(response.choices[0].message.content)
+            result = json.loads(content)
             return result
         
         except Exception as e:
             print(f"Risk analysis error: {e}")
             return self._get_fallback_risk_analysis(branch_data)
     
+    async def _analyze_risk_chunk(self, chunk, timeout=None):
+        """One structured-output request covering several branches; returns profiles by branch name"""
+        rows = "\n".join(json.dumps(b, separators=(",", ":")) for b in chunk)
+        prompt = f"""Analyze the risk profile of each microfinance branch below (one JSON object per line):
+
+{rows}
+
+For every branch provide:
+1. Overall risk score (1-10, 10 being highest risk)
+2. Key risk factors
+3. Mitigation strategies
+4. Priority actions
+
+Return one entry per branch in "branches", using the branch name exactly as given."""
+        
+        started = time.perf_counter()
+        content = await self._complete(
+            "risk_analysis_batch",
+            RISK_SYSTEM_PROMPT,
+            prompt,
+            max_tokens=RISK_BATCH_TOKENS_PER_BRANCH * len(chunk),
+            timeout=timeout,
+            cache=False,
+            schema=RISK_BATCH_SCHEMA
+        )
+        latency = (time.perf_counter() - started) / len(chunk)
+        
+        profiles = {}
+        for profile in json.loads(content).get("branches", []):
+            name = profile.pop("branch", None)
+            if name is not None:
+                profiles[name] = profile
+        return profiles, latency
+    
+    async def analyze_risk_profiles(self, branches, chunk_size=None, timeout=None):
+        """Risk profiles for many branches at once.
+        
+        Branches already answered by the cache (from either this or the single-branch path) are
+        skipped; the rest are packed into chunked structured-output requests sent concurrently.
+        Returns {"results": {branch: profile}, ...counts}.
+        """
+        if not self.is_configured():
+            return {
+                "results": {b['branch']: self._get_fallback_risk_analysis(b) for b in branches},
+                "cached": 0, "analyzed": 0, "fallback": len(branches), "chunks": 0
+            }
+        
+        keys = {
+            b['branch']: self._cache_key(RISK_SYSTEM_PROMPT, self._risk_prompt(b), RISK_MAX_TOKENS, True)
+            for b in branches
+        }
+        cached = await asyncio.to_thread(ai_cache.get_many, list(keys.values()))
+        results = {name: json.loads(cached[key]) for name, key in keys.items() if key in cached}
+        
+        pending = [b for b in branches if b['branch'] not in results]
+        chunk_size = chunk_size or AI_RISK_BATCH_SIZE
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        replies = await asyncio.gather(
+            *(self._analyze_risk_chunk(chunk, timeout) for chunk in chunks),
+            return_exceptions=True
+        )
+        
+        analyzed, fallback, entries = 0, 0, []
+        for chunk, reply in zip(chunks, replies):
+            if isinstance(reply, asyncio.CancelledError):
+                raise reply
+            if isinstance(reply, Exception):
+                print(f"Batch risk analysis error: {reply}")
+                profiles, latency = {}, 0.0
+            else:
+                profiles, latency = reply
+            
+            for branch in chunk:
+                profile = profiles.get(branch['branch'])
+                if profile is None:
+                    results[branch['branch']] = self._get_fallback_risk_analysis(branch)
+                    fallback += 1
+                    continue
+                results[branch['branch']] = profile
+                analyzed += 1
+                # Stored under the single-branch key so /api/ai/risk-analysis/{branch} hits it too
+                entries.append((keys[branch['branch']], "risk_analysis", json.dumps(profile), latency))
+        
+        await asyncio.to_thread(ai_cache.put_many, AI_MODEL, entries)
+        return {
+            "results": results,
+            "cached": len(branches) - len(pending),
+            "analyzed": analyzed,
+            "fallback": fallback,
+            "chunks": len(chunks)
+        }
+    
     def _get_fallback_insights(self, summary_data, branches_data):
         """Fallback insights when AI is not available"""
         insights = []
@@ -197,32 +546,6 @@ Format as JSON: {{"risk_score": 0, "risk_level": "low/medium/high", "risk_factor
         
         return insights
     
-    def _get_fallback_predictions(self):
-        """Fallback predictions when AI is not available"""
-        return [
-            {
-                "month": "Next Month",
-                "predicted_rate": 88.5,
-                "confidence": 0.75,
-                "risks": ["Seasonal payment delays", "Economic uncertainty"],
-                "recommendations": ["Increase follow-up calls", "Offer flexible payment plans"]
-            },
-            {
-                "month": "Month 2",
-                "predicted_rate": 89.0,
-                "confidence": 0.70,
-                "risks": ["Market competition"],
-                "recommendations": ["Enhance customer service", "Review interest rates"]
-            },
-            {
-                "month": "Month 3",
-                "predicted_rate": 90.5,
-                "confidence": 0.65,
-                "risks": ["Staff turnover"],
-                "recommendations": ["Staff training programs", "Performance incentives"]
-            }
-        ]
-    
     def _get_fallback_motivation(self, branch_name, performance_data):
         """Fallback motivation when AI is not available"""
         collection_rate = performance_data.get('collection_rate', 0)
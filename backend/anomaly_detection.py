@@ -0,0 +1,368 @@
+"""
+Streaming anomaly detection over branch collections
+Keeps an exponentially weighted mean and variance of every branch's daily collections, updated in O(1)
+per collection, and raises an alert when a closed day deviates sharply from the branch's own baseline.
+With a database, the anomaly job reads each day's totals from the collections table, so it sees uploads
+handled by any worker, and saves the detector's state there for the other workers to serve
+"""
+
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+
+from database import Branch, Collection, DetectorState, ReportRecipient
+from bots.whatsapp_bot import whatsapp_bot
+from bots.telegram_bot import telegram_bot
+from message_queue import message_queue
+
+# Weight of the newest day once a branch is past warm-up; before that the average is plain Welford
+ANOMALY_EWMA_ALPHA = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.1"))
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "3.0"))
+ANOMALY_WARMUP_DAYS = int(os.getenv("ANOMALY_WARMUP_DAYS", "14"))
+ANOMALY_BASELINE_DAYS = int(os.getenv("ANOMALY_BASELINE_DAYS", "90"))
+# The deviation is measured against at least this fraction of the mean, so near-constant series don't alert on noise
+MIN_STD_FRACTION = 0.1
+MAX_ALERT_HISTORY = 1000
+JOB_NAME = "anomaly_alerts"
+
+
+class CollectionAnomalyDetector:
+    def __init__(self, alpha: float = ANOMALY_EWMA_ALPHA, threshold: float = ANOMALY_Z_THRESHOLD,
+                 warmup_days: int = ANOMALY_WARMUP_DAYS):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup_days = warmup_days
+        self._lock = threading.Lock()
+        # Version of the saved state this process last loaded or wrote
+        self._version: Optional[int] = None
+        self._reset()
+
+    def _reset(self):
+        self._index: Dict[str, int] = {}
+        self._names: List[str] = []
+        capacity = 256
+        self._mean = np.zeros(capacity)
+        self._var = np.zeros(capacity)
+        self._days = np.zeros(capacity, dtype=np.int64)
+        self._today = np.zeros(capacity)
+        # Consecutive anomalous days, negative for drops and positive for spikes
+        self._streak = np.zeros(capacity, dtype=np.int64)
+        self._day: Optional[int] = None
+        self._alerts: List[Dict] = []
+        self.late = 0
+        self.bootstrapped = False
+
+    def _slot(self, branch: str) -> int:
+        slot = self._index.get(branch)
+        if slot is None:
+            slot = len(self._names)
+            if slot == len(self._mean):
+                grow = len(self._mean)
+                self._mean, self._var, self._today = (np.concatenate([a, np.zeros(grow)])
+                                                      for a in (self._mean, self._var, self._today))
+                self._days, self._streak = (np.concatenate([a, np.zeros(grow, dtype=np.int64)])
+                                            for a in (self._days, self._streak))
+            self._index[branch] = slot
+            self._names.append(branch)
+        return slot
+
+    def _close_day(self) -> List[Dict]:
+        """Score the open day for every branch against its baseline, then fold it into the baseline"""
+        n = len(self._names)
+        x, mean, var, days = self._today[:n], self._mean[:n], self._var[:n], self._days[:n]
+
+        scale = np.maximum(np.sqrt(var), MIN_STD_FRACTION * mean)
+        z = np.divide(x - mean, scale, out=np.zeros(n), where=scale > 0)
+        flagged = (days >= self.warmup_days) & (np.abs(z) >= self.threshold)
+
+        streak = self._streak[:n]
+        streak[:] = np.where(flagged & (z < 0), np.minimum(streak, 0) - 1,
+                             np.where(flagged, np.maximum(streak, 0) + 1, 0))
+
+        closed = date.fromordinal(self._day)
+        alerts = []
+        for i in np.flatnonzero(flagged):
+            alerts.append({
+                "branch": self._names[i],
+                "date": closed.isoformat(),
+                "direction": "drop" if z[i] < 0 else "spike",
+                "collections": round(float(x[i]), 2),
+                "expected": round(float(mean[i]), 2),
+                "z_score": round(float(z[i]), 2),
+                "consecutive_days": int(abs(streak[i])),
+                "severity": "critical" if z[i] < 0 and x[i] < 0.5 * mean[i] else "warning" if z[i] < 0 else "info",
+            })
+
+        # EWMA update, with Welford's 1/n weights until a branch has 1/alpha days of history
+        days += 1
+        weight = np.maximum(self.alpha, 1.0 / days)
+        diff = x - mean
+        mean += weight * diff
+        var[:] = (1 - weight) * (var + weight * diff ** 2)
+
+        x[:] = 0
+        self._day += 1
+        self._alerts.extend(alerts)
+        del self._alerts[:-MAX_ALERT_HISTORY]
+        return alerts
+
+    def _advance_to(self, ordinal: int) -> List[Dict]:
+        if self._day is None:
+            self._day = ordinal
+            return []
+        alerts = []
+        # Days without a single collection still close, as zeros for every branch
+        while self._day < ordinal:
+            alerts.extend(self._close_day())
+        return alerts
+
+    def observe(self, branch: str, amount: float, day: date) -> List[Dict]:
+        """Add one collection; returns alerts for any days it closes"""
+        with self._lock:
+            ordinal = day.toordinal()
+            if self._day is not None and ordinal < self._day:
+                # Backfilled history for a closed day is left to the next bootstrap
+                self.late += 1
+                return []
+            alerts = self._advance_to(ordinal)
+            slot = self._slot(branch)
+            self._today[slot] += amount
+            return alerts
+
+    def observe_many(self, collections: Iterable[Dict]) -> List[Dict]:
+        """Add (branch, amount, date) collections in date order"""
+        rows = sorted(collections, key=lambda c: c["date"])
+        alerts = []
+        for row in rows:
+            alerts.extend(self.observe(row["branch"], float(row["amount"]), row["date"]))
+        return alerts
+
+    def advance(self, day: Optional[date] = None) -> List[Dict]:
+        """Close every day before day (default today) and return the alerts they raise"""
+        with self._lock:
+            return self._advance_to((day or date.today()).toordinal())
+
+    def _replay(self, collections: pd.DataFrame, start: int, end: int) -> List[Dict]:
+        """Close days start..end-1 from (branch, date, amount) rows in one vectorized pass per day,
+        leaving day end open with its totals so far"""
+        for branch in pd.unique(collections["branch"].astype(str)):
+            self._slot(branch)
+        days = end - start
+        first = pd.Timestamp(date.fromordinal(start))
+        offset = (pd.to_datetime(collections["date"], errors="coerce").dt.normalize() - first).dt.days
+        offset = offset.fillna(-1).to_numpy(dtype=np.int64)
+        slots = pd.Index(self._names).get_indexer(collections["branch"].astype(str))
+        keep = (offset >= 0) & (offset <= days)
+        n = len(self._names)
+        totals = np.bincount(offset[keep] * n + slots[keep],
+                             weights=collections["amount"].to_numpy(dtype=float)[keep],
+                             minlength=(days + 1) * n).reshape(days + 1, n)
+
+        self._day = start
+        alerts = []
+        for day_totals in totals[:-1]:
+            self._today[:n] = day_totals
+            alerts.extend(self._close_day())
+        self._today[:n] = totals[-1]
+        return alerts
+
+    def bootstrap(self, branches: Iterable[str], collections: pd.DataFrame, as_of: Optional[date] = None) -> List[Dict]:
+        """Replay daily totals for the last ANOMALY_BASELINE_DAYS; today's collections so far stay open"""
+        end = (as_of or date.today()).toordinal()
+        with self._lock:
+            self._reset()
+            for branch in branches:
+                self._slot(str(branch))
+            alerts = self._replay(collections, end - ANOMALY_BASELINE_DAYS, end)
+            self.bootstrapped = True
+            return alerts
+
+    def _daily_sql(self, db, since: date) -> pd.DataFrame:
+        day = func.date(Collection.collection_date)
+        return pd.read_sql(
+            select(Branch.name.label("branch"), day.label("date"), func.sum(Collection.amount).label("amount"))
+            .join(Branch, Branch.id == Collection.branch_id)
+            .where(Collection.collection_date >= datetime.combine(since, datetime.min.time()))
+            .group_by(Branch.name, day),
+            db.connection()
+        )
+
+    def bootstrap_sql(self, db, as_of: Optional[date] = None) -> List[Dict]:
+        as_of = as_of or date.today()
+        daily = self._daily_sql(db, as_of - timedelta(days=ANOMALY_BASELINE_DAYS))
+        branches = db.scalars(select(Branch.name).order_by(Branch.name)).all()
+        return self.bootstrap(branches, daily, as_of)
+
+    def advance_sql(self, db, as_of: Optional[date] = None) -> List[Dict]:
+        """Close every finished day from the collections table and reload the open day's running totals"""
+        end = (as_of or date.today()).toordinal()
+        with self._lock:
+            start = self._day
+            daily = self._daily_sql(db, date.fromordinal(start))
+            return self._replay(daily, start, max(start, end))
+
+    def bootstrap_sample(self, data: Dict[str, pd.DataFrame], as_of: Optional[date] = None) -> List[Dict]:
+        collections = data["collections"][["branch", "collection_date", "amount"]]
+        return self.bootstrap(data["branches"]["name"], collections.set_axis(["branch", "date", "amount"], axis=1), as_of)
+
+    def recent_alerts(self, days: int = 7, direction: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            if self._day is None:
+                return []
+            since = date.fromordinal(self._day - days).isoformat()
+            return [
+                a for a in reversed(self._alerts)
+                if a["date"] >= since and (direction is None or a["direction"] == direction)
+            ]
+
+    def status(self, branch: Optional[str] = None) -> List[Dict]:
+        """Baseline, today's running total and its current deviation for each branch"""
+        with self._lock:
+            n = len(self._names)
+            slots = range(n) if branch is None else [self._index[branch]] if branch in self._index else []
+            scale = np.maximum(np.sqrt(self._var[:n]), MIN_STD_FRACTION * self._mean[:n])
+            return [
+                {
+                    "branch": self._names[i],
+                    "baseline_mean": round(float(self._mean[i]), 2),
+                    "baseline_std": round(float(np.sqrt(self._var[i])), 2),
+                    "days_observed": int(self._days[i]),
+                    "today": round(float(self._today[i]), 2),
+                    "streak": int(self._streak[i]),
+                    "z_score_so_far": round(float((self._today[i] - self._mean[i]) / scale[i]), 2) if scale[i] > 0 else 0.0,
+                }
+                for i in slots
+            ]
+
+    def _state(self) -> Dict:
+        n = len(self._names)
+        return {
+            "names": self._names,
+            "mean": self._mean[:n].tolist(),
+            "var": self._var[:n].tolist(),
+            "days": self._days[:n].tolist(),
+            "today": self._today[:n].tolist(),
+            "streak": self._streak[:n].tolist(),
+            "day": self._day,
+            "alerts": self._alerts,
+            "late": self.late,
+            "bootstrapped": self.bootstrapped,
+        }
+
+    def _load(self, state: Dict):
+        self._reset()
+        for name in state["names"]:
+            self._slot(name)
+        n = len(self._names)
+        for array, values in ((self._mean, "mean"), (self._var, "var"), (self._days, "days"),
+                              (self._today, "today"), (self._streak, "streak")):
+            array[:n] = state[values]
+        self._day = state["day"]
+        self._alerts = state["alerts"]
+        self.late = state["late"]
+        self.bootstrapped = state["bootstrapped"]
+
+    def save(self, db):
+        """Store the baselines and alerts so every worker process serves the same ones"""
+        with self._lock:
+            state = json.dumps(self._state())
+        saved = db.query(DetectorState).filter(DetectorState.name == JOB_NAME).first()
+        if saved is None:
+            saved = DetectorState(name=JOB_NAME, version=1, state=state)
+            db.add(saved)
+        else:
+            saved.version = DetectorState.version + 1
+            saved.state = state
+        db.commit()
+        self._version = saved.version
+
+    def refresh(self, db) -> bool:
+        """Load the state last saved by whichever process ran the anomaly job, if it is newer than ours"""
+        version = db.scalar(select(DetectorState.version).where(DetectorState.name == JOB_NAME))
+        if version is None or version == self._version:
+            return False
+        saved = db.execute(
+            select(DetectorState.version, DetectorState.state).where(DetectorState.name == JOB_NAME)
+        ).one()
+        with self._lock:
+            self._load(json.loads(saved.state))
+            self._version = saved.version
+        return True
+
+    def _alert_details(self, alert: Dict) -> Dict:
+        if alert["direction"] == "drop":
+            subject = f"Collections drop at {alert['branch']}"
+            action = "Call the branch manager today and check field officer coverage"
+        else:
+            subject = f"Unusual collections spike at {alert['branch']}"
+            action = "Confirm the entries are genuine and not duplicated uploads"
+        message = (
+            f"{alert['date']}: KES {alert['collections']:,.0f} collected against a usual "
+            f"KES {alert['expected']:,.0f} per day ({alert['z_score']:+.1f} sd)"
+        )
+        if alert["consecutive_days"] > 1:
+            message += f", {alert['consecutive_days']} days running"
+        return {"subject": subject, "title": subject, "message": message, "action": action}
+
+    def dispatch(self, db, alerts: List[Dict]) -> int:
+        """Queue each alert for the branch's report recipients and the portfolio-wide ones"""
+        if not alerts:
+            return 0
+        recipients = db.query(ReportRecipient).filter(ReportRecipient.active.is_(True)).all()
+
+        messages = []
+        for alert in alerts:
+            details = self._alert_details(alert)
+            formatted = {
+                "whatsapp": whatsapp_bot.format_alert("urgent" if alert["severity"] == "critical" else "arrears", details),
+                "telegram": telegram_bot.format_alert(alert["severity"], details),
+            }
+            for recipient in recipients:
+                if recipient.branch not in (None, alert["branch"]):
+                    continue
+                messages.append({
+                    "channel": recipient.channel,
+                    "recipient": recipient.address,
+                    "body": formatted[recipient.channel],
+                    "idempotency_key": f"{JOB_NAME}:{alert['branch']}:{alert['date']}:{recipient.id}",
+                })
+        return len(message_queue.enqueue_many(db, messages)) if messages else 0
+
+
+anomaly_detector = CollectionAnomalyDetector()
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(3)
+    branches = np.array([f"Branch {i}" for i in range(5_000)])
+    detector = CollectionAnomalyDetector()
+    first = date.today() - timedelta(days=30)
+    # Every branch books 8 collections a day
+    per_day = len(branches) * 8
+
+    started = time.perf_counter()
+    alerts = []
+    for offset in range(30):
+        day = first + timedelta(days=offset)
+        names = rng.permutation(np.repeat(branches, 8))
+        amounts = rng.normal(5_000, 500, per_day)
+        if offset == 29:
+            # Branch 7 collapses on the last day
+            amounts[names == "Branch 7"] *= 0.05
+        for name, amount in zip(names.tolist(), amounts.tolist()):
+            alerts.extend(detector.observe(name, amount, day))
+    alerts.extend(detector.advance(first + timedelta(days=30)))
+    elapsed = time.perf_counter() - started
+
+    total = 30 * per_day
+    print(f"{total:,} collections across {len(branches):,} branches in {elapsed:.2f}s "
+          f"({total / elapsed:,.0f} collections/s)")
+    print("Drops on the last day:", [a["branch"] for a in alerts if a["direction"] == "drop" and a["date"] == day.isoformat()])
@@ -1,4 +1,5 @@
 from .whatsapp_bot import whatsapp_bot
 from .telegram_bot import telegram_bot
+from .templates import message_templates
 
-__all__ = ['whatsapp_bot', 'telegram_bot']
+__all__ = ['whatsapp_bot', 'telegram_bot', 'message_templates']
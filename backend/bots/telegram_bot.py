@@ -3,27 +3,70 @@ Enhanced Telegram Bot Integration
 Sends automated rich-formatted notifications and interactive reports via Telegram
 """
 
+import asyncio
 import os
+import time
 from datetime import datetime
 from typing import Dict, List
 from dotenv import load_dotenv
 
+from client_registry import client_registry
+from metrics import metrics
+from .rate_limit import AsyncTokenBucket, backoff_delay
+from .templates import message_templates
+
 load_dotenv()
 
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Telegram allows roughly 30 messages per second per bot across all chats
+TELEGRAM_RATE_PER_SECOND = float(os.getenv("TELEGRAM_RATE_PER_SECOND", "25"))
+TELEGRAM_MAX_CONCURRENCY = int(os.getenv("TELEGRAM_MAX_CONCURRENCY", "16"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
+def _build_telegram_bot():
+    """Bot for the TELEGRAM_BOT_TOKEN in the environment at build time"""
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not bot_token:
+        return None
+    try:
+        from telegram import Bot
+        from telegram.request import HTTPXRequest
+    except ImportError:
+        print("⚠️ python-telegram-bot not installed. Run: pip install python-telegram-bot")
+        return None
+    # One pooled HTTP client shared by every send, sized for the broadcast concurrency
+    return Bot(
+        token=bot_token,
+        request=HTTPXRequest(connection_pool_size=TELEGRAM_MAX_CONCURRENCY, pool_timeout=30.0)
+    )
+
+client_registry.register("telegram", _build_telegram_bot, lambda bot: bot.shutdown())
 
 class TelegramBot:
     def __init__(self):
-        self.configured = TELEGRAM_BOT_TOKEN is not None
-        self.bot_token = TELEGRAM_BOT_TOKEN
-        
-        if self.configured:
-            try:
-                from telegram import Bot
-                self.bot = Bot(token=self.bot_token)
-            except ImportError:
-                print("⚠️ python-telegram-bot not installed. Run: pip install python-telegram-bot")
-                self.configured = False
+        self.rate_limiter = AsyncTokenBucket(TELEGRAM_RATE_PER_SECOND)
+    
+    @property
+    def configured(self) -> bool:
+        return client_registry.get("telegram") is not None
+    
+    async def _send(self, chat_id: str, message: str, parse_mode: str = "Markdown") -> Dict:
+        """Single Bot API call; raises on any Telegram or network error"""
+        with client_registry.lease("telegram") as bot:
+            if bot is None:
+                raise RuntimeError("Telegram bot not configured")
+            with metrics.external("telegram", "send_message"):
+                result = await bot.send_message(
+                    chat_id=chat_id,
+                    text=message,
+                    parse_mode=parse_mode
+                )
+        
+        return {
+            "status": "success",
+            "message_id": result.message_id,
+            "chat_id": chat_id,
+            "timestamp": datetime.now().isoformat()
+        }
     
     async def send_message(self, chat_id: str, message: str, parse_mode: str = "Markdown") -> Dict:
         """Send message to a Telegram chat"""
@@ -34,219 +77,135 @@ class TelegramBot:
             }
         
         try:
-            result = await self.bot.send_message(
-                chat_id=chat_id,
-                text=message,
-                parse_mode=parse_mode
-            )
-            
-            return {
-                "status": "success",
-                "message_id": result.message_id,
-                "chat_id": chat_id,
-                "timestamp": datetime.now().isoformat()
-            }
+            return await self._send(chat_id, message, parse_mode)
         except Exception as e:
             return {
                 "status": "error",
                 "message": str(e)
             }
     
+    def format_daily_summary(self, summary_data: Dict) -> str:
+        """Build the daily summary message with KPIs"""
+        return message_templates.render("daily_summary", "telegram", summary_data)
+    
     async def send_daily_summary(self, chat_id: str, summary_data: Dict) -> Dict:
         """Send beautifully formatted daily summary message with KPIs"""
-        collection_rate = summary_data.get('overall_collection_rate', 0)
-        status_emoji = "🌟" if collection_rate >= 90 else "💪" if collection_rate >= 80 else "⚡"
-        
-        message = f"""
-🏦 *KECHITA MICROFINANCE*
-━━━━━━━━━━━━━━━━━━━━━━━
-
-📅 *Daily Performance Report*
-{datetime.now().strftime('%A, %B %d, %Y')}
-
-📊 *OVERALL PERFORMANCE*
-━━━━━━━━━━━━━━━━━━━━━━━
-💰 *Disbursements:* KES {summary_data.get('total_disbursements', 0):,.0f}
-✅ *Collections:* KES {summary_data.get('total_collections', 0):,.0f}
-⚠️ *Arrears:* KES {summary_data.get('total_arrears', 0):,.0f}
-
-📈 *Collection Rate:* {status_emoji} *{collection_rate:.1f}%*
-
-👥 *Customer Metrics*
-Total Customers: {summary_data.get('total_customers', 0):,}
-Active Branches: {summary_data.get('branch_count', 0)}
-
-━━━━━━━━━━━━━━━━━━━━━━━
-✨ Excellence Through Unity! ✨
-━━━━━━━━━━━━━━━━━━━━━━━
-        """.strip()
-        
-        return await self.send_message(chat_id, message)
+        return await self.send_message(chat_id, self.format_daily_summary(summary_data))
+    
+    def format_branch_performance(self, branch_data: Dict) -> str:
+        """Build the branch-specific performance message"""
+        return message_templates.render("branch_performance", "telegram", branch_data)
     
     async def send_branch_performance(self, chat_id: str, branch_data: Dict) -> Dict:
         """Send branch-specific performance message"""
-        collection_rate = branch_data['collection_rate']
-        
-        if collection_rate >= 90:
-            status = "🌟 EXCELLENT"
-            bar = "█" * 10
-        elif collection_rate >= 80:
-            status = "💪 GOOD"
-            bar = "█" * 8 + "░" * 2
-        elif collection_rate >= 70:
-            status = "⚡ FAIR"
-            bar = "█" * 7 + "░" * 3
-        else:
-            status = "🚨 NEEDS ATTENTION"
-            bar = "█" * int(collection_rate/10) + "░" * (10-int(collection_rate/10))
-        
-        message = f"""
-📍 *{branch_data['branch'].upper()}*
-━━━━━━━━━━━━━━━━━━━━━━━
-📅 {datetime.now().strftime('%B %d, %Y')}
-
-*Performance Status:* {status}
-
-💼 *Financial Metrics*
-━━━━━━━━━━━━━━━━━━━━━━━
-💰 Disbursements: KES {branch_data['total_disbursements']:,.0f}
-✅ Collections: KES {branch_data['total_collections']:,.0f}
-⚠️ Arrears: KES {branch_data['total_arrears']:,.0f}
-
-📊 *Collection Rate*
-{bar} *{collection_rate:.1f}%*
-
-👥 *Customer Base*
-{branch_data['customer_count']:,} active customers
-
-━━━━━━━━━━━━━━━━━━━━━━━
-🎯 Keep striving for excellence!
-━━━━━━━━━━━━━━━━━━━━━━━
-        """.strip()
-        
-        return await self.send_message(chat_id, message)
+        return await self.send_message(chat_id, self.format_branch_performance(branch_data))
+    
+    def format_ai_insights(self, insights: List[str]) -> str:
+        """Build the AI insights message"""
+        return message_templates.render("ai_insights", "telegram", {"insights": insights})
     
     async def send_ai_insights(self, chat_id: str, insights: List[str]) -> Dict:
         """Send AI-generated insights with rich formatting"""
-        insights_text = "\n\n".join([f"{i+1}️⃣ {insight}" for i, insight in enumerate(insights)])
-        
-        message = f"""
-🤖 *AI-POWERED INSIGHTS*
-━━━━━━━━━━━━━━━━━━━━━━━
-📅 {datetime.now().strftime('%B %d, %Y at %I:%M %p')}
-
-*Strategic Recommendations*
-━━━━━━━━━━━━━━━━━━━━━━━
-
-{insights_text}
-
-━━━━━━━━━━━━━━━━━━━━━━━
-💡 Powered by Advanced Analytics
-━━━━━━━━━━━━━━━━━━━━━━━
-        """.strip()
-        
-        return await self.send_message(chat_id, message)
+        return await self.send_message(chat_id, self.format_ai_insights(insights))
+    
+    def format_alert(self, alert_type: str, details: Dict) -> str:
+        """Build a formatted alert"""
+        return message_templates.render("alert", "telegram", {**details, "alert_type": alert_type})
     
     async def send_alert(self, chat_id: str, alert_type: str, details: Dict) -> Dict:
         """Send formatted alerts"""
-        icons = {
-            "critical": "🚨",
-            "warning": "⚠️",
-            "info": "ℹ️",
-            "success": "✅",
-            "achievement": "🏆"
-        }
-        
-        icon = icons.get(alert_type, "📢")
+        return await self.send_message(chat_id, self.format_alert(alert_type, details))
+    
+    async def _send_with_retry(self, chat_id: str, message: str, max_retries: int) -> Dict:
+        """Rate-limited send honouring RetryAfter flood waits and retrying transient network errors"""
+        from telegram.error import BadRequest, NetworkError, RetryAfter
+        
+        attempt = 0
+        flood_waits = 0
+        while True:
+            attempt += 1
+            await self.rate_limiter.acquire()
+            try:
+                result = await self._send(chat_id, message)
+                result.update(attempts=attempt, flood_waits=flood_waits)
+                return result
+            except RetryAfter as e:
+                flood_waits += 1
+                retry_after = e.retry_after
+                seconds = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+                # Flood control applies to the whole bot, so every in-flight send waits
+                self.rate_limiter.pause(seconds)
+                error, retryable = e, True
+            except BadRequest as e:
+                error, retryable = e, False
+            except NetworkError as e:
+                error, retryable = e, True
+            except Exception as e:
+                error, retryable = e, False
+            
+            if not retryable or attempt > max_retries:
+                return {
+                    "status": "error",
+                    "message": str(error),
+                    "chat_id": chat_id,
+                    "attempts": attempt,
+                    "flood_waits": flood_waits,
+                    "retryable": retryable
+                }
+            if not isinstance(error, RetryAfter):
+                await asyncio.sleep(backoff_delay(attempt))
+    
+    async def send_bulk_messages(self, chat_ids: List[str], message: str,
+                                 max_concurrency: int = None, max_retries: int = None,
+                                 messages: List[str] = None) -> List[Dict]:
+        """Send same message to multiple chats concurrently; results come back in chat order.
+        
+        Pass `messages` (parallel to chat_ids) to give each chat its own text.
+        """
+        bodies = messages if messages is not None else [message] * len(chat_ids)
+        if not self.configured:
+            return [await self.send_message(chat_id, body) for chat_id, body in zip(chat_ids, bodies)]
         
-        message = f"""
-{icon} *ALERT: {details.get('title', 'Notification').upper()}* {icon}
-━━━━━━━━━━━━━━━━━━━━━━━
-⏰ {datetime.now().strftime('%B %d, %Y - %I:%M %p')}
-
-*Details:*
-{details.get('message', 'No details provided')}
-
-*Recommended Action:*
-{details.get('action', 'Please review and respond')}
-
-━━━━━━━━━━━━━━━━━━━━━━━
-        """.strip()
+        max_retries = TELEGRAM_MAX_RETRIES if max_retries is None else max_retries
+        semaphore = asyncio.Semaphore(max_concurrency or TELEGRAM_MAX_CONCURRENCY)
         
-        return await self.send_message(chat_id, message)
-    
-    async def send_bulk_messages(self, chat_ids: List[str], message: str) -> List[Dict]:
-        """Send same message to multiple chats"""
-        results = []
-        for chat_id in chat_ids:
-            result = await self.send_message(chat_id, message)
-            results.append(result)
+        async def deliver(chat_id, body):
+            async with semaphore:
+                return await self._send_with_retry(chat_id, body, max_retries)
         
-        return results
+        return await asyncio.gather(*(deliver(chat_id, body) for chat_id, body in zip(chat_ids, bodies)))
+    
+    async def broadcast(self, chat_ids: List[str], message: str, max_concurrency: int = None) -> Dict:
+        """Broadcast to many chats and report throughput and failures"""
+        started = time.perf_counter()
+        results = await self.send_bulk_messages(chat_ids, message, max_concurrency)
+        duration = time.perf_counter() - started
+        
+        sent = sum(1 for r in results if r['status'] == 'success')
+        return {
+            "sent": sent,
+            "failed": len(results) - sent,
+            "flood_waits": sum(r.get('flood_waits', 0) for r in results),
+            "duration_seconds": round(duration, 3),
+            "messages_per_second": round(sent / duration, 2) if duration > 0 else 0,
+            "results": results
+        }
+    
+    def format_weekly_report(self, report_data: Dict) -> str:
+        """Build the comprehensive weekly report"""
+        return message_templates.render("weekly_report", "telegram", report_data)
     
     async def send_weekly_report(self, chat_id: str, report_data: Dict) -> Dict:
         """Send comprehensive weekly report"""
-        message = f"""
-📊 *WEEKLY PERFORMANCE REPORT*
-━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-🏦 *Kechita Microfinance*
-
-📅 *Period:* {report_data.get('week_start', 'N/A')} to {report_data.get('week_end', 'N/A')}
-
-*WEEKLY SUMMARY*
-━━━━━━━━━━━━━━━━━━━━━━━━━━━
-💰 Total Disbursed: KES {report_data.get('total_disbursed', 0):,.0f}
-✅ Total Collected: KES {report_data.get('total_collected', 0):,.0f}
-📈 Average Collection Rate: {report_data.get('avg_rate', 0):.1f}%
-
-*🌟 TOP 3 PERFORMERS*
-━━━━━━━━━━━━━━━━━━━━━━━━━━━
-{report_data.get('top_branches', 'Data processing...')}
-
-*📍 IMPROVEMENT AREAS*
-━━━━━━━━━━━━━━━━━━━━━━━━━━━
-{report_data.get('needs_improvement', 'All branches performing well!')}
-
-*🎯 NEXT WEEK TARGETS*
-━━━━━━━━━━━━━━━━━━━━━━━━━━━
-{report_data.get('targets', 'Maintain current excellence')}
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🚀 Together we achieve more!
-━━━━━━━━━━━━━━━━━━━━━━━━━━━
-        """.strip()
-        
-        return await self.send_message(chat_id, message)
+        return await self.send_message(chat_id, self.format_weekly_report(report_data))
+    
+    def format_motivational_quote(self) -> str:
+        """Build a motivational quote message"""
+        return message_templates.render("motivational", "telegram", {})
     
     async def send_motivational_quote(self, chat_id: str) -> Dict:
         """Send motivational quote to inspire team"""
-        quotes = [
-            "💫 *Success is the sum of small efforts repeated day in and day out.*",
-            "🌟 *Excellence is not a destination; it is a continuous journey.*",
-            "💪 *Your work is to discover your work and then give yourself to it.*",
-            "🎯 *The only way to do great work is to love what you do.*",
-            "✨ *Believe you can and you're halfway there.*",
-            "🏆 *Champions keep playing until they get it right.*",
-            "🚀 *The future depends on what you do today.*",
-            "💡 *Innovation distinguishes between a leader and a follower.*"
-        ]
-        
-        import random
-        quote = random.choice(quotes)
-        
-        message = f"""
-🏦 *KECHITA MICROFINANCE*
-━━━━━━━━━━━━━━━━━━━━━━━
-
-{quote}
-
-━━━━━━━━━━━━━━━━━━━━━━━
-📅 {datetime.now().strftime('%A, %B %d, %Y')}
-━━━━━━━━━━━━━━━━━━━━━━━
-        """.strip()
-        
-        return await self.send_message(chat_id, message)
+        return await self.send_message(chat_id, self.format_motivational_quote())
 
 # Singleton instance
 telegram_bot = TelegramBot()
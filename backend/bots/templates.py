@@ -0,0 +1,536 @@
+"""
+Message templates shared by the messaging bots
+Each layout is compiled once per channel (rule width, escaping rules) and rendered with
+str.format_map; batch rendering shares one timestamp context across every recipient
+"""
+
+import random
+import string
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+RULE_CHAR = "━"
+
+# Characters with meaning in Telegram's (legacy) Markdown parse mode
+TELEGRAM_MARKDOWN_SPECIALS = str.maketrans({c: "\\" + c for c in "_*`["})
+
+
+def escape_telegram_markdown(text: str) -> str:
+    return text.translate(TELEGRAM_MARKDOWN_SPECIALS)
+
+
+def strip_telegram_bold(text: str) -> str:
+    """Legacy Markdown shows escapes inside an entity literally; only the closing '*' needs to go"""
+    return text.replace("*", "")
+
+
+class ChannelStyle:
+    """Per-channel formatting rules applied when a template is compiled and rendered"""
+
+    def __init__(self, name: str, rule_width: int, escape: Callable[[str], str],
+                 escape_in_bold: Callable[[str], str]):
+        self.name = name
+        self.rule_width = rule_width
+        self.escape = escape
+        self.escape_in_bold = escape_in_bold
+
+    def bold(self, text: str) -> str:
+        # Both WhatsApp and Telegram Markdown use single asterisks for bold
+        return f"*{self.escape_in_bold(text)}*"
+
+
+CHANNEL_STYLES = {
+    # WhatsApp has no escape syntax, so values are sent as-is
+    "whatsapp": ChannelStyle("whatsapp", 20, lambda text: text, lambda text: text),
+    "telegram": ChannelStyle("telegram", 23, escape_telegram_markdown, strip_telegram_bold),
+}
+
+
+def timestamp_context(now: Optional[datetime] = None) -> Dict[str, str]:
+    """Every date format the layouts use, computed once per render call or batch"""
+    now = now or datetime.now()
+    return {
+        "day": now.strftime("%A, %B %d, %Y"),
+        "date": now.strftime("%B %d, %Y"),
+        "date_time": now.strftime("%B %d, %Y - %I:%M %p"),
+        "date_at_time": now.strftime("%B %d, %Y at %I:%M %p"),
+    }
+
+
+class CompiledTemplate:
+    def __init__(self, layout: str, style: ChannelStyle, text_fields: Iterable[str], bold_fields: Iterable[str],
+                 defaults: Dict, prepare: Optional[Callable[[Dict], Dict]]):
+        self.layout = layout
+        self.style = style
+        self.text_fields = tuple(text_fields)
+        self.bold_fields = tuple(bold_fields)
+        self.defaults = defaults
+        self.prepare = prepare
+        self.fields = {name for _, name, _, _ in string.Formatter().parse(layout) if name}
+
+    def _values(self, data: Dict, context: Dict) -> Dict:
+        values = {**self.defaults, **context, **data}
+        if self.prepare:
+            values.update(self.prepare(values))
+        for names, escape in ((self.text_fields, self.style.escape), (self.bold_fields, self.style.escape_in_bold)):
+            for name in names:
+                value = values.get(name)
+                if isinstance(value, str):
+                    values[name] = escape(value)
+        return values
+
+    def render(self, data: Dict, context: Optional[Dict] = None) -> str:
+        return self.layout.format_map(self._values(data, context or timestamp_context()))
+
+    def render_batch(self, rows: Iterable[Dict], context: Optional[Dict] = None) -> List[str]:
+        context = context or timestamp_context()
+        layout, values = self.layout, self._values
+        return [layout.format_map(values(row, context)) for row in rows]
+
+
+class MessageTemplate:
+    """A message layout with `{rule}` dividers, format-spec placeholders and optional derived fields.
+
+    `text_fields` are free-text values escaped for the channel; `bold_fields` are free-text values that
+    sit inside a `*...*` entity, where escapes are not processed; `prepare` derives extra fields
+    (status bands, progress bars) from the input row.
+    """
+
+    def __init__(self, layout: str, text_fields: Iterable[str] = (), defaults: Optional[Dict] = None,
+                 prepare: Optional[Callable[[Dict], Dict]] = None, rule_width: Optional[int] = None,
+                 bold_fields: Iterable[str] = ()):
+        self.layout = layout.strip()
+        self.text_fields = tuple(text_fields)
+        self.bold_fields = tuple(bold_fields)
+        self.defaults = defaults or {}
+        self.prepare = prepare
+        self.rule_width = rule_width
+        self._compiled = {}
+
+    def compile(self, style: ChannelStyle) -> CompiledTemplate:
+        compiled = self._compiled.get(style.name)
+        if compiled is None:
+            rule = RULE_CHAR * (self.rule_width or style.rule_width)
+            compiled = CompiledTemplate(
+                self.layout.replace("{rule}", rule), style, self.text_fields, self.bold_fields,
+                self.defaults, self.prepare
+            )
+            self._compiled[style.name] = compiled
+        return compiled
+
+
+def _progress_bar(rate: float) -> str:
+    filled = int(rate / 10)
+    return "█" * filled + "░" * (10 - filled)
+
+
+def _whatsapp_summary_fields(values: Dict) -> Dict:
+    rate = values["overall_collection_rate"]
+    if rate >= 90:
+        status_line = "🌟 EXCELLENT PERFORMANCE! 🌟"
+    elif rate >= 80:
+        status_line = "💪 Keep pushing for 90%+"
+    else:
+        status_line = "⚡ Action needed to improve!"
+    return {"status_line": status_line}
+
+
+def _telegram_summary_fields(values: Dict) -> Dict:
+    rate = values["overall_collection_rate"]
+    return {"status_emoji": "🌟" if rate >= 90 else "💪" if rate >= 80 else "⚡"}
+
+
+def _whatsapp_branch_fields(values: Dict) -> Dict:
+    rate = values["collection_rate"]
+    if rate >= 90:
+        emoji, performance_msg, action = "🌟", "OUTSTANDING PERFORMANCE!", "You're setting the standard! Keep it up! 🎊"
+    elif rate >= 80:
+        emoji, performance_msg, action = "💪", "GREAT WORK!", "Just a little more to reach excellence (90%+)!"
+    else:
+        emoji, performance_msg, action = "⚡", "ACTION NEEDED", "Focus on collections - you can do this! 💪"
+    return {
+        "emoji": emoji,
+        "performance_msg": performance_msg,
+        "action": action,
+        "branch_upper": values["branch"].upper(),
+        "bar": _progress_bar(rate),
+    }
+
+
+def _telegram_branch_fields(values: Dict) -> Dict:
+    rate = values["collection_rate"]
+    if rate >= 90:
+        status, bar = "🌟 EXCELLENT", "█" * 10
+    elif rate >= 80:
+        status, bar = "💪 GOOD", "█" * 8 + "░" * 2
+    elif rate >= 70:
+        status, bar = "⚡ FAIR", "█" * 7 + "░" * 3
+    else:
+        status, bar = "🚨 NEEDS ATTENTION", _progress_bar(rate)
+    return {"status": status, "bar": bar, "branch_upper": values["branch"].upper()}
+
+
+WHATSAPP_QUOTES = [
+    "💫 Every customer you serve is a life you impact!",
+    "🌟 Your dedication makes dreams come true!",
+    "💪 Together we build stronger communities!",
+    "🎯 Excellence is not an act, it's a habit!",
+    "✨ Your work today shapes tomorrow's success!",
+    "🏆 Champions are made through consistent effort!",
+    "🚀 Push boundaries, exceed expectations!",
+    "💡 Innovation starts with you!",
+]
+
+TELEGRAM_QUOTES = [
+    "💫 *Success is the sum of small efforts repeated day in and day out.*",
+    "🌟 *Excellence is not a destination; it is a continuous journey.*",
+    "💪 *Your work is to discover your work and then give yourself to it.*",
+    "🎯 *The only way to do great work is to love what you do.*",
+    "✨ *Believe you can and you're halfway there.*",
+    "🏆 *Champions keep playing until they get it right.*",
+    "🚀 *The future depends on what you do today.*",
+    "💡 *Innovation distinguishes between a leader and a follower.*",
+]
+
+WHATSAPP_ALERT_ICONS = {"arrears": "⚠️", "target": "🎯", "achievement": "🏆", "urgent": "🚨"}
+TELEGRAM_ALERT_ICONS = {"critical": "🚨", "warning": "⚠️", "info": "ℹ️", "success": "✅", "achievement": "🏆"}
+
+
+TEMPLATES = {
+    "daily_summary": {
+        "whatsapp": MessageTemplate("""
+🏦 *KECHITA MICROFINANCE*
+{rule}
+📅 Daily Performance Report
+{day}
+
+📊 *OVERALL PERFORMANCE*
+{rule}
+💰 *Disbursements:* KES {total_disbursements:,.0f}
+✅ *Collections:* KES {total_collections:,.0f}
+⚠️ *Arrears:* KES {total_arrears:,.0f}
+
+📈 *COLLECTION RATE*
+{rule}
+🎯 *{overall_collection_rate:.1f}%*
+
+{status_line}
+
+👥 *CUSTOMER BASE*
+{rule}
+Total Customers: {total_customers:,}
+Active Branches: {branch_count}
+
+{rule}
+✨ Together we achieve more!
+{rule}
+""",
+            defaults={"total_disbursements": 0, "total_collections": 0, "total_arrears": 0,
+                      "overall_collection_rate": 0, "total_customers": 0, "branch_count": 0},
+            prepare=_whatsapp_summary_fields),
+        "telegram": MessageTemplate("""
+🏦 *KECHITA MICROFINANCE*
+{rule}
+
+📅 *Daily Performance Report*
+{day}
+
+📊 *OVERALL PERFORMANCE*
+{rule}
+💰 *Disbursements:* KES {total_disbursements:,.0f}
+✅ *Collections:* KES {total_collections:,.0f}
+⚠️ *Arrears:* KES {total_arrears:,.0f}
+
+📈 *Collection Rate:* {status_emoji} *{overall_collection_rate:.1f}%*
+
+👥 *Customer Metrics*
+Total Customers: {total_customers:,}
+Active Branches: {branch_count}
+
+{rule}
+✨ Excellence Through Unity! ✨
+{rule}
+""",
+            defaults={"total_disbursements": 0, "total_collections": 0, "total_arrears": 0,
+                      "overall_collection_rate": 0, "total_customers": 0, "branch_count": 0},
+            prepare=_telegram_summary_fields),
+    },
+    "branch_performance": {
+        "whatsapp": MessageTemplate("""
+{emoji} *{branch_upper}* {emoji}
+{rule}
+📅 {date}
+
+📊 *PERFORMANCE STATUS*
+{rule}
+{performance_msg}
+
+💰 *DISBURSEMENTS*
+KES {total_disbursements:,.0f}
+
+✅ *COLLECTIONS*
+KES {total_collections:,.0f}
+
+⚠️ *ARREARS*
+KES {total_arrears:,.0f}
+
+📈 *COLLECTION RATE*
+{rule}
+🎯 *{collection_rate:.1f}%*
+
+{bar}
+
+👥 *CUSTOMER COUNT*
+{customer_count:,} active customers
+
+💡 *ACTION ITEM*
+{rule}
+{action}
+
+{rule}
+🏆 Excellence is our standard!
+{rule}
+""",
+            bold_fields=["branch_upper"],
+            prepare=_whatsapp_branch_fields),
+        "telegram": MessageTemplate("""
+📍 *{branch_upper}*
+{rule}
+📅 {date}
+
+*Performance Status:* {status}
+
+💼 *Financial Metrics*
+{rule}
+💰 Disbursements: KES {total_disbursements:,.0f}
+✅ Collections: KES {total_collections:,.0f}
+⚠️ Arrears: KES {total_arrears:,.0f}
+
+📊 *Collection Rate*
+{bar} *{collection_rate:.1f}%*
+
+👥 *Customer Base*
+{customer_count:,} active customers
+
+{rule}
+🎯 Keep striving for excellence!
+{rule}
+""",
+            bold_fields=["branch_upper"],
+            prepare=_telegram_branch_fields),
+    },
+    "motivational": {
+        "whatsapp": MessageTemplate("""
+🏦 *KECHITA MICROFINANCE*
+{rule}
+
+{quote}
+
+{branch_line}
+
+Keep up the amazing work! 💪
+
+{rule}
+{day}
+{rule}
+""",
+            text_fields=["branch_line"],
+            defaults={"branch_name": None},
+            prepare=lambda v: {
+                "quote": random.choice(WHATSAPP_QUOTES),
+                "branch_line": f"📍 {v['branch_name']}" if v["branch_name"] else "",
+            }),
+        "telegram": MessageTemplate("""
+🏦 *KECHITA MICROFINANCE*
+{rule}
+
+{quote}
+
+{rule}
+📅 {day}
+{rule}
+""",
+            prepare=lambda v: {"quote": random.choice(TELEGRAM_QUOTES)}),
+    },
+    "alert": {
+        "whatsapp": MessageTemplate("""
+{icon} *IMPORTANT ALERT* {icon}
+{rule}
+{date_time}
+
+*SUBJECT:* {subject}
+
+*DETAILS:*
+{message}
+
+*ACTION REQUIRED:*
+{action}
+
+{rule}
+📱 Reply or call HQ for support
+{rule}
+""",
+            text_fields=["subject", "message", "action"],
+            defaults={"alert_type": None, "subject": "Notification", "message": "No details provided",
+                      "action": "Review and respond"},
+            prepare=lambda v: {"icon": WHATSAPP_ALERT_ICONS.get(v["alert_type"], "📢")}),
+        "telegram": MessageTemplate("""
+{icon} *ALERT: {title_upper}* {icon}
+{rule}
+⏰ {date_time}
+
+*Details:*
+{message}
+
+*Recommended Action:*
+{action}
+
+{rule}
+""",
+            text_fields=["message", "action"],
+            bold_fields=["title_upper"],
+            defaults={"alert_type": None, "title": "Notification", "message": "No details provided",
+                      "action": "Please review and respond"},
+            prepare=lambda v: {
+                "icon": TELEGRAM_ALERT_ICONS.get(v["alert_type"], "📢"),
+                "title_upper": v["title"].upper(),
+            }),
+    },
+    "ai_insights": {
+        "telegram": MessageTemplate("""
+🤖 *AI-POWERED INSIGHTS*
+{rule}
+📅 {date_at_time}
+
+*Strategic Recommendations*
+{rule}
+
+{insights_text}
+
+{rule}
+💡 Powered by Advanced Analytics
+{rule}
+""",
+            text_fields=["insights_text"],
+            prepare=lambda v: {
+                "insights_text": "\n\n".join(f"{i+1}️⃣ {insight}" for i, insight in enumerate(v["insights"]))
+            }),
+    },
+    "weekly_report": {
+        "whatsapp": MessageTemplate("""
+📊 *WEEKLY PERFORMANCE REPORT*
+{rule}
+📅 Week of {week_start} to {week_end}
+
+🏦 *KECHITA MICROFINANCE*
+
+*WEEKLY HIGHLIGHTS*
+{rule}
+💰 Total Disbursed: KES {total_disbursed:,.0f}
+✅ Total Collected: KES {total_collected:,.0f}
+📈 Collection Rate: {collection_rate:.1f}%
+
+*TOP PERFORMERS* 🌟
+{rule}
+{top_performers}
+
+*AREAS FOR IMPROVEMENT* 💪
+{rule}
+{improvement_areas}
+
+*NEXT WEEK'S TARGETS* 🎯
+{rule}
+{targets}
+
+{rule}
+Let's make next week even better! 🚀
+{rule}
+""",
+            defaults={"week_start": "N/A", "week_end": "N/A", "total_disbursed": 0, "total_collected": 0,
+                      "collection_rate": 0, "top_performers": "Data not available",
+                      "improvement_areas": "Keep up the good work!", "targets": "Maintain excellence"}),
+        "telegram": MessageTemplate("""
+📊 *WEEKLY PERFORMANCE REPORT*
+{rule}
+
+🏦 *Kechita Microfinance*
+
+📅 *Period:* {week_start} to {week_end}
+
+*WEEKLY SUMMARY*
+{rule}
+💰 Total Disbursed: KES {total_disbursed:,.0f}
+✅ Total Collected: KES {total_collected:,.0f}
+📈 Average Collection Rate: {avg_rate:.1f}%
+
+*🌟 TOP 3 PERFORMERS*
+{rule}
+{top_branches}
+
+*📍 IMPROVEMENT AREAS*
+{rule}
+{needs_improvement}
+
+*🎯 NEXT WEEK TARGETS*
+{rule}
+{targets}
+
+{rule}
+🚀 Together we achieve more!
+{rule}
+""",
+            rule_width=27,
+            defaults={"week_start": "N/A", "week_end": "N/A", "total_disbursed": 0, "total_collected": 0,
+                      "avg_rate": 0, "top_branches": "Data processing...",
+                      "needs_improvement": "All branches performing well!", "targets": "Maintain current excellence"}),
+    },
+}
+
+
+class TemplateRenderer:
+    def compiled(self, name: str, channel: str) -> CompiledTemplate:
+        try:
+            template = TEMPLATES[name][channel]
+        except KeyError:
+            raise ValueError(f"No '{name}' template for channel '{channel}'")
+        return template.compile(CHANNEL_STYLES[channel])
+
+    def render(self, name: str, channel: str, data: Dict, now: Optional[datetime] = None) -> str:
+        return self.compiled(name, channel).render(data, timestamp_context(now))
+
+    def render_batch(self, name: str, channel: str, rows: Iterable[Dict], now: Optional[datetime] = None) -> List[str]:
+        """Render one message per row; every row shares the same timestamp context"""
+        return self.compiled(name, channel).render_batch(rows, timestamp_context(now))
+
+
+message_templates = TemplateRenderer()
+
+
+if __name__ == "__main__":
+    # Render throughput for a 10k-recipient branch performance broadcast
+    recipients = 10_000
+    rows = [
+        {
+            "branch": f"Branch {i % 250}",
+            "total_disbursements": 1_000_000 + i * 37.5,
+            "total_collections": 850_000 + i * 21.25,
+            "total_arrears": 150_000 + i * 16.25,
+            "collection_rate": 60 + (i % 40),
+            "customer_count": 100 + i % 500,
+        }
+        for i in range(recipients)
+    ]
+
+    for channel in CHANNEL_STYLES:
+        started = time.perf_counter()
+        for row in rows:
+            message_templates.render("branch_performance", channel, row)
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        message_templates.render_batch("branch_performance", channel, rows)
+        batch = time.perf_counter() - started
+
+        print(f"{channel:>9}: {recipients:,} messages | one-by-one {single:.3f}s "
+              f"({recipients / single:,.0f}/s) | batch {batch:.3f}s ({recipients / batch:,.0f}/s)")
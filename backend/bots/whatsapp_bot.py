@@ -4,27 +4,78 @@ Sends automated rich-formatted messages to staff about KPIs and performance metr
 """
 
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List
 from dotenv import load_dotenv
 
+from client_registry import client_registry
+from metrics import metrics
+from .rate_limit import TokenBucket, backoff_delay, is_retryable_status
+from .templates import message_templates
+
 load_dotenv()
 
-TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER", "whatsapp:+14155238886")
+DEFAULT_WHATSAPP_NUMBER = "whatsapp:+14155238886"
+
+WHATSAPP_MAX_WORKERS = int(os.getenv("WHATSAPP_MAX_WORKERS", "8"))
+WHATSAPP_RATE_PER_SECOND = float(os.getenv("WHATSAPP_RATE_PER_SECOND", "10"))
+WHATSAPP_MAX_RETRIES = int(os.getenv("WHATSAPP_MAX_RETRIES", "3"))
+
+def _build_twilio_client():
+    """Twilio client for the credentials in the environment at build time"""
+    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+    if not (account_sid and auth_token):
+        return None
+    try:
+        from twilio.rest import Client
+    except ImportError:
+        print("⚠️ Twilio not installed. Run: pip install twilio")
+        return None
+    client = Client(account_sid, auth_token)
+    # Point the client at a local fake Twilio server for testing
+    if os.getenv("TWILIO_API_BASE_URL"):
+        client.api.base_url = os.getenv("TWILIO_API_BASE_URL")
+    return client
+
+def _close_twilio_client(client):
+    session = getattr(client.http_client, "session", None)
+    if session is not None:
+        session.close()
+
+client_registry.register("twilio", _build_twilio_client, _close_twilio_client)
 
 class WhatsAppBot:
     def __init__(self):
-        self.configured = TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN
+        self.rate_limiter = TokenBucket(WHATSAPP_RATE_PER_SECOND)
+    
+    @property
+    def configured(self) -> bool:
+        return client_registry.get("twilio") is not None
+    
+    def _create_message(self, to_number: str, message: str) -> Dict:
+        """Single Twilio API call; raises on any provider or network error"""
+        if not to_number.startswith("whatsapp:"):
+            to_number = f"whatsapp:{to_number}"
         
-        if self.configured:
-            try:
-                from twilio.rest import Client
-                self.client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-            except ImportError:
-                print("⚠️ Twilio not installed. Run: pip install twilio")
-                self.configured = False
+        with client_registry.lease("twilio") as client:
+            if client is None:
+                raise RuntimeError("WhatsApp bot not configured")
+            with metrics.external("twilio", "messages_create"):
+                message_obj = client.messages.create(
+                    body=message,
+                    from_=os.getenv("TWILIO_WHATSAPP_NUMBER", DEFAULT_WHATSAPP_NUMBER),
+                    to=to_number
+                )
+        
+        return {
+            "status": "success",
+            "message_sid": message_obj.sid,
+            "to": to_number,
+            "timestamp": datetime.now().isoformat()
+        }
     
     def send_message(self, to_number: str, message: str) -> Dict:
         """Send WhatsApp message to a phone number"""
@@ -35,221 +86,98 @@ class WhatsAppBot:
             }
         
         try:
-            if not to_number.startswith("whatsapp:"):
-                to_number = f"whatsapp:{to_number}"
-            
-            message_obj = self.client.messages.create(
-                body=message,
-                from_=TWILIO_WHATSAPP_NUMBER,
-                to=to_number
-            )
-            
-            return {
-                "status": "success",
-                "message_sid": message_obj.sid,
-                "to": to_number,
-                "timestamp": datetime.now().isoformat()
-            }
+            return self._create_message(to_number, message)
         except Exception as e:
             return {
                 "status": "error",
                 "message": str(e)
             }
     
+    def format_daily_summary(self, summary_data: Dict) -> str:
+        """Build the daily summary message with KPIs"""
+        return message_templates.render("daily_summary", "whatsapp", summary_data)
+    
     def send_daily_summary(self, to_number: str, summary_data: Dict) -> Dict:
         """Send beautifully formatted daily summary message with KPIs"""
-        message = f"""
-🏦 *KECHITA MICROFINANCE*
-━━━━━━━━━━━━━━━━━━━━
-📅 Daily Performance Report
-{datetime.now().strftime('%A, %B %d, %Y')}
-
-📊 *OVERALL PERFORMANCE*
-━━━━━━━━━━━━━━━━━━━━
-💰 *Disbursements:* KES {summary_data.get('total_disbursements', 0):,.0f}
-✅ *Collections:* KES {summary_data.get('total_collections', 0):,.0f}
-⚠️ *Arrears:* KES {summary_data.get('total_arrears', 0):,.0f}
-
-📈 *COLLECTION RATE*
-━━━━━━━━━━━━━━━━━━━━
-🎯 *{summary_data.get('overall_collection_rate', 0):.1f}%*
-
-{'🌟 EXCELLENT PERFORMANCE! 🌟' if summary_data.get('overall_collection_rate', 0) >= 90 else '💪 Keep pushing for 90%+' if summary_data.get('overall_collection_rate', 0) >= 80 else '⚡ Action needed to improve!'}
-
-👥 *CUSTOMER BASE*
-━━━━━━━━━━━━━━━━━━━━
-Total Customers: {summary_data.get('total_customers', 0):,}
-Active Branches: {summary_data.get('branch_count', 0)}
-
-━━━━━━━━━━━━━━━━━━━━
-✨ Together we achieve more!
-━━━━━━━━━━━━━━━━━━━━
-        """.strip()
-        
-        return self.send_message(to_number, message)
+        return self.send_message(to_number, self.format_daily_summary(summary_data))
+    
+    def format_branch_performance(self, branch_data: Dict) -> str:
+        """Format branch-specific performance message with motivational content"""
+        return message_templates.render("branch_performance", "whatsapp", branch_data)
     
     def send_branch_performance(self, to_number: str, branch_data: Dict) -> Dict:
         """Send branch-specific performance message with motivational content"""
-        collection_rate = branch_data['collection_rate']
-        
-        if collection_rate >= 90:
-            emoji = "🌟"
-            performance_msg = "OUTSTANDING PERFORMANCE!"
-            action = "You're setting the standard! Keep it up! 🎊"
-        elif collection_rate >= 80:
-            emoji = "💪"
-            performance_msg = "GREAT WORK!"
-            action = "Just a little more to reach excellence (90%+)!"
-        else:
-            emoji = "⚡"
-            performance_msg = "ACTION NEEDED"
-            action = "Focus on collections - you can do this! 💪"
-        
-        message = f"""
-{emoji} *{branch_data['branch'].upper()}* {emoji}
-━━━━━━━━━━━━━━━━━━━━
-📅 {datetime.now().strftime('%B %d, %Y')}
-
-📊 *PERFORMANCE STATUS*
-━━━━━━━━━━━━━━━━━━━━
-{performance_msg}
-
-💰 *DISBURSEMENTS*
-KES {branch_data['total_disbursements']:,.0f}
-
-✅ *COLLECTIONS*
-KES {branch_data['total_collections']:,.0f}
-
-⚠️ *ARREARS*
-KES {branch_data['total_arrears']:,.0f}
-
-📈 *COLLECTION RATE*
-━━━━━━━━━━━━━━━━━━━━
-🎯 *{collection_rate:.1f}%*
-
-{'█' * int(collection_rate/10)}{'░' * (10-int(collection_rate/10))}
-
-👥 *CUSTOMER COUNT*
-{branch_data['customer_count']:,} active customers
-
-💡 *ACTION ITEM*
-━━━━━━━━━━━━━━━━━━━━
-{action}
-
-━━━━━━━━━━━━━━━━━━━━
-🏆 Excellence is our standard!
-━━━━━━━━━━━━━━━━━━━━
-        """.strip()
-        
-        return self.send_message(to_number, message)
+        return self.send_message(to_number, self.format_branch_performance(branch_data))
+    
+    def format_motivational_message(self, branch_name: str = None) -> str:
+        """Format motivational message to inspire staff"""
+        return message_templates.render("motivational", "whatsapp", {"branch_name": branch_name})
     
     def send_motivational_message(self, to_number: str, branch_name: str = None) -> Dict:
         """Send motivational message to inspire staff"""
-        messages = [
-            "💫 Every customer you serve is a life you impact!",
-            "🌟 Your dedication makes dreams come true!",
-            "💪 Together we build stronger communities!",
-            "🎯 Excellence is not an act, it's a habit!",
-            "✨ Your work today shapes tomorrow's success!",
-            "🏆 Champions are made through consistent effort!",
-            "🚀 Push boundaries, exceed expectations!",
-            "💡 Innovation starts with you!",
-        ]
-        
-        import random
-        motivational_text = random.choice(messages)
-        
-        message = f"""
-🏦 *KECHITA MICROFINANCE*
-━━━━━━━━━━━━━━━━━━━━
-
-{motivational_text}
-
-{f'📍 {branch_name}' if branch_name else ''}
-
-Keep up the amazing work! 💪
-
-━━━━━━━━━━━━━━━━━━━━
-{datetime.now().strftime('%A, %B %d, %Y')}
-━━━━━━━━━━━━━━━━━━━━
-        """.strip()
-        
-        return self.send_message(to_number, message)
+        return self.send_message(to_number, self.format_motivational_message(branch_name))
+    
+    def format_alert(self, alert_type: str, details: Dict) -> str:
+        """Format urgent alerts for critical situations"""
+        return message_templates.render("alert", "whatsapp", {**details, "alert_type": alert_type})
     
     def send_alert(self, to_number: str, alert_type: str, details: Dict) -> Dict:
         """Send urgent alerts for critical situations"""
-        icons = {
-            "arrears": "⚠️",
-            "target": "🎯",
-            "achievement": "🏆",
-            "urgent": "🚨"
-        }
+        return self.send_message(to_number, self.format_alert(alert_type, details))
+    
+    def _send_with_retry(self, to_number: str, message: str, max_retries: int) -> Dict:
+        """Rate-limited send that retries throttling, 5xx and network errors with jittered backoff"""
+        if not self.configured:
+            return self.send_message(to_number, message)
         
-        icon = icons.get(alert_type, "📢")
+        attempt = 0
+        while True:
+            attempt += 1
+            self.rate_limiter.acquire()
+            try:
+                result = self._create_message(to_number, message)
+                result['attempts'] = attempt
+                return result
+            except Exception as e:
+                status_code = getattr(e, 'status', None)
+                retryable = is_retryable_status(status_code) or isinstance(e, OSError)
+                if not retryable or attempt > max_retries:
+                    return {
+                        "status": "error",
+                        "message": str(e),
+                        "status_code": status_code,
+                        "attempts": attempt,
+                        "retryable": retryable
+                    }
+            
+            time.sleep(backoff_delay(attempt))
+    
+    def send_bulk_messages(self, recipients: List[Dict[str, str]], message: str,
+                           max_workers: int = None, max_retries: int = None) -> List[Dict]:
+        """Send a message to many recipients concurrently within the provider rate limit.
         
-        message = f"""
-{icon} *IMPORTANT ALERT* {icon}
-━━━━━━━━━━━━━━━━━━━━
-{datetime.now().strftime('%B %d, %Y - %I:%M %p')}
-
-*SUBJECT:* {details.get('subject', 'Notification')}
-
-*DETAILS:*
-{details.get('message', 'No details provided')}
-
-*ACTION REQUIRED:*
-{details.get('action', 'Review and respond')}
-
-━━━━━━━━━━━━━━━━━━━━
-📱 Reply or call HQ for support
-━━━━━━━━━━━━━━━━━━━━
-        """.strip()
+        A recipient may carry its own 'message'; results come back in recipient order.
+        """
+        if not recipients:
+            return []
         
-        return self.send_message(to_number, message)
-    
-    def send_bulk_messages(self, recipients: List[Dict[str, str]], message: str) -> List[Dict]:
-        """Send same message to multiple recipients"""
-        results = []
-        for recipient in recipients:
-            result = self.send_message(recipient['phone'], message)
+        max_retries = WHATSAPP_MAX_RETRIES if max_retries is None else max_retries
+        
+        def deliver(recipient):
+            result = self._send_with_retry(recipient['phone'], recipient.get('message', message), max_retries)
             result['recipient'] = recipient.get('name', recipient['phone'])
-            results.append(result)
+            return result
         
-        return results
+        with ThreadPoolExecutor(max_workers=min(max_workers or WHATSAPP_MAX_WORKERS, len(recipients))) as pool:
+            return list(pool.map(deliver, recipients))
+    
+    def format_weekly_report(self, weekly_data: Dict) -> str:
+        """Format comprehensive weekly performance report"""
+        return message_templates.render("weekly_report", "whatsapp", weekly_data)
     
     def send_weekly_report(self, to_number: str, weekly_data: Dict) -> Dict:
         """Send comprehensive weekly performance report"""
-        message = f"""
-📊 *WEEKLY PERFORMANCE REPORT*
-━━━━━━━━━━━━━━━━━━━━
-📅 Week of {weekly_data.get('week_start', 'N/A')} to {weekly_data.get('week_end', 'N/A')}
-
-🏦 *KECHITA MICROFINANCE*
-
-*WEEKLY HIGHLIGHTS*
-━━━━━━━━━━━━━━━━━━━━
-💰 Total Disbursed: KES {weekly_data.get('total_disbursed', 0):,.0f}
-✅ Total Collected: KES {weekly_data.get('total_collected', 0):,.0f}
-📈 Collection Rate: {weekly_data.get('collection_rate', 0):.1f}%
-
-*TOP PERFORMERS* 🌟
-━━━━━━━━━━━━━━━━━━━━
-{weekly_data.get('top_performers', 'Data not available')}
-
-*AREAS FOR IMPROVEMENT* 💪
-━━━━━━━━━━━━━━━━━━━━
-{weekly_data.get('improvement_areas', 'Keep up the good work!')}
-
-*NEXT WEEK'S TARGETS* 🎯
-━━━━━━━━━━━━━━━━━━━━
-{weekly_data.get('targets', 'Maintain excellence')}
-
-━━━━━━━━━━━━━━━━━━━━
-Let's make next week even better! 🚀
-━━━━━━━━━━━━━━━━━━━━
-        """.strip()
-        
-        return self.send_message(to_number, message)
+        return self.send_message(to_number, self.format_weekly_report(weekly_data))
 
 # Singleton instance
 whatsapp_bot = WhatsAppBot()
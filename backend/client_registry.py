@@ -0,0 +1,131 @@
+"""
+Registry of hot-swappable service clients (OpenAI, Twilio, Telegram)
+Callers lease the current client for the duration of a request. A reload builds replacements off the
+request path, swaps them in atomically, and closes each old client once its last in-flight lease ends
+"""
+
+import asyncio
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional
+
+
+class _Slot:
+    __slots__ = ("client", "version", "in_flight", "retired", "created_at")
+
+    def __init__(self, client, version: int):
+        self.client = client
+        self.version = version
+        self.in_flight = 0
+        self.retired = False
+        self.created_at = datetime.now()
+
+
+class ClientRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._factories: Dict[str, tuple] = {}
+        self._current: Dict[str, _Slot] = {}
+        self._draining: Dict[str, list] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing = set()
+
+    def register(self, name: str, factory: Callable, closer: Optional[Callable] = None):
+        """Register a factory returning a client (or None when unconfigured) and build the first one"""
+        self._factories[name] = (factory, closer)
+        self._install(name, self._build(name))
+
+    def _build(self, name: str):
+        factory, _ = self._factories[name]
+        try:
+            return factory()
+        except Exception as e:
+            print(f"⚠️ Could not build {name} client: {e}")
+            return None
+
+    def _install(self, name: str, client):
+        with self._lock:
+            old = self._current.get(name)
+            self._current[name] = _Slot(client, old.version + 1 if old else 1)
+            if old is None:
+                return
+            old.retired = True
+            if old.in_flight:
+                # Requests still running on the old client finish on it; the last one out closes it
+                self._draining.setdefault(name, []).append(old)
+                return
+        self._close(name, old)
+
+    def get(self, name: str):
+        """Current client, or None if the service is not configured"""
+        slot = self._current.get(name)
+        return slot.client if slot else None
+
+    @contextmanager
+    def lease(self, name: str):
+        """Hold the current client for one request so a concurrent swap cannot close it underneath"""
+        with self._lock:
+            slot = self._current.get(name)
+            if slot:
+                slot.in_flight += 1
+        try:
+            yield slot.client if slot else None
+        finally:
+            if slot:
+                with self._lock:
+                    slot.in_flight -= 1
+                    drained = slot.retired and slot.in_flight == 0
+                    if drained:
+                        self._draining[name].remove(slot)
+                if drained:
+                    self._close(name, slot)
+
+    async def reload(self, names: Optional[Iterable[str]] = None) -> Dict:
+        """Rebuild clients in worker threads from the current environment, then swap them in"""
+        self._loop = asyncio.get_running_loop()
+        names = list(names or self._factories)
+        clients = await asyncio.gather(*(asyncio.to_thread(self._build, name) for name in names))
+        for name, client in zip(names, clients):
+            self._install(name, client)
+        return self.status()
+
+    def _close(self, name: str, slot: _Slot):
+        """Release an old client's connection pool, on the event loop that owns it if it is async"""
+        _, closer = self._factories[name]
+        if closer is None or slot.client is None:
+            return
+        try:
+            result = closer(slot.client)
+            if not asyncio.iscoroutine(result):
+                return
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is not None:
+                task = running.create_task(result)
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+            elif self._loop is not None and self._loop.is_running():
+                asyncio.run_coroutine_threadsafe(result, self._loop)
+            else:
+                asyncio.run(result)
+        except Exception as e:
+            print(f"Error closing {name} client: {e}")
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                name: {
+                    "configured": slot.client is not None,
+                    "version": slot.version,
+                    "in_flight": slot.in_flight,
+                    "draining": sum(old.in_flight for old in self._draining.get(name, [])),
+                    "created_at": slot.created_at.isoformat()
+                }
+                for name, slot in self._current.items()
+            }
+
+
+client_registry = ClientRegistry()
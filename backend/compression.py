@@ -0,0 +1,144 @@
+"""
+Response compression middleware (brotli when installed, otherwise gzip)
+Bodies under COMPRESSION_MIN_BYTES and content that is already compressed pass through untouched.
+Streamed responses are compressed chunk by chunk and flushed after each one, so NDJSON rows still
+reach the client as they are produced
+
+    python backend/compression.py                      # bytes on the wire and compression cost per payload
+"""
+
+import os
+import zlib
+from typing import List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    print("⚠️ brotli not installed, responses are gzip-compressed only. Run: pip install brotli")
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+# Fast settings: these are dynamic responses compressed on every request
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+# Already-compressed formats, and event streams whose consumers expect each event the moment it is sent
+SKIP_CONTENT_TYPES = ("application/zip", "application/gzip", "image/", "video/", "audio/", "text/event-stream")
+
+
+class _Encoder:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes, last: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._compressor.process(data)
+            return out + (self._compressor.finish() if last else self._compressor.flush())
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Preferred encoding the client accepts, ignoring q=0 entries"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = negotiate(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        encoder: Optional[_Encoder] = None
+        passthrough = False
+
+        async def wrapped_send(message):
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether the response is worth compressing
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if encoder is None:
+                response_headers: List[Tuple[bytes, bytes]] = list(start.get("headers", []))
+                names = {name.lower(): value for name, value in response_headers}
+                content_type = names.get(b"content-type", b"").decode("latin-1")
+                if (b"content-encoding" in names
+                        or content_type.startswith(SKIP_CONTENT_TYPES)
+                        or (not more and len(body) < self.minimum_size)):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                encoder = _Encoder(encoding)
+                response_headers = [
+                    (name, value) for name, value in response_headers if name.lower() != b"content-length"
+                ]
+                response_headers.append((b"content-encoding", encoding.encode()))
+                vary = names.get(b"vary")
+                if vary is None:
+                    response_headers.append((b"vary", b"Accept-Encoding"))
+                elif b"accept-encoding" not in vary.lower():
+                    response_headers = [(n, v) for n, v in response_headers if n.lower() != b"vary"]
+                    response_headers.append((b"vary", vary + b", Accept-Encoding"))
+                compressed = encoder.chunk(body, last=not more)
+                if not more:
+                    response_headers.append((b"content-length", str(len(compressed)).encode()))
+                await send({**start, "headers": response_headers})
+                await send({"type": "http.response.body", "body": compressed, "more_body": more})
+                return
+            await send({"type": "http.response.body", "body": encoder.chunk(body, last=not more), "more_body": more})
+
+        await self.app(scope, receive, wrapped_send)
+
+
+if __name__ == "__main__":
+    import gzip
+    import time
+    from categorical_encoding import _synthetic_loans, categorical_encoder
+    from fast_json import FrameJSONResponse
+
+    loans = categorical_encoder.encode({"loans": _synthetic_loans(100_000)})["loans"]
+    print(f"min size {COMPRESSION_MIN_BYTES} B, gzip level {GZIP_LEVEL}"
+          + (f", brotli quality {BROTLI_QUALITY}" if brotli else ", brotli not installed"))
+    print(f"{'payload':>16} {'raw KB':>9} {'gzip KB':>8} {'gzip ms':>8} {'br KB':>8} {'br ms':>8}")
+    for label, rows in (("100 loans", 100), ("10k loans", 10_000), ("100k loans", 100_000)):
+        body = FrameJSONResponse({"loans": loans.iloc[:rows], "total": rows}).body
+        row = f"{label:>16} {len(body) / 1024:>9.0f}"
+        for name in ("gzip", "br"):
+            if name == "br" and brotli is None:
+                row += f" {'-':>8} {'-':>8}"
+                continue
+            started = time.perf_counter()
+            size = len(_Encoder(name).chunk(body, last=True))
+            row += f" {size / 1024:>8.0f} {(time.perf_counter() - started) * 1000:>8.1f}"
+        print(row)
+    assert gzip.decompress(_Encoder("gzip").chunk(body, last=True)) == body
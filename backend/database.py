@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -6,7 +6,10 @@ import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./kechita.db")
 
-engine = create_engine(DATABASE_URL, echo=True)
+# Logging every statement is costly under load; per-request query counts and timings are on /metrics
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
+
+engine = create_engine(DATABASE_URL, echo=SQL_ECHO)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -36,7 +39,7 @@ class Customer(Base):
     customer_id = Column(String(50), unique=True, nullable=False, index=True)
     name = Column(String(255), nullable=False)
     phone = Column(String(20), nullable=True)
-    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=False)
+    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -47,14 +50,14 @@ class Loan(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     loan_id = Column(String(50), unique=True, nullable=False, index=True)
-    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
-    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=False)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False, index=True)
+    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=False, index=True)
     disbursement_amount = Column(Float, nullable=False)
     disbursement_date = Column(DateTime, nullable=False)
-    due_date = Column(DateTime, nullable=True)
+    due_date = Column(DateTime, nullable=True, index=True)
     status = Column(String(50), default="active")
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     customer = relationship("Customer", back_populates="loans")
     branch = relationship("Branch", back_populates="loans")
@@ -64,15 +67,91 @@ class Collection(Base):
     __tablename__ = "collections"
     
     id = Column(Integer, primary_key=True, index=True)
-    loan_id = Column(Integer, ForeignKey("loans.id"), nullable=False)
-    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=False)
+    loan_id = Column(Integer, ForeignKey("loans.id"), nullable=False, index=True)
+    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=False, index=True)
     amount = Column(Float, nullable=False)
     collection_date = Column(DateTime, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     loan = relationship("Loan", back_populates="collections")
     branch = relationship("Branch", back_populates="collections")
 
+class Installment(Base):
+    __tablename__ = "installments"
+    __table_args__ = (UniqueConstraint("loan_id", "installment_number"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    loan_id = Column(Integer, ForeignKey("loans.id"), nullable=False, index=True)
+    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=False, index=True)
+    installment_number = Column(Integer, nullable=False)
+    due_date = Column(DateTime, nullable=False, index=True)
+    amount_due = Column(Float, nullable=False)
+    amount_paid = Column(Float, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class OutboundMessage(Base):
+    __tablename__ = "outbound_messages"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    channel = Column(String(20), nullable=False)
+    recipient = Column(String(100), nullable=False)
+    body = Column(Text, nullable=False)
+    idempotency_key = Column(String(255), unique=True, nullable=False, index=True)
+    status = Column(String(20), nullable=False, default="pending", index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, index=True)
+    claimed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    provider_message_id = Column(String(100), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+class ReportRecipient(Base):
+    __tablename__ = "report_recipients"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(255), nullable=True)
+    channel = Column(String(20), nullable=False)
+    address = Column(String(100), nullable=False)
+    # Branch name for branch managers; recipients without a branch get the portfolio summary
+    branch = Column(String(255), nullable=True, index=True)
+    active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (UniqueConstraint("channel", "address", "branch"),)
+
+class AICacheEntry(Base):
+    __tablename__ = "ai_cache"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String(64), unique=True, nullable=False, index=True)
+    kind = Column(String(50), nullable=False)
+    model = Column(String(50), nullable=False)
+    response = Column(Text, nullable=False)
+    latency_seconds = Column(Float, nullable=False, default=0)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    last_accessed_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class JobRun(Base):
+    __tablename__ = "job_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), unique=True, nullable=False, index=True)
+    last_run_at = Column(DateTime, nullable=True)
+    last_result = Column(String(255), nullable=True)
+
+class DetectorState(Base):
+    __tablename__ = "detector_states"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), unique=True, nullable=False, index=True)
+    # Bumped on every save, so readers in other worker processes know to reload
+    version = Column(Integer, nullable=False, default=0)
+    state = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
@@ -1,6 +1,7 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from sqlalchemy.orm import Session
@@ -8,16 +9,35 @@ from sqlalchemy import func
 import os
 from dotenv import load_dotenv
 import pandas as pd
-from datetime import datetime
+import numpy as np
+from datetime import date, datetime, timedelta
 import io
+import json
+import asyncio
 
-from database import get_db, Branch, Loan, Collection, Customer
+from database import get_db, init_db, engine, SessionLocal, Branch, Loan, Collection, Customer
 from bots.whatsapp_bot import whatsapp_bot
 from bots.telegram_bot import telegram_bot
 from ai_service import ai_service
+from ai_cache import ai_cache
+from message_queue import message_queue, delivery_worker
 from settings_service import settings_service
+from client_registry import client_registry
 from data_generator import get_enhanced_sample_data, generate_realistic_loan_data
 from credit_scoring import credit_scoring_engine
+from loan_status import loan_status_engine
+from parquet_export import parquet_exporter
+from portfolio_aging import portfolio_aging_engine, PAR_THRESHOLDS
+from repayment_schedule import repayment_schedule_engine
+from report_scheduler import daily_report_scheduler
+from forecasting import collection_forecaster
+from anomaly_detection import anomaly_detector
+from shared_dataset import shared_dataset, SHARED_DATASET_ENV
+from categorical_encoding import categorical_encoder
+from fast_json import FrameJSONResponse, iter_ndjson
+from compression import CompressionMiddleware
+from metrics import metrics, MetricsMiddleware
+from ranking import ranking_engine, BRANCH_METRICS, CUSTOMER_METRICS, LOAN_METRICS
 
 load_dotenv()
 
@@ -39,6 +59,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Large JSON bodies and NDJSON streams are gzip/brotli-encoded for clients that accept it
+app.add_middleware(CompressionMiddleware)
+# Outermost, so latency covers compression and response sizes are the bytes actually sent
+app.add_middleware(MetricsMiddleware)
+metrics.instrument_engine(engine)
+metrics.add_source(lambda: {
+    f"kechita_ai_cache_{name}_total": ("counter", f"AI response cache {name.replace('_', ' ')}", value)
+    for name, value in ai_cache.counters().items()
+})
 
 class LoanData(BaseModel):
     branch: str
@@ -47,6 +76,28 @@ class LoanData(BaseModel):
     arrears: float
     customer_count: int
 
+class BulkRecipient(BaseModel):
+    phone: str
+    name: Optional[str] = None
+    message: Optional[str] = None
+
+class BulkMessageRequest(BaseModel):
+    recipients: List[BulkRecipient]
+    message: str
+
+class ReportRecipientRequest(BaseModel):
+    channel: str
+    address: str
+    name: Optional[str] = None
+    branch: Optional[str] = None
+
+class BatchRiskAnalysisRequest(BaseModel):
+    branches: Optional[List[str]] = None
+
+class TelegramBroadcastRequest(BaseModel):
+    chat_ids: List[str]
+    message: str
+
 class BranchMetrics(BaseModel):
     branch: str
     total_disbursements: float
@@ -55,14 +106,175 @@ class BranchMetrics(BaseModel):
     collection_rate: float
     customer_count: int
 
+BRANCH_METRIC_TYPES = {name: field.annotation for name, field in BranchMetrics.model_fields.items()}
+
 # Enhanced sample data with 100+ branches
 sample_data = get_enhanced_sample_data(num_branches=100)
-enhanced_full_data = generate_realistic_loan_data(num_branches=100)
+if os.getenv(SHARED_DATASET_ENV):
+    # Processes started by serve_production.py map the launcher's shared copy instead of building their own
+    enhanced_full_data = shared_dataset.attach(os.environ[SHARED_DATASET_ENV])
+else:
+    # branch, region, customer and status columns are held as integer codes into shared dictionaries
+    enhanced_full_data = categorical_encoder.encode(generate_realistic_loan_data(num_branches=100))
+
+LOAN_STATUS_INTERVAL_SECONDS = int(os.getenv("LOAN_STATUS_INTERVAL_SECONDS", "3600"))
+REPAYMENT_SCHEDULE_INTERVAL_SECONDS = int(os.getenv("REPAYMENT_SCHEDULE_INTERVAL_SECONDS", "86400"))
+# Local hour after which the daily branch reports go out, and how often to check
+DAILY_REPORT_HOUR = int(os.getenv("DAILY_REPORT_HOUR", "7"))
+DAILY_REPORT_CHECK_SECONDS = int(os.getenv("DAILY_REPORT_CHECK_SECONDS", "300"))
+# How often finished days are scored for collection anomalies, and how far back get_trends looks
+ANOMALY_CHECK_SECONDS = int(os.getenv("ANOMALY_CHECK_SECONDS", "300"))
+ANOMALY_TREND_DAYS = 7
+# How often a pending AI call checks whether its HTTP client is still connected
+DISCONNECT_POLL_SECONDS = 0.5
+# How often each worker checks whether another worker changed the API settings in .env
+SETTINGS_WATCH_SECONDS = float(os.getenv("SETTINGS_WATCH_SECONDS", "5"))
+# The prefork launcher (serve_production.py) turns this off in every worker but one
+RUN_BACKGROUND_JOBS = os.getenv("RUN_BACKGROUND_JOBS", "true").lower() != "false"
 
 def use_database():
     """Check if DATABASE_URL is configured"""
     return os.getenv("DATABASE_URL") is not None
 
+def run_loan_status_job():
+    """Reclassify loan statuses in the in-memory dataset and, if configured, the database"""
+    if os.getenv(SHARED_DATASET_ENV):
+        # serve_production.py classifies the shared dataset once before publishing it; rewriting one
+        # worker's view would make the workers disagree about every loan's status
+        result = {"in_memory": "shared_dataset"}
+    else:
+        result = {
+            "in_memory": loan_status_engine.reclassify_frame(
+                enhanced_full_data["loans"], enhanced_full_data["collections"]
+            )
+        }
+    
+    if use_database():
+        db = SessionLocal()
+        try:
+            result["database"] = loan_status_engine.run(db)
+        except Exception as e:
+            db.rollback()
+            print(f"Loan status job error: {e}")
+            result["database"] = {"error": str(e)}
+        finally:
+            db.close()
+    
+    return result
+
+def run_repayment_schedule_job():
+    """Regenerate installment schedules and re-match collections for all open loans"""
+    if not use_database():
+        return {"database": "not_configured"}
+    
+    db = SessionLocal()
+    try:
+        return repayment_schedule_engine.rebuild(db)
+    except Exception as e:
+        db.rollback()
+        print(f"Repayment schedule job error: {e}")
+        return {"error": str(e)}
+    finally:
+        db.close()
+
+def _branch_metrics(db: Session) -> pd.DataFrame:
+    """Metrics for every branch in one aggregate pass, from the database or the sample data"""
+    try:
+        if use_database():
+            return daily_report_scheduler.branch_metrics_sql(db)
+    except Exception:
+        # Fall back to sample data if database query fails
+        pass
+    return daily_report_scheduler.branch_metrics_sample(sample_data)
+
+def run_daily_reports_job(force: bool = False):
+    """Queue today's branch and summary reports for every recipient in the directory"""
+    db = SessionLocal()
+    try:
+        if not force and not daily_report_scheduler.is_due(db, DAILY_REPORT_HOUR):
+            return {"job": "daily_reports", "status": "not_due"}
+        return daily_report_scheduler.run(db, _branch_metrics(db))
+    except Exception as e:
+        db.rollback()
+        print(f"Daily report job error: {e}")
+        return {"error": str(e)}
+    finally:
+        db.close()
+
+def run_anomaly_job():
+    """Build the collection baselines on first run, then score each day as it closes and queue alerts"""
+    db = SessionLocal()
+    try:
+        # Another process may have run the job since; carry on from where it left off
+        anomaly_detector.refresh(db)
+        if not anomaly_detector.bootstrapped:
+            if use_database():
+                alerts = anomaly_detector.bootstrap_sql(db)
+            else:
+                alerts = anomaly_detector.bootstrap_sample(enhanced_full_data)
+            # Only yesterday's alerts go out; older ones are history the baseline replay rediscovered
+            yesterday = (date.today() - timedelta(days=1)).isoformat()
+            alerts = [a for a in alerts if a["date"] == yesterday]
+        elif use_database():
+            alerts = anomaly_detector.advance_sql(db)
+        else:
+            alerts = anomaly_detector.advance()
+        anomaly_detector.save(db)
+        return {"job": "anomaly_alerts", "alerts": len(alerts), "queued": anomaly_detector.dispatch(db, alerts)}
+    except Exception as e:
+        db.rollback()
+        print(f"Anomaly job error: {e}")
+        return {"error": str(e)}
+    finally:
+        db.close()
+
+def _refresh_anomaly_detector(db: Session):
+    """Pick up the baselines and alerts the anomaly job last saved, whichever worker ran it"""
+    try:
+        anomaly_detector.refresh(db)
+    except Exception:
+        # Serve this worker's copy if the state table is not available
+        db.rollback()
+
+async def _run_periodically(job, interval_seconds: int):
+    while True:
+        await asyncio.to_thread(job)
+        await asyncio.sleep(interval_seconds)
+
+async def _watch_settings():
+    """Rebuild this worker's clients when the settings change, including updates handled by another worker"""
+    seen = settings_service.version
+    while True:
+        await asyncio.sleep(SETTINGS_WATCH_SECONDS)
+        try:
+            await asyncio.to_thread(settings_service.refresh)
+            if settings_service.version != seen:
+                seen = settings_service.version
+                await client_registry.reload()
+        except Exception as e:
+            print(f"Settings watch error: {e}")
+
+@app.on_event("startup")
+async def start_scheduled_jobs():
+    # Creates the outbound queue tables even when only the local SQLite file is in use
+    init_db()
+    app.state.settings_watch_task = asyncio.create_task(_watch_settings())
+    if not RUN_BACKGROUND_JOBS:
+        return
+    app.state.delivery_worker_task = asyncio.create_task(delivery_worker.run_forever())
+    app.state.loan_status_task = asyncio.create_task(
+        _run_periodically(run_loan_status_job, LOAN_STATUS_INTERVAL_SECONDS)
+    )
+    app.state.repayment_schedule_task = asyncio.create_task(
+        _run_periodically(run_repayment_schedule_job, REPAYMENT_SCHEDULE_INTERVAL_SECONDS)
+    )
+    app.state.daily_reports_task = asyncio.create_task(
+        _run_periodically(run_daily_reports_job, DAILY_REPORT_CHECK_SECONDS)
+    )
+    app.state.anomaly_task = asyncio.create_task(
+        _run_periodically(run_anomaly_job, ANOMALY_CHECK_SECONDS)
+    )
+
 @app.get("/")
 def read_root():
     return {
@@ -80,60 +292,36 @@ def health_check():
         "database": "connected" if use_database() else "sample_data"
     }
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Request latency, SQL, external API and payload-size metrics in Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+LIST_FORMATS = ("json", "ndjson")
+# Page size of the JSON list endpoints when no limit is given; NDJSON streams every matching row
+DEFAULT_PAGE_SIZE = 100
+
+def _validate_format(format: str):
+    if format not in LIST_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(LIST_FORMATS)}")
+
+def _ndjson_response(frame: pd.DataFrame):
+    """Stream a frame as one JSON object per line, serialized a chunk of rows at a time"""
+    return StreamingResponse(iter_ndjson(frame), media_type="application/x-ndjson")
+
+def _typed_branch_metrics(db: Session) -> pd.DataFrame:
+    """Every branch's metrics, with exactly the BranchMetrics columns and field types"""
+    # One aggregate pass over every branch, falling back to sample data if tables don't exist
+    return _branch_metrics(db)[list(BranchMetrics.model_fields)].astype(BRANCH_METRIC_TYPES)
+
 @app.get("/api/branches", response_model=List[BranchMetrics])
-def get_branches(db: Session = Depends(get_db)):
-    # Try database first, fall back to sample data if tables don't exist
-    try:
-        if use_database():
-            # Use database
-            branches = db.query(Branch).all()
-            metrics = []
-            
-            for branch in branches:
-                total_disbursements = db.query(func.sum(Loan.disbursement_amount)).filter(
-                    Loan.branch_id == branch.id
-                ).scalar() or 0
-                
-                total_collections = db.query(func.sum(Collection.amount)).filter(
-                    Collection.branch_id == branch.id
-                ).scalar() or 0
-                
-                total_arrears = total_disbursements - total_collections
-                collection_rate = (total_collections / total_disbursements * 100) if total_disbursements > 0 else 0
-                
-                customer_count = db.query(func.count(Customer.id)).filter(
-                    Customer.branch_id == branch.id
-                ).scalar() or 0
-                
-                metrics.append(BranchMetrics(
-                    branch=branch.name,
-                    total_disbursements=float(total_disbursements),
-                    total_collections=float(total_collections),
-                    total_arrears=float(total_arrears),
-                    collection_rate=round(collection_rate, 2),
-                    customer_count=customer_count
-                ))
-            
-            return metrics
-    except Exception:
-        # Fall back to sample data if database query fails
-        pass
-    
-    # Fallback to sample data
-    df = pd.DataFrame(sample_data)
-    df['collection_rate'] = (df['collections'] / df['disbursements'] * 100).round(2)
-    
-    metrics = []
-    for _, row in df.iterrows():
-        metrics.append(BranchMetrics(
-            branch=str(row['branch']),
-            total_disbursements=float(row['disbursements']),
-            total_collections=float(row['collections']),
-            total_arrears=float(row['arrears']),
-            collection_rate=float(row['collection_rate']),
-            customer_count=int(row['customer_count'])
-        ))
-    return metrics
+def get_branches(db: Session = Depends(get_db), format: str = "json"):
+    _validate_format(format)
+    # Serialized column-wise instead of one model per row
+    metrics = _typed_branch_metrics(db)
+    if format == "ndjson":
+        return _ndjson_response(metrics)
+    return FrameJSONResponse(metrics)
 
 @app.get("/api/summary")
 def get_summary(db: Session = Depends(get_db)):
@@ -183,143 +371,291 @@ def get_top_performers(db: Session = Depends(get_db)):
         # Fallback to sample data
         df = pd.DataFrame(sample_data)
         df['collection_rate'] = (df['collections'] / df['disbursements'] * 100).round(2)
-        df = df.sort_values('collection_rate', ascending=False)
-        return df.head(3).to_dict(orient='records')
+        return ranking_engine.top_n(df, 'collection_rate', 3).to_dict(orient='records')
     
     # Use database
-    branches = get_branches(db)
-    sorted_branches = sorted(branches, key=lambda x: x.collection_rate, reverse=True)
+    top_branches = ranking_engine.top_branches_sql(db, 'collection_rate', 3)
     
     return [
         {
-            "branch": b.branch,
-            "disbursements": b.total_disbursements,
-            "collections": b.total_collections,
-            "arrears": b.total_arrears,
-            "collection_rate": b.collection_rate,
-            "customer_count": b.customer_count
+            "branch": b["branch"],
+            "disbursements": float(b["total_disbursements"]),
+            "collections": float(b["total_collections"]),
+            "arrears": float(b["total_arrears"]),
+            "collection_rate": b["collection_rate"],
+            "customer_count": int(b["customer_count"])
         }
-        for b in sorted_branches[:3]
+        for b in top_branches
     ]
 
+def _validate_ranking(metric: str, allowed: List[str], order: str):
+    if metric not in allowed:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown metric '{metric}'. Choose one of: {', '.join(allowed)}"
+        )
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'")
+
+@app.get("/api/rankings/branches")
+def rank_branches(metric: str = "collection_rate", n: int = 10, order: str = "desc", db: Session = Depends(get_db)):
+    """Top/bottom-N branches by any branch metric"""
+    _validate_ranking(metric, BRANCH_METRICS, order)
+    ascending = order == "asc"
+    
+    try:
+        if use_database():
+            return {
+                "metric": metric,
+                "order": order,
+                "branches": ranking_engine.top_branches_sql(db, metric, n, ascending)
+            }
+    except Exception:
+        # Fall back to sample data if database query fails
+        pass
+    
+    df = pd.DataFrame(sample_data).rename(columns={
+        "disbursements": "total_disbursements",
+        "collections": "total_collections",
+        "arrears": "total_arrears"
+    })
+    df['collection_rate'] = (df['total_collections'] / df['total_disbursements'] * 100).round(2)
+    
+    return FrameJSONResponse({
+        "metric": metric,
+        "order": order,
+        "branches": ranking_engine.top_n(df, metric, n, ascending)
+    })
+
+@app.get("/api/rankings/customers")
+def rank_customers(metric: str = "arrears", n: int = 10, order: str = "desc"):
+    """Top/bottom-N customers, by arrears unless another metric is given"""
+    _validate_ranking(metric, CUSTOMER_METRICS, order)
+    rollup = ranking_engine.customer_rollup(enhanced_full_data)
+    
+    return FrameJSONResponse({
+        "metric": metric,
+        "order": order,
+        "customers": ranking_engine.top_n(rollup, metric, n, order == "asc")
+    })
+
+@app.get("/api/rankings/loans")
+def rank_loans(metric: str = "outstanding", n: int = 10, order: str = "desc"):
+    """Top/bottom-N loans, by outstanding amount unless another metric is given"""
+    _validate_ranking(metric, LOAN_METRICS, order)
+    rollup = ranking_engine.loan_rollup(enhanced_full_data)
+    
+    return FrameJSONResponse({
+        "metric": metric,
+        "order": order,
+        "loans": ranking_engine.top_n(rollup, metric, n, order == "asc")
+    })
+
+def _load_ai_inputs():
+    """Summary and branch metrics for the AI endpoints, with the DB session closed before any LLM call"""
+    db = SessionLocal()
+    try:
+        metrics = _branch_metrics(db)
+    finally:
+        db.close()
+    
+    columns = list(BranchMetrics.model_fields) + (["region"] if "region" in metrics else [])
+    branches = metrics[columns].to_dict(orient='records')
+    return daily_report_scheduler.summarize(metrics), branches
+
+def _load_forecast():
+    """Local 3-month collection forecast, from the database or the sample data"""
+    if use_database():
+        db = SessionLocal()
+        try:
+            return collection_forecaster.forecast(collection_forecaster.series_sql(db))
+        except Exception as e:
+            print(f"Forecast query error: {e}")
+        finally:
+            db.close()
+    return collection_forecaster.forecast_sample(enhanced_full_data)
+
+async def _await_unless_disconnected(request: Request, coro):
+    """Await an AI call, cancelling it (and its upstream request) if the HTTP client goes away"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
+
+async def _find_branch(branch_name: str):
+    _, branches = await asyncio.to_thread(_load_ai_inputs)
+    branch_data = next((b for b in branches if b['branch'] == branch_name), None)
+    if not branch_data:
+        raise HTTPException(status_code=404, detail=f"Branch '{branch_name}' not found")
+    return branch_data
+
 @app.get("/api/ai/insights")
-def get_ai_insights(db: Session = Depends(get_db)):
-    # Get summary and branches data
-    summary = get_summary(db)
-    branches = get_branches(db)
+async def get_ai_insights(request: Request):
+    summary, branches = await asyncio.to_thread(_load_ai_inputs)
     
     if not branches:
         return {"insights": ["No data available yet. Please upload loan data to get insights."]}
     
-    # Convert to dict format for AI service
-    summary_dict = summary if isinstance(summary, dict) else summary
-    branches_dict = [b.model_dump() if hasattr(b, 'model_dump') else b for b in branches]
-    
     # Use AI service for advanced insights
-    insights = ai_service.generate_advanced_insights(summary_dict, branches_dict)
+    insights = await _await_unless_disconnected(
+        request, ai_service.generate_advanced_insights(summary, branches)
+    )
     
     return {"insights": insights}
 
+def _sse_response(events):
+    """Serve (event, data) pairs from an async generator as server-sent events"""
+    async def frames():
+        async for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/ai/insights/stream")
+async def stream_ai_insights():
+    """Server-sent events: rule-based insights immediately, then AI insights as each one completes"""
+    summary, branches = await asyncio.to_thread(_load_ai_inputs)
+    return _sse_response(ai_service.stream_insights(summary, branches))
+
 @app.get("/api/ai/predictions")
-def get_predictions(db: Session = Depends(get_db)):
-    """Get AI-powered collection trend predictions"""
-    branches = get_branches(db)
+async def get_predictions(request: Request, token_budget: Optional[int] = None):
+    """Collection trend predictions from the local forecaster, narrated by AI when configured"""
+    if token_budget is not None and token_budget < 200:
+        raise HTTPException(status_code=400, detail="token_budget must be at least 200")
+    
+    (_, branches), forecast = await asyncio.gather(
+        asyncio.to_thread(_load_ai_inputs), asyncio.to_thread(_load_forecast)
+    )
     
     if not branches:
         return {"predictions": []}
     
     # Prepare historical data
-    historical_data = [
-        {
-            "branch": b.branch if hasattr(b, 'branch') else b['branch'],
-            "collection_rate": b.collection_rate if hasattr(b, 'collection_rate') else b['collection_rate'],
-            "total_collections": b.total_collections if hasattr(b, 'total_collections') else b['total_collections'],
-            "total_disbursements": b.total_disbursements if hasattr(b, 'total_disbursements') else b['total_disbursements']
-        }
-        for b in branches
+    historical_data = pd.DataFrame(branches)[
+        ["branch", "region", "collection_rate", "total_collections", "total_disbursements"]
     ]
     
-    predictions = ai_service.predict_collection_trends(historical_data)
-    return {"predictions": predictions}
+    context = ai_service.predictions_context(historical_data, token_budget)
+    predictions = await _await_unless_disconnected(
+        request, ai_service.predict_collection_trends(forecast, context)
+    )
+    return {
+        "predictions": predictions,
+        "forecast": {k: forecast[k] for k in ("method", "history_months", "interval_level", "current_rate", "duration_seconds")},
+        "narrated": ai_service.is_configured(),
+        "prompt": {k: context[k] for k in ("tokens", "token_budget", "branches", "detail")}
+    }
+
+@app.get("/api/forecasts/collections")
+async def get_collection_forecast(branch: Optional[str] = None, sort: str = "branch"):
+    """Per-branch 3-month collection rate forecasts with intervals, plus the portfolio history"""
+    forecast = await asyncio.to_thread(_load_forecast)
+    branches = forecast["branches"]
+    
+    if branch is not None:
+        branches = branches[branches["branch"] == branch]
+        if branches.empty:
+            raise HTTPException(status_code=404, detail=f"Branch '{branch}' not found")
+    if sort not in branches.columns:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(branches.columns)}")
+    
+    return FrameJSONResponse({
+        **{k: v for k, v in forecast.items() if k != "branches"},
+        "branches": branches.sort_values(sort, kind="stable")
+    })
 
 @app.get("/api/ai/risk-analysis/{branch_name}")
-def get_risk_analysis(branch_name: str, db: Session = Depends(get_db)):
+async def get_risk_analysis(branch_name: str, request: Request):
     """Get AI-powered risk analysis for a specific branch"""
-    branches = get_branches(db)
-    
-    # Find the branch
-    branch_data = None
-    for b in branches:
-        b_name = b.branch if hasattr(b, 'branch') else b['branch']
-        if b_name == branch_name:
-            branch_data = b.model_dump() if hasattr(b, 'model_dump') else b
-            break
+    branch_data = await _find_branch(branch_name)
+    return await _await_unless_disconnected(request, ai_service.analyze_risk_profile(branch_data))
+
+@app.post("/api/ai/risk-analysis")
+async def get_batch_risk_analysis(request: Request, body: BatchRiskAnalysisRequest = None):
+    """Risk analysis for many branches (all of them by default) in a few batched AI requests"""
+    _, branches = await asyncio.to_thread(_load_ai_inputs)
     
-    if not branch_data:
-        raise HTTPException(status_code=404, detail=f"Branch '{branch_name}' not found")
+    not_found = []
+    if body and body.branches is not None:
+        by_name = {b['branch']: b for b in branches}
+        not_found = [name for name in body.branches if name not in by_name]
+        branches = [by_name[name] for name in dict.fromkeys(body.branches) if name in by_name]
     
-    risk_analysis = ai_service.analyze_risk_profile(branch_data)
-    return risk_analysis
+    result = await _await_unless_disconnected(request, ai_service.analyze_risk_profiles(branches))
+    result["not_found"] = not_found
+    return result
 
 @app.get("/api/ai/motivation/{branch_name}")
-def get_motivation(branch_name: str, db: Session = Depends(get_db)):
+async def get_motivation(branch_name: str, request: Request):
     """Generate motivational message for a branch"""
-    branches = get_branches(db)
-    
-    # Find the branch
-    branch_data = None
-    for b in branches:
-        b_name = b.branch if hasattr(b, 'branch') else b['branch']
-        if b_name == branch_name:
-            branch_data = b.model_dump() if hasattr(b, 'model_dump') else b
-            break
-    
-    if not branch_data:
-        raise HTTPException(status_code=404, detail=f"Branch '{branch_name}' not found")
-    
-    message = ai_service.generate_motivational_message(branch_name, branch_data)
+    branch_data = await _find_branch(branch_name)
+    message = await _await_unless_disconnected(
+        request, ai_service.generate_motivational_message(branch_name, branch_data)
+    )
     return {"branch": branch_name, "message": message}
 
+@app.get("/api/ai/motivation/{branch_name}/stream")
+async def stream_motivation(branch_name: str):
+    """Server-sent events with the motivational message token by token"""
+    branch_data = await _find_branch(branch_name)
+    return _sse_response(ai_service.stream_motivational_message(branch_name, branch_data))
+
+@app.get("/api/ai/cache")
+def get_ai_cache_stats(db: Session = Depends(get_db)):
+    """AI response cache hit rate, latency saved and size"""
+    return ai_cache.stats(db)
+
+@app.delete("/api/ai/cache")
+def clear_ai_cache(db: Session = Depends(get_db)):
+    return {"status": "cleared", "entries_removed": ai_cache.clear(db)}
+
 @app.get("/api/analytics/trends")
 def get_trends(db: Session = Depends(get_db)):
     """Get trending analytics and performance patterns"""
-    branches = get_branches(db)
+    branches = _typed_branch_metrics(db)
     summary = get_summary(db)
     
-    if not branches:
+    if branches.empty:
         return {"trends": {}}
     
-    # Calculate trends
-    collection_rates = [
-        b.collection_rate if hasattr(b, 'collection_rate') else b['collection_rate']
-        for b in branches
-    ]
+    names = branches["branch"].tolist()
+    rates = branches["collection_rate"].to_numpy(dtype=float)
+    distribution = ranking_engine.bucket_counts(rates)
+    high_performers = [names[i] for i in np.flatnonzero(rates >= 90)]
+    at_risk = [names[i] for i in np.flatnonzero(rates < 80)]
     
-    avg_rate = sum(collection_rates) / len(collection_rates)
-    high_performers = [b for b in branches if (b.collection_rate if hasattr(b, 'collection_rate') else b['collection_rate']) >= 90]
-    at_risk = [b for b in branches if (b.collection_rate if hasattr(b, 'collection_rate') else b['collection_rate']) < 80]
+    # Branches whose daily collections fell sharply below their own baseline this week
+    _refresh_anomaly_detector(db)
+    drops = anomaly_detector.recent_alerts(days=ANOMALY_TREND_DAYS, direction="drop")
+    collapsing = list(dict.fromkeys(a["branch"] for a in drops))
     
     return {
         "trends": {
-            "average_collection_rate": round(avg_rate, 2),
-            "high_performers_count": len(high_performers),
-            "at_risk_branches_count": len(at_risk),
+            "average_collection_rate": round(float(rates.mean()), 2),
+            "high_performers_count": distribution["excellent"],
+            "at_risk_branches_count": distribution["needs_improvement"],
+            "collapsing_branches_count": len(collapsing),
             "total_arrears_trend": summary.get('total_arrears', 0),
             "customer_growth": summary.get('total_customers', 0),
-            "branch_performance_distribution": {
-                "excellent": len([b for b in branches if (b.collection_rate if hasattr(b, 'collection_rate') else b['collection_rate']) >= 90]),
-                "good": len([b for b in branches if 80 <= (b.collection_rate if hasattr(b, 'collection_rate') else b['collection_rate']) < 90]),
-                "needs_improvement": len([b for b in branches if (b.collection_rate if hasattr(b, 'collection_rate') else b['collection_rate']) < 80])
-            }
+            "branch_performance_distribution": distribution
         },
-        "high_performers": [
-            (b.branch if hasattr(b, 'branch') else b['branch'])
-            for b in high_performers[:5]
-        ],
-        "at_risk_branches": [
-            (b.branch if hasattr(b, 'branch') else b['branch'])
-            for b in at_risk
-        ]
+        "high_performers": high_performers[:5],
+        "at_risk_branches": at_risk,
+        "collapsing_branches": collapsing,
+        "collection_anomalies": drops[:20]
     }
 
 @app.post("/api/upload/csv")
@@ -399,6 +735,10 @@ async def upload_csv(file: UploadFile = File(...), db: Session = Depends(get_db)
         
         db.commit()
         
+        # New loans and collections change statuses; only those loans are re-evaluated. Anomaly scoring
+        # happens in the job, which reads the new collections from the database on its next run
+        loan_status_engine.run(db)
+        
         return {
             "message": "Data uploaded successfully",
             "records_processed": records_added,
@@ -411,57 +751,149 @@ async def upload_csv(file: UploadFile = File(...), db: Session = Depends(get_db)
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
-@app.post("/api/messaging/whatsapp/send")
-def send_whatsapp_message(to_number: str, message: str):
-    """Send WhatsApp message via Twilio"""
-    result = whatsapp_bot.send_message(to_number, message)
-    if result['status'] == 'error':
-        raise HTTPException(status_code=500, detail=result['message'])
-    return result
+@app.post("/api/jobs/loan-status/run")
+def trigger_loan_status_job():
+    """Run the loan status recomputation job immediately"""
+    return run_loan_status_job()
+
+@app.post("/api/jobs/repayment-schedule/run")
+def trigger_repayment_schedule_job():
+    """Rebuild installment schedules immediately"""
+    return run_repayment_schedule_job()
+
+@app.post("/api/jobs/daily-reports/run")
+def trigger_daily_reports_job():
+    """Queue today's branch reports now; recipients already sent today are skipped"""
+    return run_daily_reports_job(force=True)
+
+@app.post("/api/jobs/anomalies/run")
+def trigger_anomaly_job():
+    """Score any finished days for collection anomalies now"""
+    return run_anomaly_job()
+
+@app.get("/api/anomalies")
+def get_collection_anomalies(days: int = 7, branch: Optional[str] = None, db: Session = Depends(get_db)):
+    """Recent collection anomaly alerts and the per-branch daily baselines behind them"""
+    _refresh_anomaly_detector(db)
+    alerts = anomaly_detector.recent_alerts(days=days)
+    if branch is not None:
+        alerts = [a for a in alerts if a["branch"] == branch]
+    return {
+        "alerts": alerts,
+        "baselines": anomaly_detector.status(branch),
+        "late_collections_skipped": anomaly_detector.late
+    }
+
+@app.get("/api/reports/recipients")
+def list_report_recipients(db: Session = Depends(get_db)):
+    """Recipient directory for the daily reports"""
+    return daily_report_scheduler.list_recipients(db)
+
+@app.post("/api/reports/recipients")
+def add_report_recipients(recipients: List[ReportRecipientRequest], db: Session = Depends(get_db)):
+    """Add recipients; those with a branch get its performance report, others the portfolio summary"""
+    try:
+        return daily_report_scheduler.add_recipients(db, [r.model_dump() for r in recipients])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/api/reports/recipients/{recipient_id}")
+def remove_report_recipient(recipient_id: int, db: Session = Depends(get_db)):
+    if not daily_report_scheduler.remove_recipient(db, recipient_id):
+        raise HTTPException(status_code=404, detail="Recipient not found")
+    return {"status": "deleted", "id": recipient_id}
 
-@app.post("/api/messaging/whatsapp/daily-summary")
-def send_whatsapp_daily_summary(to_number: str, db: Session = Depends(get_db)):
-    """Send daily summary via WhatsApp"""
+def _enqueue_whatsapp(db: Session, to_number: str, message: str, idempotency_key: Optional[str]):
+    queued = message_queue.enqueue(db, "whatsapp", to_number, message, idempotency_key)
+    return {"status": "queued", "message": queued}
+
+@app.post("/api/messaging/whatsapp/send", status_code=202)
+def send_whatsapp_message(to_number: str, message: str, db: Session = Depends(get_db),
+                          idempotency_key: Optional[str] = Header(None)):
+    """Queue a WhatsApp message for delivery via Twilio"""
+    return _enqueue_whatsapp(db, to_number, message, idempotency_key)
+
+@app.post("/api/messaging/whatsapp/daily-summary", status_code=202)
+def send_whatsapp_daily_summary(to_number: str, db: Session = Depends(get_db),
+                                idempotency_key: Optional[str] = Header(None)):
+    """Queue the daily summary for WhatsApp delivery"""
     summary = get_summary(db)
-    result = whatsapp_bot.send_daily_summary(to_number, summary)
-    if result['status'] == 'error':
-        raise HTTPException(status_code=500, detail=result['message'])
-    return result
+    return _enqueue_whatsapp(db, to_number, whatsapp_bot.format_daily_summary(summary), idempotency_key)
 
-@app.post("/api/messaging/whatsapp/branch-performance")
-def send_whatsapp_branch_performance(to_number: str, branch_name: str, db: Session = Depends(get_db)):
-    """Send branch performance via WhatsApp"""
-    branches = get_branches(db)
-    branch_data = next((b for b in branches if b.branch == branch_name), None)
+@app.post("/api/messaging/whatsapp/branch-performance", status_code=202)
+def send_whatsapp_branch_performance(to_number: str, branch_name: str, db: Session = Depends(get_db),
+                                     idempotency_key: Optional[str] = Header(None)):
+    """Queue branch performance for WhatsApp delivery"""
+    branches = _typed_branch_metrics(db)
+    branch_data = branches[branches["branch"] == branch_name].to_dict(orient="records")
     
     if not branch_data:
         raise HTTPException(status_code=404, detail=f"Branch '{branch_name}' not found")
     
-    result = whatsapp_bot.send_branch_performance(to_number, branch_data.model_dump())
-    if result['status'] == 'error':
-        raise HTTPException(status_code=500, detail=result['message'])
-    return result
+    message = whatsapp_bot.format_branch_performance(branch_data[0])
+    return _enqueue_whatsapp(db, to_number, message, idempotency_key)
 
-@app.post("/api/messaging/whatsapp/motivational")
-def send_whatsapp_motivational(to_number: str, branch_name: str = None):
-    """Send motivational message via WhatsApp"""
-    result = whatsapp_bot.send_motivational_message(to_number, branch_name)
-    if result['status'] == 'error':
-        raise HTTPException(status_code=500, detail=result['message'])
-    return result
+@app.post("/api/messaging/whatsapp/motivational", status_code=202)
+def send_whatsapp_motivational(to_number: str, branch_name: str = None, db: Session = Depends(get_db),
+                               idempotency_key: Optional[str] = Header(None)):
+    """Queue a motivational message for WhatsApp delivery"""
+    message = whatsapp_bot.format_motivational_message(branch_name)
+    return _enqueue_whatsapp(db, to_number, message, idempotency_key)
 
-@app.post("/api/messaging/whatsapp/alert")
-def send_whatsapp_alert(to_number: str, alert_type: str, subject: str, message: str, action: str):
-    """Send alert via WhatsApp"""
+@app.post("/api/messaging/whatsapp/alert", status_code=202)
+def send_whatsapp_alert(to_number: str, alert_type: str, subject: str, message: str, action: str,
+                        db: Session = Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    """Queue an alert for WhatsApp delivery"""
     details = {
         "subject": subject,
         "message": message,
         "action": action
     }
-    result = whatsapp_bot.send_alert(to_number, alert_type, details)
-    if result['status'] == 'error':
-        raise HTTPException(status_code=500, detail=result['message'])
-    return result
+    return _enqueue_whatsapp(db, to_number, whatsapp_bot.format_alert(alert_type, details), idempotency_key)
+
+@app.post("/api/messaging/whatsapp/bulk", status_code=202)
+def send_whatsapp_bulk(request: BulkMessageRequest, db: Session = Depends(get_db),
+                       idempotency_key: Optional[str] = Header(None)):
+    """Queue WhatsApp messages for many recipients; the delivery worker sends them concurrently"""
+    queued = message_queue.enqueue_many(db, [
+        {
+            "channel": "whatsapp",
+            "recipient": r.phone,
+            "body": r.message or request.message,
+            "idempotency_key": f"{idempotency_key}:{i}" if idempotency_key else None
+        }
+        for i, r in enumerate(request.recipients)
+    ])
+    return {"status": "queued", "count": len(queued), "messages": queued}
+
+@app.get("/api/messaging/queue")
+def get_message_queue_stats(db: Session = Depends(get_db)):
+    """Outbound queue depth by status"""
+    return message_queue.stats(db)
+
+@app.get("/api/messaging/queue/{message_id}")
+def get_queued_message(message_id: int, db: Session = Depends(get_db)):
+    """Delivery status of a queued message"""
+    message = message_queue.get(db, message_id)
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return message
+
+@app.post("/api/messaging/queue/{message_id}/retry")
+def retry_queued_message(message_id: int, db: Session = Depends(get_db)):
+    """Requeue a dead-lettered message"""
+    try:
+        message = message_queue.requeue(db, message_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return message
+
+@app.post("/api/messaging/telegram/broadcast")
+async def send_telegram_broadcast(request: TelegramBroadcastRequest):
+    """Broadcast a Telegram message to many chats concurrently"""
+    return await telegram_bot.broadcast(request.chat_ids, request.message)
 
 @app.get("/api/messaging/status")
 def get_messaging_status():
@@ -496,41 +928,43 @@ def get_messaging_status():
 @app.get("/api/settings/status")
 def get_settings_status():
     """Get the status of configured API keys"""
-    return settings_service.get_settings_status()
+    return {**settings_service.get_settings_status(), "clients": client_registry.status()}
 
 @app.post("/api/settings/update")
-def update_settings(settings: dict):
+async def update_settings(settings: dict):
     """Update API configuration settings"""
     try:
-        success = settings_service.update_settings(settings)
-        if success:
-            # Reload bots with new settings
-            whatsapp_bot.__init__()
-            telegram_bot.__init__()
-            ai_service.__init__()
-            return {"message": "Settings updated successfully"}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to update settings")
+        success = await asyncio.to_thread(settings_service.update_settings, settings)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not success:
+        raise HTTPException(status_code=500, detail="Failed to update settings")
+    
+    # New clients are built off the request path and swapped in; in-flight sends finish on the old ones.
+    # The other workers see the rewritten .env within SETTINGS_WATCH_SECONDS and reload their own
+    app.state.client_reload_task = asyncio.create_task(client_registry.reload())
+    return {"message": "Settings updated successfully", "clients": "reloading"}
 
 @app.get("/api/customers")
-def get_customers(branch: Optional[str] = None, limit: int = 100, offset: int = 0):
+def get_customers(branch: Optional[str] = None, limit: Optional[int] = None, offset: int = 0, format: str = "json"):
     """Get customers with optional filtering"""
+    _validate_format(format)
     customers_df = enhanced_full_data["customers"]
     
     if branch:
-        customers_df = customers_df[customers_df["branch"] == branch]
+        customers_df = customers_df[categorical_encoder.mask(customers_df["branch"], branch)]
     
-    customers = customers_df.iloc[offset:offset+limit].to_dict(orient="records")
-    total = len(customers_df)
+    if format == "ndjson":
+        return _ndjson_response(customers_df.iloc[offset:None if limit is None else offset+limit])
+    limit = DEFAULT_PAGE_SIZE if limit is None else limit
     
-    return {
-        "customers": customers,
-        "total": total,
+    # The page is serialized straight from the frame, without a dict per row
+    return FrameJSONResponse({
+        "customers": customers_df.iloc[offset:offset+limit],
+        "total": len(customers_df),
         "limit": limit,
         "offset": offset
-    }
+    })
 
 @app.get("/api/customers/{customer_id}")
 def get_customer_details(customer_id: str):
@@ -539,14 +973,18 @@ def get_customer_details(customer_id: str):
     loans_df = enhanced_full_data["loans"]
     collections_df = enhanced_full_data["collections"]
     
-    customer = customers_df[customers_df["customer_id"] == customer_id]
+    customer = customers_df[categorical_encoder.mask(customers_df["customer_id"], customer_id)]
     if customer.empty:
         raise HTTPException(status_code=404, detail="Customer not found")
     
     customer_data = customer.iloc[0].to_dict()
     
-    customer_loans = loans_df[loans_df["customer_id"] == customer_id].to_dict(orient="records")
-    customer_collections = collections_df[collections_df["customer_id"] == customer_id].to_dict(orient="records")
+    customer_loans = loans_df[
+        categorical_encoder.mask(loans_df["customer_id"], customer_id)
+    ].to_dict(orient="records")
+    customer_collections = collections_df[
+        categorical_encoder.mask(collections_df["customer_id"], customer_id)
+    ].to_dict(orient="records")
     
     features = credit_scoring_engine.extract_features(customer_data, customer_loans, customer_collections)
     credit_score = credit_scoring_engine.calculate_credit_score(features)
@@ -562,25 +1000,31 @@ def get_customer_details(customer_id: str):
     }
 
 @app.get("/api/loans")
-def get_loans(branch: Optional[str] = None, status: Optional[str] = None, limit: int = 100, offset: int = 0):
+def get_loans(branch: Optional[str] = None, status: Optional[str] = None, limit: Optional[int] = None,
+              offset: int = 0, format: str = "json"):
     """Get loans with optional filtering"""
+    _validate_format(format)
     loans_df = enhanced_full_data["loans"]
     
+    # Both filters compare integer codes; the combined mask selects the page in one pass
+    mask = np.ones(len(loans_df), dtype=bool)
     if branch:
-        loans_df = loans_df[loans_df["branch"] == branch]
-    
+        mask &= categorical_encoder.mask(loans_df["branch"], branch)
     if status:
-        loans_df = loans_df[loans_df["status"] == status]
+        mask &= categorical_encoder.mask(loans_df["status"], status)
+    if branch or status:
+        loans_df = loans_df[mask]
     
-    loans = loans_df.iloc[offset:offset+limit].to_dict(orient="records")
-    total = len(loans_df)
+    if format == "ndjson":
+        return _ndjson_response(loans_df.iloc[offset:None if limit is None else offset+limit])
+    limit = DEFAULT_PAGE_SIZE if limit is None else limit
     
-    return {
-        "loans": loans,
-        "total": total,
+    return FrameJSONResponse({
+        "loans": loans_df.iloc[offset:offset+limit],
+        "total": len(loans_df),
         "limit": limit,
         "offset": offset
-    }
+    })
 
 @app.get("/api/loans/{loan_id}")
 def get_loan_details(loan_id: str):
@@ -606,6 +1050,24 @@ def get_loan_details(loan_id: str):
         "outstanding": loan_data["disbursement_amount"] - total_collected
     }
 
+@app.get("/api/loans/{loan_id}/schedule")
+def get_loan_schedule(loan_id: str):
+    """Get the installment schedule for a loan with collections allocated oldest-first"""
+    schedule = repayment_schedule_engine.schedule_for_frames(
+        enhanced_full_data["loans"], enhanced_full_data["collections"]
+    )
+    installments = schedule[schedule["loan_id"] == loan_id]
+    if installments.empty:
+        raise HTTPException(status_code=404, detail="Loan not found")
+    
+    installments = installments.assign(due_date=installments["due_date"].dt.strftime("%Y-%m-%d"))
+    return FrameJSONResponse({
+        "loan_id": loan_id,
+        "installments": installments,
+        "total_due": float(installments["amount_due"].sum()),
+        "total_paid": float(installments["amount_paid"].sum())
+    })
+
 @app.post("/api/credit-score/calculate")
 def calculate_credit_score(customer_id: str):
     """Calculate credit score for a customer"""
@@ -613,13 +1075,17 @@ def calculate_credit_score(customer_id: str):
     loans_df = enhanced_full_data["loans"]
     collections_df = enhanced_full_data["collections"]
     
-    customer = customers_df[customers_df["customer_id"] == customer_id]
+    customer = customers_df[categorical_encoder.mask(customers_df["customer_id"], customer_id)]
     if customer.empty:
         raise HTTPException(status_code=404, detail="Customer not found")
     
     customer_data = customer.iloc[0].to_dict()
-    customer_loans = loans_df[loans_df["customer_id"] == customer_id].to_dict(orient="records")
-    customer_collections = collections_df[collections_df["customer_id"] == customer_id].to_dict(orient="records")
+    customer_loans = loans_df[
+        categorical_encoder.mask(loans_df["customer_id"], customer_id)
+    ].to_dict(orient="records")
+    customer_collections = collections_df[
+        categorical_encoder.mask(collections_df["customer_id"], customer_id)
+    ].to_dict(orient="records")
     
     features = credit_scoring_engine.extract_features(customer_data, customer_loans, customer_collections)
     credit_score = credit_scoring_engine.calculate_credit_score(features)
@@ -643,7 +1109,7 @@ def get_portfolio_analysis():
     
     total_portfolio = loans_df["disbursement_amount"].sum()
     total_collected = collections_df["amount"].sum()
-    portfolio_at_risk = loans_df[loans_df["status"] == "overdue"]["disbursement_amount"].sum()
+    par = portfolio_aging_engine.par_report(loans_df, collections_df)[0]
     
     by_status = loans_df.groupby("status").agg({
         "disbursement_amount": "sum",
@@ -658,8 +1124,11 @@ def get_portfolio_analysis():
     return {
         "total_portfolio_value": float(total_portfolio),
         "total_collected": float(total_collected),
-        "portfolio_at_risk": float(portfolio_at_risk),
-        "par_ratio": round(portfolio_at_risk / total_portfolio * 100, 2) if total_portfolio > 0 else 0,
+        "outstanding_portfolio": par["outstanding_portfolio"],
+        "portfolio_at_risk": par["par30"],
+        "par_ratio": par["par30_ratio"],
+        "par": {f"par{t}": {"amount": par[f"par{t}"], "ratio": par[f"par{t}_ratio"]} for t in PAR_THRESHOLDS},
+        "aging": par["aging"],
         "collection_rate": round(total_collected / total_portfolio * 100, 2) if total_portfolio > 0 else 0,
         "by_status": by_status,
         "by_region": by_region,
@@ -667,6 +1136,80 @@ def get_portfolio_analysis():
         "total_loans": len(loans_df)
     }
 
+@app.get("/api/reports/par")
+def get_par_report(level: str = "portfolio", as_of: Optional[str] = None):
+    """Portfolio-at-risk aging (PAR1/30/60/90) by portfolio, branch or region"""
+    try:
+        as_of_date = datetime.strptime(as_of, "%Y-%m-%d") if as_of else None
+        report = portfolio_aging_engine.par_report(
+            enhanced_full_data["loans"],
+            enhanced_full_data["collections"],
+            level=level,
+            as_of=as_of_date
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "level": level,
+        "as_of": (as_of_date or datetime.now()).strftime("%Y-%m-%d"),
+        "thresholds": PAR_THRESHOLDS,
+        "results": report
+    }
+
+@app.get("/api/reports/collection-efficiency")
+def get_collection_efficiency(level: str = "branch", as_of: Optional[str] = None, db: Session = Depends(get_db)):
+    """Collections measured against installments actually due to date"""
+    try:
+        as_of_date = datetime.strptime(as_of, "%Y-%m-%d") if as_of else None
+        
+        if use_database() and level == "branch":
+            try:
+                results = repayment_schedule_engine.collection_efficiency_db(db, as_of_date)
+                if results:
+                    return {"level": level, "source": "database", "results": results}
+            except Exception:
+                # Fall back to sample data if the installments table is not available
+                pass
+        
+        loans_df = enhanced_full_data["loans"]
+        schedule = repayment_schedule_engine.schedule_for_frames(loans_df, enhanced_full_data["collections"])
+        results = repayment_schedule_engine.collection_efficiency(schedule, loans_df, level, as_of_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {"level": level, "source": "sample_data", "results": results}
+
+def _snapshot_archive_response(snapshot_id: str):
+    snapshot_dir = parquet_exporter.snapshot_path(snapshot_id)
+    if snapshot_dir is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    
+    return StreamingResponse(
+        parquet_exporter.stream_archive(snapshot_dir),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="kechita_snapshot_{snapshot_id}.zip"'}
+    )
+
+@app.post("/api/export/parquet")
+def export_parquet_snapshot(full: bool = False):
+    """Write a Parquet snapshot of everything added since the last export and stream it as a zip"""
+    if not parquet_exporter.available:
+        raise HTTPException(status_code=503, detail="Parquet export unavailable. Install pyarrow.")
+    
+    manifest = parquet_exporter.export_snapshot(enhanced_full_data, full=full)
+    return _snapshot_archive_response(manifest["snapshot_id"])
+
+@app.get("/api/export/snapshots")
+def list_export_snapshots():
+    """List previously written Parquet snapshots"""
+    return {"snapshots": parquet_exporter.list_snapshots()}
+
+@app.get("/api/export/snapshots/{snapshot_id}")
+def download_export_snapshot(snapshot_id: str):
+    """Re-download a previously written Parquet snapshot"""
+    return _snapshot_archive_response(snapshot_id)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,253 @@
+"""
+Durable outbound message queue and delivery worker
+Endpoints enqueue messages and return immediately; the worker drains the queue in batches with
+retries, dead-lettering and idempotency keys so provider latency never sits on the request path
+"""
+
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal, OutboundMessage
+from bots.rate_limit import backoff_delay
+from bots.whatsapp_bot import whatsapp_bot
+from bots.telegram_bot import telegram_bot
+
+CHANNELS = ("whatsapp", "telegram")
+MAX_ATTEMPTS = 5
+BATCH_SIZE = 50
+POLL_INTERVAL_SECONDS = 2.0
+# A claimed message not finished within this window is assumed lost and handed out again
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+class MessageQueue:
+    def _to_dict(self, message: OutboundMessage) -> Dict:
+        return {
+            "id": message.id,
+            "channel": message.channel,
+            "recipient": message.recipient,
+            "idempotency_key": message.idempotency_key,
+            "status": message.status,
+            "attempts": message.attempts,
+            "last_error": message.last_error,
+            "provider_message_id": message.provider_message_id,
+            "created_at": message.created_at.isoformat() if message.created_at else None,
+            "sent_at": message.sent_at.isoformat() if message.sent_at else None
+        }
+
+    def enqueue(self, db, channel: str, recipient: str, body: str, idempotency_key: Optional[str] = None) -> Dict:
+        """Persist a message for delivery; re-enqueueing the same idempotency key returns the original"""
+        return self.enqueue_many(db, [{
+            "channel": channel,
+            "recipient": recipient,
+            "body": body,
+            "idempotency_key": idempotency_key
+        }])[0]
+
+    def enqueue_many(self, db, messages: List[Dict]) -> List[Dict]:
+        """Persist many messages in one transaction, skipping idempotency keys already queued"""
+        for message in messages:
+            if message["channel"] not in CHANNELS:
+                raise ValueError(f"Unknown channel '{message['channel']}'")
+            message["idempotency_key"] = message.get("idempotency_key") or uuid.uuid4().hex
+
+        keys = [m["idempotency_key"] for m in messages]
+        try:
+            return self._insert_new(db, messages, keys)
+        except IntegrityError:
+            # A concurrent request queued one of the keys first; once more against what is stored now.
+            # A second failure is not a duplicate key and is raised
+            return self._insert_new(db, messages, keys)
+
+    def _insert_new(self, db, messages: List[Dict], keys: List[str]) -> List[Dict]:
+        existing = {
+            m.idempotency_key: m
+            for m in db.query(OutboundMessage).filter(OutboundMessage.idempotency_key.in_(keys))
+        }
+
+        queued = {}
+        for message in messages:
+            key = message["idempotency_key"]
+            if key in existing or key in queued:
+                continue
+            queued[key] = OutboundMessage(
+                channel=message["channel"],
+                recipient=message["recipient"],
+                body=message["body"],
+                idempotency_key=key,
+                status="pending",
+                attempts=0,
+                next_attempt_at=datetime.utcnow()
+            )
+        db.add_all(queued.values())
+
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise
+
+        stored = {**existing, **queued}
+        return [self._to_dict(stored[key]) for key in keys]
+
+    def get(self, db, message_id: int) -> Optional[Dict]:
+        message = db.get(OutboundMessage, message_id)
+        return self._to_dict(message) if message else None
+
+    def stats(self, db) -> Dict:
+        counts = dict(
+            db.query(OutboundMessage.status, func.count(OutboundMessage.id))
+            .group_by(OutboundMessage.status)
+            .all()
+        )
+        return {status: counts.get(status, 0) for status in ("pending", "sending", "sent", "dead")}
+
+    def requeue(self, db, message_id: int) -> Optional[Dict]:
+        """Give a dead-lettered message a fresh set of attempts; raises ValueError for any other status"""
+        # Conditional on the status in the same statement, so a message the worker is sending or has sent
+        # is never handed out again
+        result = db.execute(
+            update(OutboundMessage)
+            .where(OutboundMessage.id == message_id, OutboundMessage.status == "dead")
+            .values(status="pending", attempts=0, next_attempt_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        message = db.get(OutboundMessage, message_id)
+        if not message:
+            return None
+        if result.rowcount == 0:
+            raise ValueError(f"Message {message_id} is {message.status}; only dead messages can be retried")
+        return self._to_dict(message)
+
+
+class DeliveryWorker:
+    def __init__(self, batch_size: int = BATCH_SIZE, max_attempts: int = MAX_ATTEMPTS,
+                 poll_interval: float = POLL_INTERVAL_SECONDS):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+
+    def _configured_channels(self) -> List[str]:
+        # Messages for an unconfigured channel wait in the queue instead of burning attempts
+        channels = []
+        if whatsapp_bot.configured:
+            channels.append("whatsapp")
+        if telegram_bot.configured:
+            channels.append("telegram")
+        return channels
+
+    def claim_batch(self) -> List[Dict]:
+        """Atomically mark up to batch_size due messages as sending and return them"""
+        channels = self._configured_channels()
+        if not channels:
+            return []
+
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            due = (
+                select(OutboundMessage.id)
+                .where(OutboundMessage.channel.in_(channels))
+                .where(or_(
+                    (OutboundMessage.status == "pending") & (OutboundMessage.next_attempt_at <= now),
+                    (OutboundMessage.status == "sending") & (OutboundMessage.claimed_at < now - CLAIM_TIMEOUT)
+                ))
+                .order_by(OutboundMessage.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            ids = [row[0] for row in db.execute(due)]
+            if not ids:
+                db.rollback()
+                return []
+
+            db.execute(
+                update(OutboundMessage)
+                .where(OutboundMessage.id.in_(ids))
+                .values(status="sending", claimed_at=now, attempts=OutboundMessage.attempts + 1)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+
+            rows = db.query(OutboundMessage).filter(OutboundMessage.id.in_(ids)).order_by(OutboundMessage.id).all()
+            return [
+                {"id": m.id, "channel": m.channel, "recipient": m.recipient, "body": m.body, "attempts": m.attempts}
+                for m in rows
+            ]
+        finally:
+            db.close()
+
+    def record_results(self, batch: List[Dict], results: List[Dict]):
+        """Mark each message sent, scheduled for retry, or dead-lettered"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            for item, result in zip(batch, results):
+                message = db.get(OutboundMessage, item["id"])
+                if result["status"] == "success":
+                    message.status = "sent"
+                    message.sent_at = now
+                    message.last_error = None
+                    message.provider_message_id = str(result.get("message_sid") or result.get("message_id") or "")
+                elif result.get("retryable", True) and message.attempts < self.max_attempts:
+                    message.status = "pending"
+                    message.last_error = result.get("message")
+                    message.next_attempt_at = now + timedelta(seconds=backoff_delay(message.attempts, base=5, cap=900))
+                else:
+                    message.status = "dead"
+                    message.last_error = result.get("message")
+            db.commit()
+        finally:
+            db.close()
+
+    async def deliver(self, batch: List[Dict]) -> List[Dict]:
+        """Send a claimed batch through each channel's bulk path; one result per message, in order"""
+        results = [None] * len(batch)
+
+        whatsapp = [(i, m) for i, m in enumerate(batch) if m["channel"] == "whatsapp"]
+        if whatsapp:
+            recipients = [{"phone": m["recipient"], "message": m["body"]} for _, m in whatsapp]
+            # Retries are owned by the queue, so the bots make a single attempt per claim
+            sent = await asyncio.to_thread(whatsapp_bot.send_bulk_messages, recipients, "", None, 0)
+            for (i, _), result in zip(whatsapp, sent):
+                results[i] = result
+
+        telegram = [(i, m) for i, m in enumerate(batch) if m["channel"] == "telegram"]
+        if telegram:
+            sent = await telegram_bot.send_bulk_messages(
+                [m["recipient"] for _, m in telegram], "",
+                max_retries=0,
+                messages=[m["body"] for _, m in telegram]
+            )
+            for (i, _), result in zip(telegram, sent):
+                results[i] = result
+
+        return results
+
+    async def drain_once(self) -> int:
+        batch = await asyncio.to_thread(self.claim_batch)
+        if not batch:
+            return 0
+        results = await self.deliver(batch)
+        await asyncio.to_thread(self.record_results, batch, results)
+        return len(batch)
+
+    async def run_forever(self):
+        while True:
+            try:
+                processed = await self.drain_once()
+            except Exception as e:
+                print(f"Delivery worker error: {e}")
+                processed = 0
+            if processed < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+
+message_queue = MessageQueue()
+delivery_worker = DeliveryWorker()
@@ -0,0 +1,224 @@
+"""
+Request-level performance metrics, exposed in Prometheus text format on /metrics
+Per-route latency and payload-size histograms, SQL query count and time per request (from SQLAlchemy
+cursor events), and latency of calls to external APIs (OpenAI, Twilio, Telegram). Everything is kept in
+process memory, so under serve_production.py each worker reports its own requests
+
+    python backend/metrics.py                          # overhead the middleware adds per request
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# [query count, query seconds] of the request being handled; the threadpool copies the context into
+# sync endpoints, so their queries land in the same list
+_request_queries: ContextVar[Optional[List[float]]] = ContextVar("request_queries", default=None)
+
+
+def _labels(names: Sequence[str], values: Tuple) -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return ",".join(pairs)
+
+
+class _Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Label values -> per-bucket counts (last slot is +Inf), sum
+        self._series: Dict[Tuple, List] = {}
+
+    def observe(self, values: Tuple, amount: float):
+        series = self._series.get(values)
+        if series is None:
+            series = self._series[values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, amount)] += 1
+        series[1] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total) in sorted(self._series.items()):
+            labels = _labels(self.labels, values)
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for le, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_seconds = _Histogram(
+            "kechita_http_request_duration_seconds", "Time from request start to the last response byte",
+            ("method", "route", "status"), LATENCY_BUCKETS)
+        self.request_bytes = _Histogram(
+            "kechita_http_request_size_bytes", "Request body size",
+            ("method", "route"), SIZE_BUCKETS)
+        self.response_bytes = _Histogram(
+            "kechita_http_response_size_bytes", "Response body size as sent, after compression",
+            ("method", "route"), SIZE_BUCKETS)
+        self.request_queries = _Histogram(
+            "kechita_http_request_db_queries", "SQL statements executed while handling a request",
+            ("method", "route"), QUERY_COUNT_BUCKETS)
+        self.request_query_seconds = _Histogram(
+            "kechita_http_request_db_seconds", "Time spent in SQL statements while handling a request",
+            ("method", "route"), LATENCY_BUCKETS)
+        self.query_seconds = _Histogram(
+            "kechita_db_query_duration_seconds", "SQL statement execution time, inside and outside requests",
+            ("statement",), QUERY_LATENCY_BUCKETS)
+        self.external_seconds = _Histogram(
+            "kechita_external_request_duration_seconds", "Latency of calls to external APIs",
+            ("service", "operation", "outcome"), LATENCY_BUCKETS)
+        self._histograms = [
+            self.request_seconds, self.request_bytes, self.response_bytes, self.request_queries,
+            self.request_query_seconds, self.query_seconds, self.external_seconds,
+        ]
+        # Callables returning {metric name: (type, help, value)}, read at scrape time
+        self._sources: List[Callable[[], Dict[str, Tuple[str, str, float]]]] = []
+
+    def observe(self, histogram: _Histogram, values: Tuple, amount: float):
+        with self._lock:
+            histogram.observe(values, amount)
+
+    def add_source(self, source: Callable[[], Dict[str, Tuple[str, str, float]]]):
+        """Counters and gauges kept elsewhere (e.g. cache hit counts), exported alongside the histograms"""
+        self._sources.append(source)
+
+    def instrument_engine(self, engine):
+        """Time every statement the engine executes and charge it to the current request"""
+        @event.listens_for(engine, "before_cursor_execute")
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info["query_started"].pop()
+            kind = (statement.split(None, 1) or ["OTHER"])[0].upper()
+            self.observe(self.query_seconds, (kind,), elapsed)
+            current = _request_queries.get()
+            if current is not None:
+                current[0] += 1
+                current[1] += elapsed
+
+        @event.listens_for(engine, "handle_error")
+        def failed(context):
+            # A failed statement never reaches after_cursor_execute
+            if context.connection is not None and context.connection.info.get("query_started"):
+                context.connection.info["query_started"].pop()
+
+    @contextmanager
+    def external(self, service: str, operation: str):
+        """Time a call to an external API; errors are recorded with outcome="error" and re-raised"""
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.observe(self.external_seconds, (service, operation, outcome), time.perf_counter() - started)
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [line for histogram in self._histograms for line in histogram.render()]
+        for source in self._sources:
+            for name, (kind, help, value) in source().items():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = RequestMetrics()
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status, received, sent = 500, 0, 0
+        queries = [0, 0.0]
+        token = _request_queries.set(queries)
+
+        async def counted_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+
+        async def counted_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counted_receive, counted_send)
+        finally:
+            _request_queries.reset(token)
+            # The route template, not the raw path, so ids in the URL don't explode the label set
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            metrics.observe(metrics.request_seconds, (method, route, str(status)), time.perf_counter() - started)
+            metrics.observe(metrics.request_bytes, (method, route), received)
+            metrics.observe(metrics.response_bytes, (method, route), sent)
+            metrics.observe(metrics.request_queries, (method, route), queries[0])
+            metrics.observe(metrics.request_query_seconds, (method, route), queries[1])
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    class _Route:
+        path = "/items/{item_id}"
+
+    async def endpoint(scope, receive, send):
+        scope["route"] = _Route
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b'{"id":1}'})
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def mean_us(app, repeat: int = 50_000) -> float:
+        scope = {"type": "http", "method": "GET", "path": "/items/1"}
+        started = time.perf_counter()
+        for _ in range(repeat):
+            await app(dict(scope), receive, send)
+        return (time.perf_counter() - started) / repeat * 1e6
+
+    plain = asyncio.run(mean_us(endpoint))
+    instrumented = asyncio.run(mean_us(MetricsMiddleware(endpoint)))
+    print(f"bare ASGI app {plain:.1f} us/request, with MetricsMiddleware {instrumented:.1f} us/request "
+          f"(+{instrumented - plain:.1f} us)")
+    render_started = time.perf_counter()
+    text = metrics.render()
+    print(f"/metrics body: {len(text):,} bytes rendered in {(time.perf_counter() - render_started) * 1000:.2f} ms")
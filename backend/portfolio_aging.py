@@ -0,0 +1,112 @@
+"""
+Portfolio-at-risk (PAR) aging engine
+Computes outstanding balance per loan and buckets it by days past due at loan, branch, region and portfolio level
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Days-past-due thresholds for PAR1 / PAR30 / PAR60 / PAR90
+PAR_THRESHOLDS = [1, 30, 60, 90]
+AGING_BANDS = ["current", "1-29", "30-59", "60-89", "90+"]
+LEVELS = {"portfolio": None, "branch": "branch", "region": "region"}
+
+
+class PortfolioAgingEngine:
+    def loan_aging(self, loans: pd.DataFrame, collections: pd.DataFrame, as_of: Optional[datetime] = None) -> pd.DataFrame:
+        """Outstanding balance, days past due and aging band for every loan"""
+        as_of = pd.Timestamp(as_of or datetime.now()).normalize()
+
+        # One groupby over collections, hash-joined back onto loans
+        collected = collections.groupby("loan_id", observed=True)["amount"].sum()
+        aged = loans[["loan_id", "branch", "region", "disbursement_amount", "due_date"]].copy()
+        aged["collected"] = aged["loan_id"].map(collected).astype(float).fillna(0.0).to_numpy()
+
+        outstanding = (aged["disbursement_amount"].to_numpy(dtype=float) - aged["collected"].to_numpy())
+        outstanding = np.clip(outstanding, 0, None)
+
+        due = pd.to_datetime(aged["due_date"], format="%Y-%m-%d", errors="coerce").to_numpy(dtype="datetime64[D]")
+        days = (np.datetime64(as_of.date(), "D") - due).astype("timedelta64[D]").astype(float)
+        days = np.nan_to_num(days, nan=0.0)
+        # A fully repaid loan is never in arrears, however late its due date
+        days = np.where(outstanding > 0, np.clip(days, 0, None), 0).astype(np.int64)
+
+        aged["outstanding"] = outstanding
+        aged["days_past_due"] = days
+        aged["aging_band"] = np.searchsorted(PAR_THRESHOLDS, days, side="right")
+        return aged
+
+    def par_report(self, loans: pd.DataFrame, collections: pd.DataFrame, level: str = "portfolio",
+                   as_of: Optional[datetime] = None) -> List[Dict]:
+        """PAR1/PAR30/PAR60/PAR90 amounts and ratios grouped by portfolio, branch or region"""
+        if level not in LEVELS:
+            raise ValueError(f"Unknown level '{level}'. Choose one of: {', '.join(LEVELS)}")
+
+        aged = self.loan_aging(loans, collections, as_of)
+        group_col = LEVELS[level]
+        keys = aged[group_col] if group_col else pd.Series("portfolio", index=aged.index)
+
+        # Outstanding per (group, band); each PAR-n is the sum of bands at or beyond n days
+        bands = (
+            aged.groupby([keys, aged["aging_band"]], observed=True)["outstanding"].sum()
+            .unstack(fill_value=0.0)
+            .reindex(columns=range(len(AGING_BANDS)), fill_value=0.0)
+        )
+        band_values = bands.to_numpy()
+        par_values = np.cumsum(band_values[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        total = band_values.sum(axis=1)
+
+        in_arrears = (aged["aging_band"] > 0).groupby(keys, observed=True).sum().reindex(bands.index, fill_value=0)
+        loan_count = keys.groupby(keys, observed=True).size().reindex(bands.index, fill_value=0)
+
+        ratios = np.divide(par_values * 100, total[:, None], out=np.zeros_like(par_values), where=total[:, None] > 0)
+
+        rows = []
+        for i, name in enumerate(bands.index):
+            row = {
+                level: name,
+                "outstanding_portfolio": float(total[i]),
+                "loan_count": int(loan_count.iloc[i]),
+                "loans_in_arrears": int(in_arrears.iloc[i]),
+                "aging": {band: float(band_values[i, j]) for j, band in enumerate(AGING_BANDS)},
+            }
+            for j, threshold in enumerate(PAR_THRESHOLDS):
+                row[f"par{threshold}"] = float(par_values[i, j])
+                row[f"par{threshold}_ratio"] = round(float(ratios[i, j]), 2)
+            rows.append(row)
+        return rows
+
+
+portfolio_aging_engine = PortfolioAgingEngine()
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(42)
+    num_loans = 1_000_000
+    num_branches = 1_000
+    today = np.datetime64(datetime.now().date(), "D")
+
+    branch_ids = rng.integers(0, num_branches, num_loans)
+    loans = pd.DataFrame({
+        "loan_id": np.arange(num_loans),
+        "branch": pd.Categorical.from_codes(branch_ids, [f"Branch {i}" for i in range(num_branches)]),
+        "region": pd.Categorical.from_codes(branch_ids % 8, [f"Region {i}" for i in range(8)]),
+        "disbursement_amount": rng.integers(5_000, 500_000, num_loans).astype(float),
+        "due_date": (today + rng.integers(-365, 180, num_loans)).astype(str),
+    })
+    num_collections = 4 * num_loans
+    collections = pd.DataFrame({
+        "loan_id": rng.integers(0, num_loans, num_collections),
+        "amount": rng.uniform(100, 60_000, num_collections),
+    })
+
+    for level in LEVELS:
+        start = time.perf_counter()
+        report = portfolio_aging_engine.par_report(loans, collections, level)
+        print(f"{level:>9}: {len(report):>5} rows in {time.perf_counter() - start:.2f}s "
+              f"({num_loans:,} loans, {num_collections:,} collections)")
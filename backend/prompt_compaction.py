@@ -0,0 +1,169 @@
+"""
+Prompt compaction for portfolio-wide AI prompts
+Summarises any number of branches into quantiles, region aggregates, outliers and top/bottom-N
+tables in a compact pipe-separated encoding that fits a token budget
+"""
+
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_TOKEN_BUDGET = 1500
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+# (top/bottom N, max regions, max outliers), tried from richest to leanest until one fits
+DETAIL_LEVELS = [
+    (10, 50, 10),
+    (5, 20, 5),
+    (3, 10, 3),
+    (1, 5, 1),
+    (0, 0, 0),
+]
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _ENCODING = None
+
+
+def count_tokens(text: str) -> int:
+    """Exact count with tiktoken when installed, otherwise the usual ~4 characters per token"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return max(1, -(-len(text) // 4))
+
+
+def _millions(value: float) -> str:
+    return f"{value / 1e6:.1f}"
+
+
+def _table(header: List[str], rows: List[List[str]]) -> str:
+    return "\n".join("|".join(row) for row in [header] + rows)
+
+
+class PortfolioPromptBuilder:
+    def __init__(self):
+        self._cached = None
+
+    def _frame(self, branches: Union[pd.DataFrame, List[Dict]]) -> pd.DataFrame:
+        frame = branches if isinstance(branches, pd.DataFrame) else pd.DataFrame(branches)
+        frame = frame.copy()
+        if "region" not in frame:
+            frame["region"] = "Unknown"
+        frame["region"] = frame["region"].fillna("Unknown").astype(str)
+        disbursed = frame["total_disbursements"].to_numpy(dtype=float)
+        collected = frame["total_collections"].to_numpy(dtype=float)
+        frame["collection_rate"] = np.divide(collected * 100, disbursed, out=np.zeros_like(disbursed), where=disbursed > 0)
+        return frame
+
+    def _sections(self, frame: pd.DataFrame, top_n: int, max_regions: int, max_outliers: int) -> List[str]:
+        rates = frame["collection_rate"].to_numpy()
+        disbursed = float(frame["total_disbursements"].sum())
+        collected = float(frame["total_collections"].sum())
+
+        sections = [
+            "Amounts in KES millions; rate = collections / disbursements %.",
+            f"Portfolio: branches={len(frame)} disbursed={_millions(disbursed)} collected={_millions(collected)} "
+            f"arrears={_millions(disbursed - collected)} rate={collected / disbursed * 100 if disbursed else 0:.1f}",
+        ]
+
+        if len(frame):
+            q = np.quantile(rates, QUANTILES)
+            sections.append(
+                "Rate distribution: "
+                f"min={rates.min():.1f} " + " ".join(f"p{int(p * 100)}={v:.1f}" for p, v in zip(QUANTILES, q))
+                + f" max={rates.max():.1f} mean={rates.mean():.1f} std={rates.std():.1f}"
+            )
+
+        if max_regions:
+            regions = (
+                frame.groupby("region", sort=False)
+                .agg(branches=("region", "size"), disbursed=("total_disbursements", "sum"),
+                     collected=("total_collections", "sum"))
+                .sort_values("disbursed", ascending=False)
+            )
+            shown = regions.head(max_regions)
+            rows = [
+                [name, str(int(r.branches)), _millions(r.disbursed), _millions(r.collected),
+                 f"{r.collected / r.disbursed * 100 if r.disbursed else 0:.1f}"]
+                for name, r in shown.iterrows()
+            ]
+            title = "Regions" if len(shown) == len(regions) else f"Regions (largest {len(shown)} of {len(regions)})"
+            sections.append(f"{title}:\n" + _table(["region", "branches", "disbursed", "collected", "rate"], rows))
+
+        if top_n and len(frame):
+            order = np.argsort(rates, kind="stable")
+            columns = ["branch", "region", "disbursed", "rate"]
+
+            def rows_for(idx):
+                return [
+                    [str(frame["branch"].iat[i]), frame["region"].iat[i],
+                     _millions(frame["total_disbursements"].iat[i]), f"{rates[i]:.1f}"]
+                    for i in idx
+                ]
+
+            n = min(top_n, len(frame))
+            sections.append(f"Top {n} by rate:\n" + _table(columns, rows_for(order[::-1][:n])))
+            sections.append(f"Bottom {n} by rate:\n" + _table(columns, rows_for(order[:n])))
+
+        if max_outliers and len(frame) >= 4:
+            q1, q3 = np.quantile(rates, [0.25, 0.75])
+            fence = 1.5 * (q3 - q1)
+            distance = np.maximum(q1 - fence - rates, rates - q3 - fence)
+            idx = np.flatnonzero(distance > 0)
+            if idx.size:
+                idx = idx[np.argsort(-distance[idx])][:max_outliers]
+                rows = [[str(frame["branch"].iat[i]), f"{rates[i]:.1f}"] for i in idx]
+                sections.append(
+                    f"Outliers outside the IQR fences ({q1 - fence:.1f}-{q3 + fence:.1f}), {idx.size} shown:\n"
+                    + _table(["branch", "rate"], rows)
+                )
+
+        return sections
+
+    def build(self, branches: Union[pd.DataFrame, List[Dict]], token_budget: int = DEFAULT_TOKEN_BUDGET) -> Dict:
+        """Richest portfolio summary that fits token_budget; returns text plus its token count"""
+        cached = self._cached
+        if cached is not None and cached[0] is branches and cached[1] == token_budget:
+            return cached[2]
+
+        frame = self._frame(branches)
+        for top_n, max_regions, max_outliers in DETAIL_LEVELS:
+            text = "\n\n".join(self._sections(frame, top_n, max_regions, max_outliers))
+            tokens = count_tokens(text)
+            if tokens <= token_budget:
+                break
+
+        result = {
+            "text": text,
+            "tokens": tokens,
+            "token_budget": token_budget,
+            "within_budget": tokens <= token_budget,
+            "branches": len(frame),
+            "detail": {"top_n": top_n, "max_regions": max_regions, "max_outliers": max_outliers},
+        }
+        self._cached = (branches, token_budget, result)
+        return result
+
+
+portfolio_prompt_builder = PortfolioPromptBuilder()
+
+
+if __name__ == "__main__":
+    import json
+
+    rng = np.random.default_rng(7)
+    for n in (100, 1_000, 10_000):
+        disbursed = rng.uniform(5e6, 5e7, n)
+        branches = pd.DataFrame({
+            "branch": [f"Branch {i}" for i in range(n)],
+            "region": rng.choice(["Nairobi", "Coast", "Rift Valley", "Nyanza", "Central", "Western"], n),
+            "total_disbursements": disbursed,
+            "total_collections": disbursed * rng.uniform(0.55, 0.98, n),
+        })
+        naive = count_tokens(json.dumps(branches.to_dict(orient="records"), indent=2))
+        compact = portfolio_prompt_builder.build(branches)
+        print(f"{n:>6} branches: indented JSON {naive:>9,} tokens | compact {compact['tokens']:>5,} tokens "
+              f"(detail {compact['detail']})")
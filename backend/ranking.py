@@ -0,0 +1,135 @@
+"""
+Ranking engine for top/bottom-N queries over branches, customers and loans.
+Selects the N best rows with argpartition selection instead of sorting the whole set.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+
+from database import Branch, Loan, Collection, Customer
+
+BRANCH_METRICS = ["collection_rate", "total_disbursements", "total_collections", "total_arrears", "customer_count"]
+CUSTOMER_METRICS = ["arrears", "total_disbursed", "total_collected", "loan_count"]
+LOAN_METRICS = ["outstanding", "disbursement_amount", "total_collected"]
+
+PERFORMANCE_EDGES = [80, 90]
+PERFORMANCE_LABELS = ["needs_improvement", "good", "excellent"]
+
+
+class RankingEngine:
+    def __init__(self):
+        self._rollups = {}
+
+    def top_n(self, df: pd.DataFrame, metric: str, n: int, ascending: bool = False) -> pd.DataFrame:
+        """Return the n rows with the highest (or lowest) metric, ordered, in O(len(df))"""
+        n = max(0, min(int(n), len(df)))
+        if n == 0:
+            return df.iloc[0:0]
+
+        keys = df[metric].to_numpy(dtype=float, na_value=np.nan)
+        if not ascending:
+            keys = -keys
+        # NaN never wins a ranking
+        keys = np.where(np.isnan(keys), np.inf, keys)
+
+        if n < len(keys):
+            idx = np.argpartition(keys, n - 1)[:n]
+        else:
+            idx = np.arange(len(keys))
+        idx = idx[np.argsort(keys[idx], kind="stable")]
+        return df.iloc[idx]
+
+    def bucket_counts(self, values, edges=PERFORMANCE_EDGES, labels=PERFORMANCE_LABELS) -> Dict[str, int]:
+        """Histogram values into labelled buckets in a single pass"""
+        values = np.asarray(values, dtype=float)
+        bins = np.searchsorted(np.asarray(edges, dtype=float), values, side="right")
+        counts = np.bincount(bins, minlength=len(labels))
+        return {label: int(count) for label, count in zip(labels, counts)}
+
+    def branch_rollup_query(self):
+        """Single aggregate query with one row of metrics per branch"""
+        loan_totals = (
+            select(Loan.branch_id, func.sum(Loan.disbursement_amount).label("total_disbursements"))
+            .group_by(Loan.branch_id)
+            .subquery()
+        )
+        collection_totals = (
+            select(Collection.branch_id, func.sum(Collection.amount).label("total_collections"))
+            .group_by(Collection.branch_id)
+            .subquery()
+        )
+        customer_totals = (
+            select(Customer.branch_id, func.count(Customer.id).label("customer_count"))
+            .group_by(Customer.branch_id)
+            .subquery()
+        )
+
+        disbursed = func.coalesce(loan_totals.c.total_disbursements, 0)
+        collected = func.coalesce(collection_totals.c.total_collections, 0)
+        return (
+            select(
+                Branch.name.label("branch"),
+                Branch.region.label("region"),
+                disbursed.label("total_disbursements"),
+                collected.label("total_collections"),
+                (disbursed - collected).label("total_arrears"),
+                func.coalesce(collected * 100.0 / func.nullif(disbursed, 0), 0).label("collection_rate"),
+                func.coalesce(customer_totals.c.customer_count, 0).label("customer_count"),
+            )
+            .outerjoin(loan_totals, loan_totals.c.branch_id == Branch.id)
+            .outerjoin(collection_totals, collection_totals.c.branch_id == Branch.id)
+            .outerjoin(customer_totals, customer_totals.c.branch_id == Branch.id)
+        )
+
+    def top_branches_sql(self, db, metric: str, n: int, ascending: bool = False) -> List[Dict]:
+        """Rank branches in the database with ORDER BY ... LIMIT over the branch rollup"""
+        rollup = self.branch_rollup_query().subquery()
+        column = rollup.c[metric]
+        query = select(rollup).order_by(column.asc() if ascending else column.desc(), rollup.c.branch).limit(n)
+
+        rows = []
+        for row in db.execute(query).mappings():
+            row = dict(row)
+            row["collection_rate"] = round(float(row["collection_rate"]), 2)
+            rows.append(row)
+        return rows
+
+    def customer_rollup(self, data: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+        """Per-customer disbursed/collected/arrears totals, cached per dataset"""
+        loans, collections = data["loans"], data["collections"]
+        cached = self._rollups.get("customers")
+        if cached is None or cached[0] is not loans or cached[1] is not collections:
+            disbursed = loans.groupby("customer_id", observed=True)["disbursement_amount"].agg(["sum", "count"])
+            collected = collections.groupby("customer_id", observed=True)["amount"].sum()
+
+            rollup = data["customers"][["customer_id", "name", "branch", "region"]].set_index("customer_id")
+            rollup = rollup.assign(
+                total_disbursed=disbursed["sum"].reindex(rollup.index, fill_value=0),
+                total_collected=collected.reindex(rollup.index, fill_value=0),
+                loan_count=disbursed["count"].reindex(rollup.index, fill_value=0),
+            )
+            rollup["arrears"] = rollup["total_disbursed"] - rollup["total_collected"]
+            cached = (loans, collections, rollup.reset_index())
+            self._rollups["customers"] = cached
+        return cached[2]
+
+    def loan_rollup(self, data: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+        """Per-loan collected/outstanding totals, cached per dataset"""
+        loans, collections = data["loans"], data["collections"]
+        cached = self._rollups.get("loans")
+        if cached is None or cached[0] is not loans or cached[1] is not collections:
+            collected = collections.groupby("loan_id", observed=True)["amount"].sum()
+
+            rollup = loans[["loan_id", "customer_id", "customer_name", "branch", "region",
+                            "disbursement_amount", "due_date"]].copy()
+            rollup["total_collected"] = rollup["loan_id"].map(collected).fillna(0).astype(float)
+            rollup["outstanding"] = rollup["disbursement_amount"] - rollup["total_collected"]
+            cached = (loans, collections, rollup)
+            self._rollups["loans"] = cached
+        return cached[2]
+
+
+ranking_engine = RankingEngine()
@@ -0,0 +1,180 @@
+"""
+Daily report fan-out
+Computes every branch's metrics in one aggregate pass, renders each branch's WhatsApp/Telegram
+report once and queues a copy for every recipient in the report directory
+"""
+
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from database import ReportRecipient, JobRun
+from bots.templates import message_templates, timestamp_context
+from message_queue import message_queue, CHANNELS
+from ranking import ranking_engine
+
+JOB_NAME = "daily_reports"
+
+
+class DailyReportScheduler:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def branch_metrics_sql(self, db) -> pd.DataFrame:
+        """All branch metrics from the database in a single aggregate query"""
+        metrics = pd.read_sql(ranking_engine.branch_rollup_query().order_by("branch"), db.connection())
+        metrics["collection_rate"] = metrics["collection_rate"].astype(float).round(2)
+        return metrics
+
+    def branch_metrics_sample(self, sample_data: List[Dict]) -> pd.DataFrame:
+        """Same shape as branch_metrics_sql, built from the sample dataset"""
+        metrics = pd.DataFrame(sample_data).rename(columns={
+            "disbursements": "total_disbursements",
+            "collections": "total_collections",
+            "arrears": "total_arrears"
+        })
+        metrics["collection_rate"] = (metrics["total_collections"] / metrics["total_disbursements"] * 100).round(2)
+        return metrics
+
+    def summarize(self, metrics: pd.DataFrame) -> Dict:
+        """Portfolio summary derived from the branch metrics instead of another round of queries"""
+        disbursed = float(metrics["total_disbursements"].sum())
+        collected = float(metrics["total_collections"].sum())
+        return {
+            "total_disbursements": disbursed,
+            "total_collections": collected,
+            "total_arrears": disbursed - collected,
+            "total_customers": int(metrics["customer_count"].sum()),
+            "overall_collection_rate": round(collected / disbursed * 100, 2) if disbursed > 0 else 0,
+            "branch_count": len(metrics)
+        }
+
+    def render(self, metrics: pd.DataFrame, recipients: List[ReportRecipient], report_date: date) -> Dict:
+        """Build one queue entry per recipient, rendering each (channel, branch) report only once"""
+        branches = metrics.set_index("branch").to_dict(orient="index")
+        context = timestamp_context()
+        rendered = {}
+
+        for channel in {r.channel for r in recipients}:
+            wanted = {r.branch for r in recipients if r.channel == channel}
+            if None in wanted:
+                rendered[(channel, None)] = message_templates.compiled("daily_summary", channel).render(
+                    self.summarize(metrics), context
+                )
+            names = sorted(b for b in wanted if b in branches)
+            bodies = message_templates.compiled("branch_performance", channel).render_batch(
+                ({"branch": name, **branches[name]} for name in names), context
+            )
+            rendered.update(((channel, name), body) for name, body in zip(names, bodies))
+
+        messages, skipped = [], []
+        for recipient in recipients:
+            body = rendered.get((recipient.channel, recipient.branch))
+            if body is None:
+                skipped.append({"recipient_id": recipient.id, "reason": f"Unknown branch '{recipient.branch}'"})
+                continue
+
+            messages.append({
+                "channel": recipient.channel,
+                "recipient": recipient.address,
+                "body": body,
+                # One report per recipient per day, however often the job runs
+                "idempotency_key": f"{JOB_NAME}:{report_date.isoformat()}:{recipient.id}"
+            })
+
+        return {"messages": messages, "skipped": skipped, "templates_rendered": len(rendered)}
+
+    def is_due(self, db, report_hour: int, now: Optional[datetime] = None) -> bool:
+        """True once report_hour has passed and today's reports have not gone out yet"""
+        now = now or datetime.now()
+        if now.hour < report_hour:
+            return False
+        job = db.query(JobRun).filter(JobRun.name == JOB_NAME).first()
+        return job is None or job.last_run_at is None or job.last_run_at.date() < now.date()
+
+    def run(self, db, metrics: pd.DataFrame, report_date: Optional[date] = None) -> Dict:
+        """Render and queue today's reports for every active recipient"""
+        with self._lock:
+            started = time.perf_counter()
+            report_date = report_date or date.today()
+
+            recipients = (
+                db.query(ReportRecipient)
+                .filter(ReportRecipient.active.is_(True))
+                .order_by(ReportRecipient.id)
+                .all()
+            )
+            rendered = self.render(metrics, recipients, report_date)
+            queued = message_queue.enqueue_many(db, rendered["messages"]) if rendered["messages"] else []
+
+            job = db.query(JobRun).filter(JobRun.name == JOB_NAME).first()
+            if not job:
+                job = JobRun(name=JOB_NAME)
+                db.add(job)
+            job.last_run_at = datetime.now()
+            job.last_result = f"{len(queued)} reports queued for {report_date.isoformat()}"
+            db.commit()
+
+            return {
+                "job": JOB_NAME,
+                "report_date": report_date.isoformat(),
+                "branches": len(metrics),
+                "recipients": len(recipients),
+                "templates_rendered": rendered["templates_rendered"],
+                "queued": len(queued),
+                "skipped": rendered["skipped"],
+                "duration_seconds": round(time.perf_counter() - started, 3)
+            }
+
+    def list_recipients(self, db) -> List[Dict]:
+        return [
+            {
+                "id": r.id,
+                "name": r.name,
+                "channel": r.channel,
+                "address": r.address,
+                "branch": r.branch,
+                "active": r.active
+            }
+            for r in db.query(ReportRecipient).order_by(ReportRecipient.id)
+        ]
+
+    def add_recipients(self, db, recipients: List[Dict]) -> List[Dict]:
+        """Add or reactivate directory entries, keyed on (channel, address, branch)"""
+        for recipient in recipients:
+            if recipient["channel"] not in CHANNELS:
+                raise ValueError(f"Unknown channel '{recipient['channel']}'")
+
+        for recipient in recipients:
+            existing = db.query(ReportRecipient).filter(
+                ReportRecipient.channel == recipient["channel"],
+                ReportRecipient.address == recipient["address"],
+                ReportRecipient.branch.is_not_distinct_from(recipient.get("branch"))
+            ).first()
+            if existing:
+                existing.name = recipient.get("name") or existing.name
+                existing.active = True
+            else:
+                db.add(ReportRecipient(
+                    name=recipient.get("name"),
+                    channel=recipient["channel"],
+                    address=recipient["address"],
+                    branch=recipient.get("branch"),
+                    active=True
+                ))
+        db.commit()
+        return self.list_recipients(db)
+
+    def remove_recipient(self, db, recipient_id: int) -> bool:
+        recipient = db.get(ReportRecipient, recipient_id)
+        if not recipient:
+            return False
+        db.delete(recipient)
+        db.commit()
+        return True
+
+
+daily_report_scheduler = DailyReportScheduler()
@@ -1,111 +1,266 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List
-import pandas as pd
-from datetime import datetime
+"""
+Production launcher: prefork multi-worker server for the full API in main.py
+The parent loads the dataset, warms every derived cache and binds the socket once, then forks N uvicorn
+workers that share all of it copy-on-write. Dead workers are re-forked from the warm parent instantly.
+
+    python backend/serve_production.py                 # workers sized to the available cores
+    python backend/serve_production.py --workers 4
+    python backend/serve_production.py --benchmark     # RPS and memory for 1, 2, 4 and 8 workers
+"""
+
+import argparse
+import gc
 import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+PORT = int(os.getenv("PORT", "5000"))
+HOST = os.getenv("HOST", "0.0.0.0")
+WEB_CONCURRENCY = os.getenv("WEB_CONCURRENCY")
+# A worker that keeps dying right after fork is restarted at most this often
+RESTART_BACKOFF_SECONDS = 1.0
 
-app = FastAPI(title="Kechita Intelligence Platform API")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-class BranchMetrics(BaseModel):
-    branch: str
-    total_disbursements: float
-    total_collections: float
-    total_arrears: float
-    collection_rate: float
-    customer_count: int
-
-sample_data = [
-    {"branch": "Nairobi Central", "disbursements": 5000000, "collections": 4200000, "arrears": 800000, "customer_count": 150},
-    {"branch": "Mombasa", "disbursements": 3500000, "collections": 3100000, "arrears": 400000, "customer_count": 120},
-    {"branch": "Kisumu", "disbursements": 2800000, "collections": 2600000, "arrears": 200000, "customer_count": 95},
-    {"branch": "Nakuru", "disbursements": 4200000, "collections": 3800000, "arrears": 400000, "customer_count": 135},
-    {"branch": "Eldoret", "disbursements": 3100000, "collections": 2900000, "arrears": 200000, "customer_count": 100},
+BENCHMARK_WORKERS = [1, 2, 4, 8]
+BENCHMARK_PATHS = [
+    "/api/branches",
+    "/api/summary",
+    "/api/customers?limit=50",
+    "/api/loans?limit=50",
+    "/api/analytics/trends",
 ]
 
-@app.get("/api/health")
-def health_check():
-    return {
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat()
-    }
-
-@app.get("/api/branches", response_model=List[BranchMetrics])
-def get_branches():
-    df = pd.DataFrame(sample_data)
-    df['collection_rate'] = (df['collections'] / df['disbursements'] * 100).round(2)
-    
-    metrics = []
-    for _, row in df.iterrows():
-        metrics.append(BranchMetrics(
-            branch=row['branch'],
-            total_disbursements=row['disbursements'],
-            total_collections=row['collections'],
-            total_arrears=row['arrears'],
-            collection_rate=row['collection_rate'],
-            customer_count=row['customer_count']
-        ))
-    
-    return metrics
-
-@app.get("/api/summary")
-def get_summary():
-    df = pd.DataFrame(sample_data)
-    
-    total_disbursements = float(df['disbursements'].sum())
-    total_collections = float(df['collections'].sum())
-    total_arrears = float(df['arrears'].sum())
-    total_customers = int(df['customer_count'].sum())
-    overall_collection_rate = round(total_collections / total_disbursements * 100, 2)
-    
-    return {
-        "total_disbursements": total_disbursements,
-        "total_collections": total_collections,
-        "total_arrears": total_arrears,
-        "total_customers": total_customers,
-        "overall_collection_rate": overall_collection_rate,
-        "branch_count": len(sample_data)
-    }
-
-@app.get("/api/top-performers")
-def get_top_performers():
-    df = pd.DataFrame(sample_data)
-    df['collection_rate'] = (df['collections'] / df['disbursements'] * 100).round(2)
-    df = df.sort_values('collection_rate', ascending=False)
-    
-    return df.head(3).to_dict(orient='records')
-
-@app.get("/api/ai/insights")
-def get_ai_insights():
-    df = pd.DataFrame(sample_data)
-    df['collection_rate'] = (df['collections'] / df['disbursements'] * 100).round(2)
-    
-    best_branch = df.loc[df['collection_rate'].idxmax()]
-    worst_branch = df.loc[df['collection_rate'].idxmin()]
-    
-    insights = [
-        f"Top performing branch: {best_branch['branch']} with {best_branch['collection_rate']:.1f}% collection rate",
-        f"Branch requiring attention: {worst_branch['branch']} with {worst_branch['collection_rate']:.1f}% collection rate",
-        f"Average arrears across all branches: KES {df['arrears'].mean():,.0f}",
-        f"Total customer base: {df['customer_count'].sum()} clients across {len(df)} branches"
-    ]
-    
-    return {"insights": insights}
-
-frontend_dist = os.path.join(os.path.dirname(__file__), "..", "frontend", "dist")
-if os.path.exists(frontend_dist):
-    app.mount("/", StaticFiles(directory=frontend_dist, html=True), name="static")
 
-if __name__ == "__main__":
+def default_workers() -> int:
+    """One worker per core this process may run on"""
+    if WEB_CONCURRENCY:
+        return max(1, int(WEB_CONCURRENCY))
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+
+def load_application():
+    """Import the app (which builds the dataset) and warm the caches derived from it, all before forking"""
+    started = time.perf_counter()
+    import main
+    from database import engine
+    from loan_status import loan_status_engine
+    from ranking import ranking_engine
+    from shared_dataset import shared_dataset, SHARED_DATASET_ENV
+
+    # Statuses are settled before publishing; workers all serve this one classification and never rewrite it
+    loan_status_engine.reclassify_frame(main.enhanced_full_data["loans"], main.enhanced_full_data["collections"])
+    # Workers read the dataset from one shared memory segment instead of each holding a private copy:
+    # forked workers inherit the mapping, anything started later attaches to it by name
+    name = shared_dataset.publish(main.enhanced_full_data)
+    main.enhanced_full_data = shared_dataset.attach(name)
+    os.environ[SHARED_DATASET_ENV] = name
+
+    main.init_db()
+    ranking_engine.customer_rollup(main.enhanced_full_data)
+    ranking_engine.loan_rollup(main.enhanced_full_data)
+    main._load_forecast()
+    main.run_anomaly_job()
+    # Connections opened here must not be shared with the children
+    engine.dispose()
+
+    # Move everything built so far out of the collector's reach, so the workers' GC passes don't
+    # write to (and un-share) the parent's pages
+    gc.collect()
+    gc.freeze()
+    print(f"Loaded application in {time.perf_counter() - started:.1f}s "
+          f"({len(main.enhanced_full_data['loans']):,} loans in {shared_dataset.status()[name]['bytes'] / 2**20:.0f} MB "
+          f"of shared memory, {gc.get_freeze_count():,} objects frozen)")
+    return main
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(main, sock: socket.socket, index: int):
+    """Body of a forked worker: serve the shared app on the shared socket until told to stop"""
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5000)
+    from database import engine
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Only one worker runs the delivery queue, scheduled jobs and anomaly scoring
+    main.RUN_BACKGROUND_JOBS = main.RUN_BACKGROUND_JOBS and index == 0
+    engine.dispose(close=False)
+
+    config = uvicorn.Config(main.app, log_level="warning", access_log=False, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(workers: int, host: str = HOST, port: int = PORT):
+    main = load_application()
+    sock = bind_socket(host, port)
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(main, sock, index)
+            finally:
+                os._exit(0)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for index in range(workers):
+        spawn(index)
+    print(f"Serving on http://{host}:{port} with {workers} workers (parent pid {os.getpid()})")
+
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = children.pop(pid, None)
+            if index is None or stopping:
+                continue
+            print(f"Worker {index} (pid {pid}) exited with status {status}; restarting")
+            time.sleep(RESTART_BACKOFF_SECONDS)
+            spawn(index)
+    finally:
+        from shared_dataset import shared_dataset
+        shared_dataset.close()
+
+
+def _memory(pid: int) -> Dict[str, int]:
+    """Resident and proportional (shared pages split between sharers) memory of a process, in KB"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                fields[parts[0][:-1].lower()] = int(parts[1])
+    return fields
+
+
+def _children(pid: int) -> List[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def _load(port: int, duration: float, concurrency: int, queue):
+    """One load-generator process: `concurrency` keep-alive clients cycling through BENCHMARK_PATHS"""
+    import asyncio
+    import httpx
+
+    async def client(http, counts, deadline, offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            response = await http.get(BENCHMARK_PATHS[i % len(BENCHMARK_PATHS)])
+            counts["ok" if response.status_code == 200 else "failed"] += 1
+            i += 1
+
+    async def run():
+        counts = {"ok": 0, "failed": 0}
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as http:
+            deadline = time.perf_counter() + duration
+            await asyncio.gather(*(client(http, counts, deadline, i) for i in range(concurrency)))
+        return counts
+
+    queue.put(asyncio.run(run()))
+
+
+def benchmark(worker_counts: List[int], duration: float, concurrency: int, load_processes: int, port: int):
+    """Start the launcher at each worker count and measure throughput and memory under load"""
+    import multiprocessing
+    import urllib.request
+
+    print(f"{'workers':>7} {'rps':>8} {'failed':>6} {'worker RSS MB':>14} {'worker PSS MB':>14} "
+          f"{'total PSS MB':>13} {'N x 1-proc RSS MB':>18}")
+    single_rss = None
+    for workers in worker_counts:
+        launcher = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--workers", str(workers), "--port", str(port)],
+            stdout=subprocess.DEVNULL,
+            env={**os.environ, "RUN_BACKGROUND_JOBS": "false"},
+        )
+        try:
+            deadline = time.time() + 180
+            while True:
+                try:
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1)
+                    if len(_children(launcher.pid)) >= workers:
+                        break
+                except OSError:
+                    pass
+                if time.time() > deadline or launcher.poll() is not None:
+                    raise RuntimeError(f"Launcher with {workers} workers did not come up")
+                time.sleep(0.5)
+
+            queue = multiprocessing.Queue()
+            loaders = [
+                multiprocessing.Process(target=_load, args=(port, duration, concurrency, queue))
+                for _ in range(load_processes)
+            ]
+            for loader in loaders:
+                loader.start()
+            results = [queue.get() for _ in loaders]
+            for loader in loaders:
+                loader.join()
+
+            ok = sum(r["ok"] for r in results)
+            failed = sum(r["failed"] for r in results)
+            pids = _children(launcher.pid)
+            memory = [_memory(pid) for pid in pids]
+            parent = _memory(launcher.pid)
+            worker_rss = sum(m["rss"] for m in memory) / len(memory) / 1024
+            worker_pss = sum(m["pss"] for m in memory) / len(memory) / 1024
+            total_pss = (parent["pss"] + sum(m["pss"] for m in memory)) / 1024
+            single_rss = single_rss or worker_rss
+            print(f"{workers:>7} {ok / duration:>8.0f} {failed:>6} {worker_rss:>14.0f} {worker_pss:>14.0f} "
+                  f"{total_pss:>13.0f} {single_rss * workers:>18.0f}")
+        finally:
+            launcher.send_signal(signal.SIGTERM)
+            try:
+                launcher.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                launcher.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prefork production server for the Kechita API")
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--benchmark", action="store_true", help="measure RPS and memory for 1-8 workers")
+    parser.add_argument("--duration", type=float, default=10.0, help="benchmark seconds per worker count")
+    parser.add_argument("--concurrency", type=int, default=32, help="benchmark connections per load process")
+    parser.add_argument("--load-processes", type=int, default=max(1, default_workers() // 2))
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(BENCHMARK_WORKERS, args.duration, args.concurrency, args.load_processes, args.port + 1)
+    else:
+        serve(args.workers, args.host, args.port)
@@ -1,22 +1,48 @@
 """
 Settings service for secure API key management with encryption
+Decrypted settings are kept in memory and only re-read when the .env file changes on disk
 """
 import os
-import json
+import re
+import tempfile
+import threading
+import time
 from pathlib import Path
 from cryptography.fernet import Fernet
-from dotenv import load_dotenv, set_key, dotenv_values
+from dotenv import load_dotenv, dotenv_values
 
 load_dotenv()
 
+# Settings exposed through the status and redacted views, with whether their value is secret
+MANAGED_SETTINGS = {
+    "OPENAI_API_KEY": True,
+    "TWILIO_ACCOUNT_SID": True,
+    "TWILIO_AUTH_TOKEN": True,
+    "TWILIO_PHONE_NUMBER": False,
+    "TELEGRAM_BOT_TOKEN": True,
+    "TELEGRAM_CHAT_ID": False
+}
+# Minimum gap between checks of the .env file's mtime
+SETTINGS_STAT_INTERVAL_SECONDS = 1.0
+
+_ENV_LINE = re.compile(r"^\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_]*)\s*=")
+
 class SettingsService:
     def __init__(self):
         self.env_file = Path(".env")
         self.encryption_key = self._get_or_create_encryption_key()
         self.cipher = Fernet(self.encryption_key)
+        self._lock = threading.RLock()
+        self._signature = None
+        self._checked_at = 0.0
+        # Bumped whenever the values change, from this process or from .env changing on disk
+        self.version = 0
+        self._values = {}
+        self._status = {}
+        self._redacted = {}
         # Load and decrypt env vars on initialization
         self._load_decrypted_env()
-        
+    
     def _get_or_create_encryption_key(self):
         """Get existing encryption key or create a new one"""
         key_file = Path(".encryption_key")
@@ -44,29 +70,61 @@ class SettingsService:
         except Exception:
             return ""
     
+    def _file_signature(self):
+        try:
+            stat = self.env_file.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def _write_env_file(self, updates: dict):
+        """Rewrite .env with updated keys in a single atomic replace, keeping every other line"""
+        lines = self.env_file.read_text().splitlines() if self.env_file.exists() else []
+        pending = dict(updates)
+
+        for i, line in enumerate(lines):
+            match = _ENV_LINE.match(line)
+            if match and match.group(1) in pending:
+                key = match.group(1)
+                lines[i] = f"{key}='{pending.pop(key)}'"
+        lines.extend(f"{key}='{value}'" for key, value in pending.items())
+
+        directory = self.env_file.resolve().parent
+        fd, temp_path = tempfile.mkstemp(prefix=".env.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, self.env_file)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+    
     def update_settings(self, settings: dict) -> bool:
         """Update settings in .env file with encryption"""
         try:
-            # Ensure .env file exists
-            if not self.env_file.exists():
-                self.env_file.touch()
-                os.chmod(self.env_file, 0o600)
-            
-            # Update each setting
-            for key, value in settings.items():
-                if value and value.strip():  # Only update non-empty values
-                    # Convert to environment variable format
-                    env_key = key.upper()
-                    
-                    # Encrypt sensitive values before storing
-                    encrypted_value = self.encrypt_value(value)
-                    set_key(str(self.env_file), env_key, encrypted_value)
-                    
-                    # Also set decrypted value in current environment for immediate use
-                    os.environ[env_key] = value
-            
-            # Reload environment with decryption
-            self._load_decrypted_env()
+            # Only update non-empty values, converted to environment variable format
+            values = {
+                key.upper(): value
+                for key, value in settings.items()
+                if value and value.strip()
+            }
+            if not values:
+                return True
+
+            with self._lock:
+                # Encrypt sensitive values before storing
+                self._write_env_file({key: self.encrypt_value(value) for key, value in values.items()})
+
+                # The new values are already known, so the cache is updated without re-reading the file
+                self._values.update(values)
+                os.environ.update(values)
+                self._rebuild_views()
+                self._signature = self._file_signature()
+                self._checked_at = time.monotonic()
+                self.version += 1
             return True
         except Exception as e:
             print(f"Error updating settings: {e}")
@@ -74,66 +132,61 @@ class SettingsService:
     
     def _load_decrypted_env(self):
         """Load and decrypt environment variables"""
-        env_vars = dotenv_values(str(self.env_file))
-        
+        signature = self._file_signature()
+        env_vars = dotenv_values(str(self.env_file)) if signature else {}
+
+        values = {}
         # Decrypt and set in environment
         for key, encrypted_value in env_vars.items():
             if encrypted_value:
-                try:
-                    # Try to decrypt - if it fails, assume it's already decrypted
-                    decrypted = self.decrypt_value(encrypted_value)
-                    if decrypted:
-                        os.environ[key] = decrypted
-                except Exception:
-                    # If decryption fails, use the value as-is (backwards compatibility)
-                    os.environ[key] = encrypted_value
-    
-    def get_settings_status(self) -> dict:
-        """Check which settings are configured by checking if they can be decrypted"""
-        env_vars = dotenv_values(str(self.env_file))
-        
-        def is_configured(key):
-            encrypted = env_vars.get(key)
-            if not encrypted:
-                return False
-            # Try to decrypt to verify it's valid
-            try:
-                decrypted = self.decrypt_value(encrypted)
-                return bool(decrypted)
-            except Exception:
-                # If can't decrypt, check if it exists in current env (already loaded)
-                return bool(os.getenv(key))
-        
-        return {
-            "configured": {
-                "openai_api_key": is_configured("OPENAI_API_KEY"),
-                "twilio_account_sid": is_configured("TWILIO_ACCOUNT_SID"),
-                "twilio_auth_token": is_configured("TWILIO_AUTH_TOKEN"),
-                "twilio_phone_number": is_configured("TWILIO_PHONE_NUMBER"),
-                "telegram_bot_token": is_configured("TELEGRAM_BOT_TOKEN"),
-                "telegram_chat_id": is_configured("TELEGRAM_CHAT_ID")
-            }
-        }
+                decrypted = self.decrypt_value(encrypted_value)
+                values[key] = decrypted
+                if decrypted:
+                    os.environ[key] = decrypted
+
+        self._values = values
+        self._rebuild_views()
+        self._signature = signature
+        self.version += 1
     
-    def get_redacted_settings(self) -> dict:
-        """Get settings with redacted values (for display purposes)"""
-        env_vars = dotenv_values(str(self.env_file))
-        
+    def _rebuild_views(self):
         def redact(value):
             if not value:
                 return ""
             if len(value) <= 8:
                 return "•" * len(value)
             return value[:4] + "•" * (len(value) - 8) + value[-4:]
-        
-        return {
-            "openai_api_key": redact(env_vars.get("OPENAI_API_KEY", "")),
-            "twilio_account_sid": redact(env_vars.get("TWILIO_ACCOUNT_SID", "")),
-            "twilio_auth_token": redact(env_vars.get("TWILIO_AUTH_TOKEN", "")),
-            "twilio_phone_number": env_vars.get("TWILIO_PHONE_NUMBER", ""),
-            "telegram_bot_token": redact(env_vars.get("TELEGRAM_BOT_TOKEN", "")),
-            "telegram_chat_id": env_vars.get("TELEGRAM_CHAT_ID", "")
+
+        self._status = {key.lower(): bool(self._values.get(key)) for key in MANAGED_SETTINGS}
+        self._redacted = {
+            key.lower(): redact(self._values.get(key, "")) if secret else self._values.get(key, "")
+            for key, secret in MANAGED_SETTINGS.items()
         }
+    
+    def refresh(self, force: bool = False):
+        """Reload from disk if .env changed since it was last read; stats the file at most once a second"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < SETTINGS_STAT_INTERVAL_SECONDS:
+            return
+        with self._lock:
+            self._checked_at = now
+            if force or self._file_signature() != self._signature:
+                self._load_decrypted_env()
+    
+    def get(self, key: str, default: str = "") -> str:
+        """Decrypted value of a setting from the in-memory store"""
+        self.refresh()
+        return self._values.get(key) or default
+    
+    def get_settings_status(self) -> dict:
+        """Check which settings are configured by checking if they can be decrypted"""
+        self.refresh()
+        return {"configured": dict(self._status)}
+    
+    def get_redacted_settings(self) -> dict:
+        """Get settings with redacted values (for display purposes)"""
+        self.refresh()
+        return dict(self._redacted)
 
 # Global instance
 settings_service = SettingsService()
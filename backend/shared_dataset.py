@@ -0,0 +1,278 @@
+"""
+Shared-memory columnar copy of the in-memory dataset (loans, customers, collections, branches)
+Numeric columns are stored as raw arrays, categorical columns (branch, region, status, ...) as dictionary
+codes and other strings as UTF-8 buffers with offsets, all in one POSIX shared memory segment. Processes
+attach to it by name and wrap the buffers in DataFrames (Arrow strings when pyarrow is installed) without
+copying, so every worker maps the same physical pages.
+
+    python backend/shared_dataset.py                   # attach time and per-process memory, copies vs shared
+"""
+
+import json
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    # String columns are then decoded into Python objects in every process that attaches
+    pa = None
+
+# Name of the segment a launcher published; processes that see it attach instead of building their own data
+SHARED_DATASET_ENV = "KECHITA_SHARED_DATASET"
+# Low-cardinality string columns stored as dictionary codes; other strings are stored as-is
+DICTIONARY_COLUMNS = {"branch", "region", "county", "status", "payment_behavior"}
+# Every buffer starts on a cache-line boundary
+ALIGNMENT = 64
+# Segment header: offset and length of the JSON manifest written after the buffers
+HEADER_BYTES = 16
+
+
+def _code_dtype(size: int) -> np.dtype:
+    """Smallest signed code type for a dictionary, the same one pandas picks, so codes are used as-is"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if size < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _utf8(values: Iterable[str]) -> Dict[str, np.ndarray]:
+    """Strings as one UTF-8 byte buffer plus Arrow-style int64 offsets"""
+    encoded = [value.encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return {"offsets": offsets, "data": np.frombuffer(b"".join(encoded), dtype=np.uint8)}
+
+
+def _encode(name: str, series: pd.Series) -> Dict:
+    """Split a column into the arrays stored for it"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, categories, dtype = series.cat.codes.to_numpy(), series.cat.categories, series.dtype
+    elif pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_datetime64_dtype(series.dtype):
+        return {"kind": "values", "arrays": {"values": np.ascontiguousarray(series.to_numpy())}}
+    elif name in DICTIONARY_COLUMNS or series.hasnans:
+        # Missing strings become code -1
+        codes, categories = pd.factorize(series, sort=True)
+        dtype = None
+    else:
+        return {"kind": "strings", "arrays": _utf8(series.astype(str))}
+    return {
+        "kind": "dictionary",
+        "arrays": {"codes": codes.astype(_code_dtype(len(categories)), copy=False)},
+        # Columns encoded with the same dtype share one stored dictionary
+        "dtype": dtype,
+        "categories": categories,
+    }
+
+
+def _strings(data: np.ndarray, offsets: np.ndarray) -> pd.Series:
+    """A stored string column; with pyarrow it reads straight out of the shared buffer"""
+    if pa is not None:
+        strings = pa.LargeStringArray.from_buffers(len(offsets) - 1, pa.py_buffer(offsets), pa.py_buffer(data))
+        return strings.to_pandas()
+    blob = data.tobytes()
+    return pd.Series([blob[offsets[i]:offsets[i + 1]].decode() for i in range(len(offsets) - 1)], dtype=object)
+
+
+def _view(buf, spec: Dict) -> np.ndarray:
+    array = np.frombuffer(buf, dtype=np.dtype(spec["dtype"]), count=spec["length"], offset=spec["offset"])
+    # The pages are shared with every other worker; a stray in-place write must fail rather than leak
+    array.flags.writeable = False
+    return array
+
+
+class _Segment(shared_memory.SharedMemory):
+    def __del__(self):
+        try:
+            self.close()
+        except BufferError:
+            # DataFrames still view the mapping at interpreter exit; it goes away with the process
+            pass
+
+
+class SharedDataset:
+    def __init__(self):
+        # Segments must outlive every DataFrame viewing them, so they are held for the life of the process
+        self._segments: Dict[str, _Segment] = {}
+        self._owned = set()
+
+    def publish(self, data: Dict[str, pd.DataFrame], name: Optional[str] = None) -> str:
+        """Copy every frame into a new shared memory segment and return its name"""
+        manifest, buffers, dictionaries, size = {}, [], {}, HEADER_BYTES
+
+        def place(arrays: Dict[str, np.ndarray]) -> Dict:
+            nonlocal size
+            specs = {}
+            for key, array in arrays.items():
+                size = -(-size // ALIGNMENT) * ALIGNMENT
+                specs[key] = {"dtype": array.dtype.str, "length": len(array), "offset": size}
+                buffers.append((size, array))
+                size += array.nbytes
+            return specs
+
+        for frame_name, frame in data.items():
+            columns = []
+            for column in frame.columns:
+                encoded = _encode(column, frame[column])
+                specs = place(encoded["arrays"])
+                if encoded["kind"] == "dictionary":
+                    key = encoded["dtype"] if encoded["dtype"] is not None else (frame_name, column)
+                    if key not in dictionaries:
+                        dictionaries[key] = place(_utf8(str(value) for value in encoded["categories"]))
+                    specs.update(dictionaries[key])
+                columns.append({"name": column, "kind": encoded["kind"], "arrays": specs})
+            manifest[frame_name] = columns
+
+        header = json.dumps(manifest).encode()
+        segment = _Segment(name=name, create=True, size=size + len(header))
+        for offset, array in buffers:
+            segment.buf[offset:offset + array.nbytes] = array.tobytes()
+        segment.buf[size:size + len(header)] = header
+        segment.buf[:HEADER_BYTES] = np.array([size, len(header)], dtype=np.int64).tobytes()
+
+        self._segments[segment.name] = segment
+        self._owned.add(segment.name)
+        return segment.name
+
+    def attach(self, name: str) -> Dict[str, pd.DataFrame]:
+        """DataFrames viewing a published segment"""
+        segment = self._segments.get(name)
+        if segment is None:
+            if sys.version_info >= (3, 13):
+                segment = _Segment(name=name, track=False)
+            else:
+                # Older versions register attached segments with the resource tracker too. Processes started
+                # through multiprocessing share the publisher's tracker, where that is harmless; a tracker
+                # started just for this process would unlink the segment when the process exits
+                inherited = resource_tracker._resource_tracker._fd is not None
+                segment = _Segment(name=name)
+                if not inherited:
+                    resource_tracker.unregister(segment._name, "shared_memory")
+            self._segments[name] = segment
+
+        buf = segment.buf
+        offset, length = np.frombuffer(buf, dtype=np.int64, count=2)
+        manifest = json.loads(bytes(buf[offset:offset + length]))
+
+        data, dtypes = {}, {}
+        for frame_name, columns in manifest.items():
+            frame = {}
+            for column in columns:
+                arrays = {key: _view(buf, spec) for key, spec in column["arrays"].items()}
+                if column["kind"] == "values":
+                    frame[column["name"]] = arrays["values"]
+                elif column["kind"] == "strings":
+                    frame[column["name"]] = _strings(arrays["data"], arrays["offsets"])
+                else:
+                    key = column["arrays"]["data"]["offset"]
+                    if key not in dtypes:
+                        dtypes[key] = pd.CategoricalDtype(pd.Index(_strings(arrays["data"], arrays["offsets"])))
+                    frame[column["name"]] = pd.Categorical.from_codes(arrays["codes"], dtype=dtypes[key],
+                                                                      validate=False)
+            data[frame_name] = pd.DataFrame(frame, copy=False)
+        return data
+
+    def close(self):
+        """Detach from every segment, unlinking the ones this process published"""
+        for name, segment in self._segments.items():
+            try:
+                segment.close()
+            except BufferError:
+                # DataFrames still view it; the mapping goes away with the process
+                pass
+            if name in self._owned:
+                try:
+                    segment.unlink()
+                except FileNotFoundError:
+                    pass
+        self._segments.clear()
+        self._owned.clear()
+
+    def status(self) -> Dict:
+        return {
+            name: {"bytes": segment.size, "owner": name in self._owned}
+            for name, segment in self._segments.items()
+        }
+
+
+shared_dataset = SharedDataset()
+
+
+def _memory_kb() -> Dict[str, int]:
+    """Resident, proportional and private (unshared) memory of this process, in KB"""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) > 1 and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1])
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def _touch(data: Dict[str, pd.DataFrame]):
+    """Read every column once, the way a worker serving requests eventually does"""
+    for frame in data.values():
+        for column in frame.columns:
+            frame[column].iloc[::997].tolist()
+            frame[column].nunique()
+
+
+def _worker(mode: str, source: str, queue, barrier):
+    baseline = _memory_kb()
+    started = time.perf_counter()
+    if mode == "shared":
+        data = shared_dataset.attach(source)
+    else:
+        data = pd.read_pickle(source)
+    ready = time.perf_counter() - started
+    _touch(data)
+    # Measure while every worker is alive, so shared pages are split between all of them
+    barrier.wait()
+    memory = _memory_kb()
+    queue.put({"ready": ready, **{key: memory[key] - baseline[key] for key in memory}})
+    barrier.wait()
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    import tempfile
+    from data_generator import generate_realistic_loan_data
+
+    WORKERS = 4
+    started = time.perf_counter()
+    data = generate_realistic_loan_data(num_branches=400)
+    frames_mb = sum(frame.memory_usage(deep=True).sum() for frame in data.values()) / 2**20
+    print(f"Dataset: {len(data['loans']):,} loans, {len(data['collections']):,} collections, "
+          f"{frames_mb:.0f} MB as pandas {pd.__version__} frames, generated in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    name = shared_dataset.publish(data)
+    print(f"Published a {shared_dataset.status()[name]['bytes'] / 2**20:.0f} MB segment in "
+          f"{time.perf_counter() - started:.2f}s")
+
+    with tempfile.NamedTemporaryFile(suffix=".pkl") as pickled:
+        pd.to_pickle(data, pickled.name)
+        context = multiprocessing.get_context("spawn")
+        print(f"{'mode':>8} {'workers':>7} {'ready s':>8} {'RSS MB':>7} {'PSS MB':>7} {'private MB':>10}")
+        for mode, source in (("copy", pickled.name), ("shared", name)):
+            queue, barrier = context.Queue(), context.Barrier(WORKERS)
+            processes = [context.Process(target=_worker, args=(mode, source, queue, barrier))
+                         for _ in range(WORKERS)]
+            for process in processes:
+                process.start()
+            results = [queue.get() for _ in processes]
+            for process in processes:
+                process.join()
+            mean = {key: sum(r[key] for r in results) / len(results) for key in results[0]}
+            print(f"{mode:>8} {WORKERS:>7} {mean['ready']:>8.3f} {mean['rss'] / 1024:>7.0f} "
+                  f"{mean['pss'] / 1024:>7.0f} {mean['private'] / 1024:>10.0f}")
+    shared_dataset.close()
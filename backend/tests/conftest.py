@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# The app creates its SQLite database and encryption key in the working directory; keep them out of the repo
+os.chdir(tempfile.mkdtemp(prefix="kechita-tests-"))
+# No loan-status or delivery jobs racing the requests under test
+os.environ.setdefault("RUN_BACKGROUND_JOBS", "false")
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import select
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi import HTTPException
+
+import ai_service as ai_service_module
+from ai_service import ai_service, INSIGHTS_SYSTEM_PROMPT
+from client_registry import client_registry
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _client_gone(self) -> bool:
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        return bool(readable) and self.connection.recv(1, socket.MSG_PEEK) == b""
+
+    def do_POST(self):
+        stub = self.server
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with stub.lock:
+            stub.requests += 1
+            stub.in_flight += 1
+            stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+        try:
+            deadline = time.monotonic() + stub.delay
+            while time.monotonic() < deadline:
+                if self._client_gone():
+                    with stub.lock:
+                        stub.aborted += 1
+                    return
+                time.sleep(0.01)
+            json_response = "response_format" in request
+            content = json.dumps({"insights": ["stub insight"]}) if json_response else "stub reply"
+            body = json.dumps({
+                "id": f"chatcmpl-{stub.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with stub.lock:
+                stub.in_flight -= 1
+
+
+class StubOpenAI(ThreadingHTTPServer):
+    """OpenAI-compatible /v1/chat/completions that answers after `delay` seconds and notices aborted calls"""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.lock = threading.Lock()
+        self.delay = 0.0
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.aborted = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def wait_for_aborted(self, count: int, timeout: float = 2.0) -> int:
+        deadline = time.monotonic() + timeout
+        while self.aborted < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.aborted
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = StubOpenAI()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    yield server
+    server.shutdown()
+    server.server_close()
+    monkeypatch.delenv("OPENAI_API_KEY")
+    asyncio.run(client_registry.reload(["openai"]))
+
+
+def run_with_client(coro_factory):
+    """Run a coroutine on a fresh loop with an OpenAI client built for that loop against the stub"""
+    async def main():
+        await client_registry.reload(["openai"])
+        client = client_registry.get("openai")
+        try:
+            return await coro_factory()
+        finally:
+            await client.close()
+
+    return asyncio.run(main())
+
+
+def complete(prompt: str, timeout=None):
+    return ai_service._complete("test", INSIGHTS_SYSTEM_PROMPT, prompt, max_tokens=16, timeout=timeout, cache=False)
+
+
+def test_completion_through_stub(stub):
+    assert run_with_client(lambda: complete("hello")) == "stub reply"
+    insights = run_with_client(lambda: ai_service.generate_advanced_insights(
+        {"total_disbursements": 1.0}, [{"branch": "Stub Branch", "collection_rate": 91.0}]
+    ))
+    assert insights == ["stub insight"]
+    assert stub.requests == 2
+
+
+def test_timeout_cancels_the_upstream_request(stub):
+    stub.delay = 5.0
+    started = time.perf_counter()
+    with pytest.raises(TimeoutError, match="timed out after 0.3s"):
+        run_with_client(lambda: complete("slow", timeout=0.3))
+    assert time.perf_counter() - started < 2.0
+    assert stub.wait_for_aborted(1) == 1
+
+
+def test_timeout_falls_back_to_rule_based_insights(stub):
+    stub.delay = 5.0
+    summary = {"total_disbursements": 100.0, "overall_collection_rate": 70.0}
+    branches = [{"branch": "Slow Branch", "collection_rate": 70.0, "total_arrears": 30.0}]
+    insights = run_with_client(lambda: ai_service.generate_advanced_insights(summary, branches, timeout=0.3))
+    assert insights == ai_service._get_fallback_insights(summary, branches)
+
+
+def test_concurrency_is_capped(stub, monkeypatch):
+    monkeypatch.setattr(ai_service_module, "AI_MAX_CONCURRENCY", 2)
+    stub.delay = 0.3
+
+    async def burst():
+        return await asyncio.gather(*(complete(f"burst {i}") for i in range(6)))
+
+    started = time.perf_counter()
+    assert run_with_client(burst) == ["stub reply"] * 6
+    assert stub.requests == 6
+    assert stub.max_in_flight == 2
+    # Three waves of two
+    assert time.perf_counter() - started >= 0.85
+
+
+class _DisconnectingRequest:
+    """Request whose client goes away after `after` seconds"""
+
+    def __init__(self, after: float):
+        self.deadline = time.monotonic() + after
+
+    async def is_disconnected(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+
+def test_client_disconnect_cancels_the_ai_call(stub, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "DISCONNECT_POLL_SECONDS", 0.05)
+    stub.delay = 5.0
+    started = time.perf_counter()
+    with pytest.raises(HTTPException) as raised:
+        run_with_client(lambda: main._await_unless_disconnected(_DisconnectingRequest(0.2), complete("gone")))
+    assert raised.value.status_code == 499
+    assert time.perf_counter() - started < 2.0
+    assert stub.wait_for_aborted(1) == 1
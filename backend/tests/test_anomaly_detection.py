@@ -0,0 +1,69 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from anomaly_detection import CollectionAnomalyDetector
+from database import Base, Branch, Collection, Customer, Loan
+
+OPENED = date(2024, 5, 1)
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'anomalies.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Branch(name="Thika"))
+    session.flush()
+    session.add(Customer(customer_id="C1", name="Test Customer", branch_id=1))
+    session.flush()
+    session.add(Loan(loan_id="L1", customer_id=1, branch_id=1, disbursement_amount=50000.0,
+                     disbursement_date=datetime(2024, 1, 1)))
+    for offset in range(30, 0, -1):
+        collect(session, OPENED - timedelta(days=offset), 900.0 if offset % 2 else 1100.0)
+    session.commit()
+    yield session
+    session.close()
+
+
+def collect(db, day: date, amount: float):
+    db.add(Collection(loan_id=1, branch_id=1, amount=amount, collection_date=datetime.combine(day, datetime.min.time())))
+
+
+def test_job_reads_collections_written_by_any_worker(db):
+    job_worker = CollectionAnomalyDetector()
+    job_worker.bootstrap_sql(db, as_of=OPENED)
+    job_worker.save(db)
+
+    # An upload handled by another worker only writes to the database
+    collect(db, OPENED, 50.0)
+    collect(db, OPENED + timedelta(days=1), 400.0)
+    db.commit()
+
+    alerts = job_worker.advance_sql(db, as_of=OPENED + timedelta(days=1))
+    assert [(a["branch"], a["date"], a["direction"]) for a in alerts] == [("Thika", OPENED.isoformat(), "drop")]
+    assert job_worker.status("Thika")[0]["today"] == 400.0
+
+    # Nothing new: no days close and no alerts repeat
+    assert job_worker.advance_sql(db, as_of=OPENED + timedelta(days=1)) == []
+
+
+def test_other_workers_serve_the_saved_state(db):
+    job_worker = CollectionAnomalyDetector()
+    other_worker = CollectionAnomalyDetector()
+    job_worker.bootstrap_sql(db, as_of=OPENED)
+    job_worker.save(db)
+    assert other_worker.refresh(db)
+    assert other_worker.status() == job_worker.status()
+
+    collect(db, OPENED, 50.0)
+    db.commit()
+    job_worker.advance_sql(db, as_of=OPENED + timedelta(days=1))
+    job_worker.save(db)
+
+    assert other_worker.refresh(db)
+    assert other_worker.recent_alerts() == job_worker.recent_alerts()
+    assert other_worker.status() == job_worker.status()
+    assert not other_worker.refresh(db)
@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from data_generator import generate_realistic_loan_data, get_enhanced_sample_data
+from fast_json import FrameJSONResponse, dumps, iter_ndjson
+from report_scheduler import daily_report_scheduler
+
+
+def _jsonable_body(content) -> bytes:
+    """What FastAPI wrote for the same content before the list endpoints used FrameJSONResponse"""
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def test_branch_metrics_match_jsonable_encoder():
+    import main
+
+    metrics = daily_report_scheduler.branch_metrics_sample(get_enhanced_sample_data(num_branches=100))
+    frame = metrics[list(main.BranchMetrics.model_fields)].astype(main.BRANCH_METRIC_TYPES)
+    models = [main.BranchMetrics(**row) for row in frame.to_dict(orient="records")]
+
+    assert FrameJSONResponse(frame).body == _jsonable_body(models)
+
+
+def test_dataset_pages_match_jsonable_encoder():
+    data = generate_realistic_loan_data(num_branches=10)
+    for name, frame in data.items():
+        page = frame.iloc[:500]
+        content = {name: page.to_dict(orient="records"), "total": len(frame), "limit": 500, "offset": 0}
+        assert FrameJSONResponse({**content, name: page}).body == _jsonable_body(content), name
+
+
+def test_floats_use_shortest_representation():
+    frame = pd.DataFrame({"amount": [48170411.42, 76.76, 0.1 + 0.2, 12.0]})
+    assert dumps(frame) == (b'[{"amount":48170411.42},{"amount":76.76},'
+                            b'{"amount":0.30000000000000004},{"amount":12.0}]')
+
+    tiny = pd.DataFrame({"amount": [1e-07, 1.2345678901234567e+20]})
+    assert json.loads(dumps(tiny)) == [{"amount": 1e-07}, {"amount": 1.2345678901234567e+20}]
+
+
+def test_missing_values_and_numpy_scalars_become_plain_json():
+    frame = pd.DataFrame({
+        "rate": [np.nan, 1.5],
+        "count": pd.array([None, 2], dtype="Int64"),
+        "when": [pd.NaT, pd.Timestamp("2025-01-02 03:04:05")],
+        "branch": pd.Categorical([None, "Nairobi Central"]),
+    })
+    assert json.loads(dumps({"rows": frame, "n": np.int64(3), "x": np.float64("nan")})) == {
+        "rows": [
+            {"rate": None, "count": None, "when": None, "branch": None},
+            {"rate": 1.5, "count": 2, "when": "2025-01-02T03:04:05", "branch": "Nairobi Central"},
+        ],
+        "n": 3,
+        "x": None,
+    }
+
+
+def test_ndjson_rows_match_json_rows():
+    frame = generate_realistic_loan_data(num_branches=5)["collections"]
+    lines = b"".join(iter_ndjson(frame, chunk_rows=7)).decode().splitlines()
+    assert [json.loads(line) for line in lines] == json.loads(dumps(frame))
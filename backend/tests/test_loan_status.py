@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, Branch, Customer, JobRun, Loan
+from loan_status import JOB_NAME, LoanStatusEngine
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'status.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Branch(name="Thika"))
+    session.flush()
+    session.add(Customer(customer_id="C1", name="Test Customer", branch_id=1))
+    session.flush()
+    yield session
+    session.close()
+
+
+def add_loan(db, loan_id: str, due_date: datetime) -> Loan:
+    loan = Loan(loan_id=loan_id, customer_id=1, branch_id=1, disbursement_amount=1000.0,
+                disbursement_date=due_date - timedelta(days=90), due_date=due_date, status="active")
+    db.add(loan)
+    db.commit()
+    return loan
+
+
+def statuses(db):
+    db.expire_all()
+    return {loan.loan_id: loan.status for loan in db.query(Loan)}
+
+
+def test_loan_due_earlier_today_is_active_in_both_paths(db):
+    engine = LoanStatusEngine()
+    afternoon = datetime.combine(datetime.now().date(), datetime.min.time()) + timedelta(hours=15)
+    due_this_morning = afternoon - timedelta(hours=7)
+    add_loan(db, "TODAY", due_this_morning)
+    add_loan(db, "YESTERDAY", due_this_morning - timedelta(days=1))
+
+    engine.run(db, as_of=afternoon)
+
+    in_memory = engine.classify([1000.0, 1000.0], [0.0, 0.0], [due_this_morning, due_this_morning - timedelta(days=1)], afternoon)
+    assert statuses(db) == {"TODAY": in_memory[0], "YESTERDAY": in_memory[1]}
+    assert statuses(db) == {"TODAY": "active", "YESTERDAY": "overdue"}
+
+
+def test_incremental_run_picks_up_loans_whose_due_day_ended(db):
+    engine = LoanStatusEngine()
+    midnight = datetime.combine(datetime.now().date(), datetime.min.time())
+    add_loan(db, "YESTERDAY", midnight - timedelta(hours=16))
+    add_loan(db, "TODAY", midnight + timedelta(hours=1))
+    engine.run(db)
+    # Untouched since well before the last run, so only the due-date window can select them
+    db.query(Loan).update({"status": "active", "updated_at": datetime.utcnow() - timedelta(days=2)})
+    # As if the last run was a day ago, before either loan's due day ended
+    db.query(JobRun).filter(JobRun.name == JOB_NAME).update({"last_run_at": datetime.utcnow() + timedelta(days=-1, minutes=1)})
+    db.commit()
+
+    result = engine.run(db)
+
+    assert result["incremental"]
+    assert statuses(db) == {"YESTERDAY": "overdue", "TODAY": "active"}
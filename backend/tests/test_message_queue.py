@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, OutboundMessage
+from message_queue import MessageQueue
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'queue.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def queued(db, queue, status):
+    message = queue.enqueue(db, "telegram", "12345", "Daily summary", idempotency_key=f"test:{status}")
+    db.query(OutboundMessage).filter(OutboundMessage.id == message["id"]).update({"status": status, "attempts": 5})
+    db.commit()
+    return message["id"]
+
+
+def test_only_dead_messages_are_requeued(db):
+    queue = MessageQueue()
+    dead = queued(db, queue, "dead")
+    requeued = queue.requeue(db, dead)
+    assert requeued["status"] == "pending" and requeued["attempts"] == 0
+
+    for status in ("sent", "sending", "pending"):
+        message_id = queued(db, queue, status)
+        with pytest.raises(ValueError, match=f"is {status}"):
+            queue.requeue(db, message_id)
+        assert queue.get(db, message_id)["status"] == status
+
+    assert queue.requeue(db, 9999) is None
+
+
+def test_retry_endpoint_conflicts_on_sent_messages(db):
+    from fastapi.testclient import TestClient
+    import main
+
+    main.app.dependency_overrides[main.get_db] = lambda: db
+    try:
+        client = TestClient(main.app)
+        sent = queued(db, MessageQueue(), "sent")
+        assert client.post(f"/api/messaging/queue/{sent}/retry").status_code == 409
+        assert client.post("/api/messaging/queue/9999/retry").status_code == 404
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+def test_repeated_idempotency_keys_return_the_stored_message(db):
+    queue = MessageQueue()
+    first = queue.enqueue(db, "whatsapp", "+254700000001", "Hello", idempotency_key="report:1")
+    again = queue.enqueue_many(db, [
+        {"channel": "whatsapp", "recipient": "+254700000001", "body": "Hello", "idempotency_key": "report:1"},
+        {"channel": "whatsapp", "recipient": "+254700000002", "body": "Hello", "idempotency_key": "report:2"},
+    ])
+    assert again[0]["id"] == first["id"]
+    assert db.query(OutboundMessage).count() == 2
+
+
+def test_constraint_violations_other_than_duplicates_are_raised(db):
+    with pytest.raises(IntegrityError):
+        MessageQueue().enqueue(db, "telegram", None, "No recipient")
+    assert db.query(OutboundMessage).count() == 0
@@ -0,0 +1,90 @@
+import multiprocessing
+
+import pandas as pd
+import pytest
+
+from data_generator import generate_realistic_loan_data
+from parquet_export import ParquetExporter
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def data():
+    return generate_realistic_loan_data(num_branches=5)
+
+
+def rows(manifest, table):
+    return manifest["tables"][table]["rows"]
+
+
+def read(exporter, manifest, table):
+    return pd.read_parquet(exporter.export_dir / manifest["snapshot_id"] / table)
+
+
+def test_second_snapshot_without_changes_is_empty(tmp_path, data):
+    exporter = ParquetExporter(tmp_path)
+    first = exporter.export_snapshot(data)
+    assert first["full"] and rows(first, "collections") == len(data["collections"])
+
+    second = exporter.export_snapshot(data)
+    assert not second["full"]
+    assert rows(second, "customers") == rows(second, "loans") == rows(second, "collections") == 0
+    assert rows(second, "branches") == len(data["branches"])
+
+
+def test_late_rows_and_status_changes_are_exported(tmp_path, data):
+    exporter = ParquetExporter(tmp_path)
+    exporter.export_snapshot(data)
+
+    collections = data["collections"]
+    # Dated on or before the latest collection already exported, and one far in the future
+    late = collections.iloc[[0, 0, 1]].copy()
+    late["collection_date"] = [collections["collection_date"].max(), "2020-01-01", "2031-06-30"]
+    loans = data["loans"].copy()
+    flipped = loans["loan_id"].iloc[3]
+    loans.loc[loans.index[3], "status"] = "overdue" if loans["status"].iloc[3] != "overdue" else "completed"
+    changed = {**data, "collections": pd.concat([collections, late], ignore_index=True), "loans": loans}
+
+    second = exporter.export_snapshot(changed)
+    assert rows(second, "collections") == 3
+    assert rows(second, "customers") == 0
+    assert read(exporter, second, "loans")["loan_id"].tolist() == [flipped]
+
+    # A future-dated row does not hold back rows added after it
+    newer = collections.iloc[[2]].copy()
+    newer["collection_date"] = "2021-01-01"
+    third = exporter.export_snapshot({**changed, "collections": pd.concat([changed["collections"], newer])})
+    assert rows(third, "collections") == 1 and rows(third, "loans") == 0
+
+
+def test_identical_collections_are_distinct_rows(tmp_path, data):
+    exporter = ParquetExporter(tmp_path)
+    exporter.export_snapshot(data)
+    duplicate = data["collections"].iloc[[5]]
+    second = exporter.export_snapshot({**data, "collections": pd.concat([data["collections"], duplicate])})
+    assert rows(second, "collections") == 1
+
+
+def test_full_export_starts_over(tmp_path, data):
+    exporter = ParquetExporter(tmp_path)
+    exporter.export_snapshot(data)
+    again = exporter.export_snapshot(data, full=True)
+    assert again["full"] and rows(again, "loans") == len(data["loans"])
+
+
+def _export_in_child(export_dir, data, results):
+    results.put(rows(ParquetExporter(export_dir).export_snapshot(data), "collections"))
+
+
+def test_concurrent_exports_from_two_processes_split_the_increment(tmp_path, data):
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [context.Process(target=_export_in_child, args=(tmp_path, data, results)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    counts = sorted(results.get(timeout=60) for _ in workers)
+    for worker in workers:
+        worker.join()
+    # One process exports everything, the other finds nothing new instead of exporting it all again
+    assert counts == [0, len(data["collections"])]
@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, Branch, Collection, Customer, Installment, Loan
+from repayment_schedule import RepaymentScheduleEngine
+
+AS_OF = datetime(2024, 6, 15)
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'schedule.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    branch = Branch(name="Thika", region="Central")
+    session.add(branch)
+    session.flush()
+    customer = Customer(customer_id="C1", name="Test Customer", branch_id=branch.id)
+    session.add(customer)
+    session.flush()
+    session.add_all([
+        Loan(loan_id="L1", customer_id=customer.id, branch_id=branch.id, disbursement_amount=900.0,
+             disbursement_date=datetime(2024, 1, 1), due_date=datetime(2024, 3, 31), status="active"),
+        # Paid off before the schedule ever ran
+        Loan(loan_id="L2", customer_id=customer.id, branch_id=branch.id, disbursement_amount=600.0,
+             disbursement_date=datetime(2024, 1, 1), due_date=datetime(2024, 3, 1), status="completed"),
+    ])
+    session.flush()
+    session.add(Collection(loan_id=2, branch_id=branch.id, amount=600.0, collection_date=datetime(2024, 2, 1)))
+    session.add(Collection(loan_id=1, branch_id=branch.id, amount=300.0, collection_date=datetime(2024, 2, 1)))
+    session.commit()
+    yield session
+    session.close()
+
+
+def paid(db, loan_id):
+    return db.execute(
+        select(Installment.amount_paid).where(Installment.loan_id == loan_id).order_by(Installment.installment_number)
+    ).scalars().all()
+
+
+def test_completed_loans_are_scheduled_and_refreshed(db):
+    engine = RepaymentScheduleEngine()
+    assert engine.rebuild(db)["loans_scheduled"] == 2
+    assert paid(db, 1) == [300.0, 0.0, 0.0]
+    assert paid(db, 2) == [300.0, 300.0]
+
+    # Nothing changed since the last run
+    assert engine.rebuild(db)["loans_scheduled"] == 0
+
+    # The final payment lands and the status job marks the loan completed
+    db.add(Collection(loan_id=1, branch_id=1, amount=600.0, collection_date=datetime(2024, 3, 30)))
+    db.execute(update(Loan).where(Loan.id == 1).values(status="completed"))
+    db.commit()
+    assert engine.rebuild(db)["loans_scheduled"] == 1
+    assert paid(db, 1) == [300.0, 300.0, 300.0]
+
+
+def test_database_and_in_memory_efficiency_have_the_same_shape(db):
+    engine = RepaymentScheduleEngine()
+    engine.rebuild(db)
+
+    from_db = engine.collection_efficiency_db(db, AS_OF)
+
+    loans = pd.DataFrame({
+        "loan_id": [1, 2], "branch": ["Thika", "Thika"], "disbursement_amount": [900.0, 600.0],
+        "disbursement_date": ["2024-01-01", "2024-01-01"], "due_date": ["2024-03-31", "2024-03-01"],
+    })
+    schedule = engine.allocate(engine.build_schedule(loans), pd.Series({1: 300.0, 2: 600.0}))
+    in_memory = engine.collection_efficiency(schedule, loans, "branch", AS_OF)
+
+    assert from_db == in_memory
+    assert list(from_db[0]) == list(in_memory[0])
+    assert from_db[0]["installments_due"] == 5 and from_db[0]["installments_missed"] == 2
@@ -0,0 +1,21 @@
+from bots.templates import message_templates
+
+BRANCH = {"branch": "Kisumu_North*", "total_disbursements": 1000.0, "total_collections": 900.0,
+          "total_arrears": 100.0, "collection_rate": 90.0, "customer_count": 12}
+
+
+def test_telegram_bold_values_are_not_backslash_escaped():
+    text = message_templates.render("branch_performance", "telegram", BRANCH)
+    # Escapes inside *...* show up literally in Telegram's legacy Markdown; the '*' would close the entity
+    assert "📍 *KISUMU_NORTH*" in text
+    alert = message_templates.render("alert", "telegram", {
+        "title": "Drop at Kisumu_North", "message": "Collections at Kisumu_North fell", "action": "Call *now*",
+    })
+    assert "*ALERT: DROP AT KISUMU_NORTH*" in alert
+    # Outside an entity, values are still escaped
+    assert "Collections at Kisumu\\_North fell" in alert and "Call \\*now\\*" in alert
+
+
+def test_whatsapp_values_are_sent_as_is():
+    text = message_templates.render("branch_performance", "whatsapp", {**BRANCH, "branch": "Kisumu_North"})
+    assert "*KISUMU_NORTH*" in text
@@ -0,0 +1,161 @@
+import asyncio
+import importlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from bots.rate_limit import TokenBucket, backoff_delay
+from bots.whatsapp_bot import WhatsAppBot
+from client_registry import client_registry
+
+# bots/__init__.py re-exports the whatsapp_bot instance under the module's name
+whatsapp_module = importlib.import_module("bots.whatsapp_bot")
+ACCOUNT_SID = "AC" + "0" * 32
+
+
+class _FakeTwilioHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        fake = self.server
+        form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        to = form["To"][0].removeprefix("whatsapp:")
+        with fake.lock:
+            fake.arrivals.append(time.monotonic())
+            fake.attempts[to] = fake.attempts.get(to, 0) + 1
+            fake.in_flight += 1
+            fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+            script = fake.scripts.get(to, [])
+            status = script.pop(0) if script else 201
+        try:
+            time.sleep(fake.delay)
+            if status == 201:
+                body = {"sid": f"SM{len(fake.arrivals):032d}", "to": form["To"][0], "status": "queued"}
+            else:
+                body = {"code": 20000 + status, "message": f"Fake error {status}", "status": status}
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with fake.lock:
+                fake.in_flight -= 1
+
+
+class FakeTwilio(ThreadingHTTPServer):
+    """Twilio Messages API stand-in; `scripts` maps a number to the statuses its next attempts get"""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _FakeTwilioHandler)
+        self.lock = threading.Lock()
+        self.delay = 0.0
+        self.scripts = {}
+        self.attempts = {}
+        self.arrivals = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+@pytest.fixture
+def twilio(monkeypatch):
+    server = FakeTwilio()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("TWILIO_ACCOUNT_SID", ACCOUNT_SID)
+    monkeypatch.setenv("TWILIO_AUTH_TOKEN", "test-token")
+    monkeypatch.setenv("TWILIO_API_BASE_URL", server.base_url)
+    asyncio.run(client_registry.reload(["twilio"]))
+    yield server
+    server.shutdown()
+    server.server_close()
+    for name in ("TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN", "TWILIO_API_BASE_URL"):
+        monkeypatch.delenv(name)
+    asyncio.run(client_registry.reload(["twilio"]))
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """Attempt numbers the bot backed off after; the sleeps themselves are shortened"""
+    requested = []
+
+    def fast_backoff(attempt):
+        requested.append(attempt)
+        return 0.01
+
+    monkeypatch.setattr(whatsapp_module, "backoff_delay", fast_backoff)
+    return requested
+
+
+def fast_bot() -> WhatsAppBot:
+    bot = WhatsAppBot()
+    bot.rate_limiter = TokenBucket(1000, capacity=1000)
+    return bot
+
+
+def test_throttling_and_server_errors_are_retried(twilio, backoffs):
+    twilio.scripts = {"+254700000001": [429, 503], "+254700000002": [400], "+254700000003": [500, 500, 500]}
+    recipients = [{"name": f"Staff {i}", "phone": f"+25470000000{i}"} for i in range(1, 5)]
+
+    results = fast_bot().send_bulk_messages(recipients, "Daily summary", max_retries=2)
+
+    assert [r["recipient"] for r in results] == ["Staff 1", "Staff 2", "Staff 3", "Staff 4"]
+    throttled, rejected, failing, clean = results
+    assert throttled["status"] == "success" and throttled["attempts"] == 3
+    # A 4xx other than 429 is the caller's fault and is not retried
+    assert rejected["status"] == "error" and rejected["attempts"] == 1
+    assert rejected["status_code"] == 400 and rejected["retryable"] is False
+    assert failing["status"] == "error" and failing["attempts"] == 3 and failing["retryable"] is True
+    assert clean["status"] == "success" and clean["attempts"] == 1
+    assert twilio.attempts == {"+254700000001": 3, "+254700000002": 1, "+254700000003": 3, "+254700000004": 1}
+    # One backoff before each retry: two for the throttled recipient, two for the failing one
+    assert sorted(backoffs) == [1, 1, 2, 2]
+
+
+def test_backoff_is_exponential_with_full_jitter():
+    random.seed(0)
+    for attempt, ceiling in ((1, 0.5), (2, 1.0), (3, 2.0), (10, 30.0)):
+        delays = [backoff_delay(attempt) for _ in range(200)]
+        assert all(0 <= delay <= ceiling for delay in delays)
+        # Jittered across the whole range rather than a fixed step
+        assert max(delays) - min(delays) > ceiling * 0.8
+
+
+def test_sends_respect_the_token_bucket_rate(twilio):
+    bot = WhatsAppBot()
+    bot.rate_limiter = TokenBucket(20, capacity=1)
+    recipients = [{"phone": f"+2547100000{i:02d}"} for i in range(11)]
+
+    results = bot.send_bulk_messages(recipients, "Rate limited", max_workers=8)
+
+    assert all(r["status"] == "success" for r in results)
+    arrivals = sorted(twilio.arrivals)
+    # 11 sends at 20/s with no burst allowance need at least 10 intervals of 50 ms
+    assert arrivals[-1] - arrivals[0] >= 0.45
+    for start in range(len(arrivals) - 4):
+        assert arrivals[start + 4] - arrivals[start] >= 0.15
+
+
+def test_worker_pool_bounds_concurrent_requests(twilio):
+    twilio.delay = 0.2
+    recipients = [{"phone": f"+2547200000{i:02d}"} for i in range(12)]
+
+    started = time.perf_counter()
+    results = fast_bot().send_bulk_messages(recipients, "Pooled", max_workers=3)
+
+    assert all(r["status"] == "success" for r in results)
+    assert twilio.max_in_flight == 3
+    # Four rounds of three, not twelve serial calls and not all twelve at once
+    assert 0.75 <= time.perf_counter() - started < 2.4
@@ -67,7 +67,7 @@ export default function Messaging({ API_URL }) {
       })
       
       if (response.ok) {
-        setMessage({ type: 'success', text: 'WhatsApp message sent successfully!' })
+        setMessage({ type: 'success', text: 'WhatsApp message queued for delivery!' })
       } else {
         const error = await response.json()
         setMessage({ type: 'error', text: error.detail || 'Failed to send message' })
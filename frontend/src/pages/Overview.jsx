@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts'
 import { TrendingUp, AlertTriangle, Users, Building2, DollarSign, CheckCircle2 } from 'lucide-react'
 
@@ -7,23 +7,42 @@ export default function Overview({ API_URL }) {
   const [branches, setBranches] = useState([])
   const [insights, setInsights] = useState([])
   const [loading, setLoading] = useState(true)
+  const insightsStream = useRef(null)
 
   useEffect(() => {
     fetchData()
     const interval = setInterval(fetchData, 30000)
-    return () => clearInterval(interval)
+    return () => {
+      clearInterval(interval)
+      insightsStream.current?.close()
+    }
   }, [])
 
+  // Rule-based insights arrive at once; AI insights replace them one by one as they stream in
+  const streamInsights = () => {
+    insightsStream.current?.close()
+    const source = new EventSource(`${API_URL}/api/ai/insights/stream`)
+    let streamed = []
+
+    source.addEventListener('fallback', (e) => setInsights(JSON.parse(e.data).insights))
+    source.addEventListener('insight', (e) => {
+      streamed = [...streamed, JSON.parse(e.data).text]
+      setInsights(streamed)
+    })
+    source.addEventListener('done', () => source.close())
+    source.onerror = () => source.close()
+    insightsStream.current = source
+  }
+
   const fetchData = async () => {
+    streamInsights()
     try {
-      const [summaryRes, branchesRes, insightsRes] = await Promise.all([
+      const [summaryRes, branchesRes] = await Promise.all([
         fetch(`${API_URL}/api/summary`),
-        fetch(`${API_URL}/api/branches`),
-        fetch(`${API_URL}/api/ai/insights`)
+        fetch(`${API_URL}/api/branches`)
       ])
       setSummary(await summaryRes.json())
       setBranches(await branchesRes.json())
-      setInsights((await insightsRes.json()).insights)
     } catch (err) {
       console.error('Error:', err)
     } finally {